@@ -0,0 +1,147 @@
+"""
+Shared analysis context for PowerPulse
+
+An AnalysisContext loads one window of battery history into NumPy columns
+once. Products derived from it (differences between consecutive rows,
+battery sessions, charging runs, per-day groupings and downsampled series)
+are computed the first time they are used and then kept, so statistics
+and every plot of the same window share a single load.
+"""
+
+from functools import cached_property
+
+import numpy as np
+
+from powerpulse.database import (
+    days_ago_epoch_ms, rollup_bucket, next_rollup_bucket, get_history_generation, MAX_SAMPLE_GAP_MS
+)
+from powerpulse.storage import get_backend
+from powerpulse.cache import cached
+
+COLUMNS = ('timestamp', 'percentage', 'is_charging', 'power_plugged')
+
+
+def runs(flags):
+    """Index pairs (start, end) of the runs of True in a boolean array
+
+    A run ends at the first row after it, or at the last row if it is
+    still going.
+    """
+    if not len(flags):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    starts = np.flatnonzero(flags & np.concatenate(([True], ~flags[:-1])))
+    ends = np.flatnonzero(~flags & np.concatenate(([False], flags[:-1])))
+    if len(ends) < len(starts):
+        ends = np.append(ends, len(flags) - 1)
+    return starts, ends
+
+
+class AnalysisContext:
+    """One window of battery history, loaded once
+
+    key identifies the loaded data the same way cache.data_key does, so
+    results computed from a context share the result cache with results
+    computed from a fresh load.
+    """
+
+    def __init__(self, days=7, history=None):
+        self.days = days
+        self.start = days_ago_epoch_ms(days)
+        backend = get_backend()
+        if history is None:
+            history = backend.read_range(self.start, columns=COLUMNS)
+
+        self.timestamps = np.asarray(history['timestamp'], dtype=np.int64)
+        self.percentages = np.asarray(history['percentage'], dtype=np.float64)
+        self.is_charging = np.asarray(history['is_charging'], dtype=bool)
+        self.power_plugged = np.asarray(history['power_plugged'], dtype=bool)
+        self._downsampled = {}
+
+        bounds = (int(self.timestamps[0]), int(self.timestamps[-1])) if len(self) else (None, None)
+        self.key = (backend.name, get_history_generation()) + bounds
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @cached_property
+    def time_diff(self):
+        """Milliseconds between each row and the next"""
+        return np.diff(self.timestamps)
+
+    @cached_property
+    def percentage_diff(self):
+        """Percentage change from each row to the next"""
+        return np.diff(self.percentages)
+
+    @cached_property
+    def sessions(self):
+        """(start, end) row indices of the sessions on battery
+
+        A session runs from the first discharging row to the row where
+        charging resumes, or to the last row.
+        """
+        return runs(~self.is_charging)
+
+    @cached_property
+    def charging_runs(self):
+        """(start, end) row indices of the charging periods"""
+        return runs(self.is_charging)
+
+    @cached_property
+    def daily(self):
+        """Per-day groupings, as rows shaped like get_battery_rollups(days, 'day')"""
+        valid = ~np.isnan(self.percentages)
+        timestamps = self.timestamps[valid]
+        if not len(timestamps):
+            return []
+        percentages = self.percentages[valid]
+        charging = self.is_charging[valid]
+        plugged = self.power_plugged[valid]
+
+        # Charging time is the gap since the previous sample, credited when
+        # the sample reports charging
+        gaps = np.diff(timestamps, prepend=timestamps[0])
+        charging_ms = np.where(charging & (gaps > 0) & (gaps <= MAX_SAMPLE_GAP_MS), gaps, 0)
+
+        # Local midnights covering the window
+        midnights = [rollup_bucket(int(timestamps[0]), 'day')]
+        while midnights[-1] <= timestamps[-1]:
+            midnights.append(next_rollup_bucket(midnights[-1] + 1, 'day'))
+        day = np.searchsorted(midnights, timestamps, side='right') - 1
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(day)) + 1))
+        lasts = np.append(starts[1:], len(timestamps)) - 1
+        samples = np.diff(np.append(starts, len(timestamps)))
+
+        return list(zip(
+            [midnights[i] for i in day[starts].tolist()],
+            timestamps[starts].tolist(),
+            timestamps[lasts].tolist(),
+            np.minimum.reduceat(percentages, starts).tolist(),
+            np.maximum.reduceat(percentages, starts).tolist(),
+            (np.add.reduceat(percentages, starts) / samples).tolist(),
+            percentages[lasts].tolist(),
+            samples.tolist(),
+            np.add.reduceat(charging.astype(np.int64), starts).tolist(),
+            np.add.reduceat(plugged.astype(np.int64), starts).tolist(),
+            np.add.reduceat(charging_ms, starts).tolist(),
+        ))
+
+    def downsampled(self, max_points):
+        """Evenly thinned columns with at most about max_points rows, last row kept"""
+        series = self._downsampled.get(max_points)
+        if series is None:
+            index = np.arange(len(self))
+            if len(self) > max_points:
+                index = np.unique(np.append(index[::len(self) // max_points], len(self) - 1))
+            series = self._downsampled[max_points] = {
+                'timestamp': self.timestamps[index],
+                'percentage': self.percentages[index],
+                'is_charging': self.is_charging[index],
+            }
+        return series
+
+
+@cached('context')
+def get_context(days=7):
+    """AnalysisContext for the last days, shared while the data is unchanged"""
+    return AnalysisContext(days)
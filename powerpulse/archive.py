@@ -0,0 +1,212 @@
+"""
+Long-term history archive for PowerPulse
+
+This module implements the compressed archive format used for cold battery
+history. An archive file holds the samples of one history partition in
+blocks of delta-encoded, zlib-compressed columns, followed by a block index
+so readers only decompress the blocks overlapping the requested range.
+
+File layout (little endian):
+
+    header   magic, version, block count, record count, index offset
+    blocks   zlib(timestamp deltas | percentage deltas | flags |
+                  temperature | remaining time)
+    index    first_ts, last_ts, offset, length, count per block
+"""
+
+import os
+import mmap
+import zlib
+import struct
+
+import numpy as np
+
+ARCHIVE_MAGIC = b'PPARCH01'
+ARCHIVE_VERSION = 1
+ARCHIVE_SUFFIX = '.ppa'
+
+# Samples per compressed block
+BLOCK_RECORDS = 4096
+
+HEADER = struct.Struct('<8sHHIQQ')
+INDEX_DTYPE = np.dtype([
+    ('first_ts', '<i8'),
+    ('last_ts', '<i8'),
+    ('offset', '<u8'),
+    ('length', '<u4'),
+    ('count', '<u4'),
+])
+
+FLAG_CHARGING = 1
+FLAG_PLUGGED = 2
+
+# Sentinels for missing values in the integer columns
+MISSING_TENTHS = np.iinfo(np.int16).min
+MISSING_SECONDS = -1
+
+# Column dtypes inside a block, in storage order
+_BLOCK_COLUMNS = (
+    ('timestamp', np.dtype('<i8')),
+    ('percentage', np.dtype('<i4')),
+    ('flags', np.dtype('u1')),
+    ('temperature', np.dtype('<i2')),
+    ('remaining_time', np.dtype('<i4')),
+)
+
+
+def _tenths(values):
+    """Float array to int16 tenths, with NaN mapped to MISSING_TENTHS"""
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    tenths = np.rint(np.where(missing, 0, values) * 10).astype(np.int16)
+    tenths[missing] = MISSING_TENTHS
+    return tenths
+
+
+def _encode_block(timestamp, percentage, is_charging, power_plugged, temperature, remaining_time):
+    """Encode one block of samples into compressed bytes"""
+    remaining = np.asarray(remaining_time, dtype=np.float64)
+    remaining = np.where(np.isnan(remaining), MISSING_SECONDS, np.rint(remaining)).astype('<i4')
+    flags = (np.asarray(is_charging, dtype=np.uint8) * FLAG_CHARGING
+             | np.asarray(power_plugged, dtype=np.uint8) * FLAG_PLUGGED)
+
+    # Delta-encode the slowly changing columns; the first value is kept as is
+    timestamp = np.asarray(timestamp, dtype='<i8')
+    percentage = _tenths(percentage).astype('<i4')
+
+    payload = b''.join((
+        np.diff(timestamp, prepend=0).astype('<i8').tobytes(),
+        np.diff(percentage, prepend=0).astype('<i4').tobytes(),
+        flags.astype('u1').tobytes(),
+        _tenths(temperature).astype('<i2').tobytes(),
+        remaining.tobytes(),
+    ))
+    return zlib.compress(payload, 9)
+
+
+def _decode_block(data, count):
+    """Decode a compressed block back into standard history arrays"""
+    payload = zlib.decompress(data)
+    columns = {}
+    offset = 0
+    for name, dtype in _BLOCK_COLUMNS:
+        size = count * dtype.itemsize
+        columns[name] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+        offset += size
+
+    percentage = np.cumsum(columns['percentage'])
+    temperature = columns['temperature']
+    remaining = columns['remaining_time']
+    flags = columns['flags']
+
+    return {
+        'timestamp': np.cumsum(columns['timestamp']),
+        'percentage': np.where(percentage == MISSING_TENTHS, np.nan, percentage / 10).astype(np.float32),
+        'is_charging': (flags & FLAG_CHARGING).astype(bool),
+        'power_plugged': (flags & FLAG_PLUGGED).astype(bool),
+        'temperature': np.where(temperature == MISSING_TENTHS, np.nan, temperature / 10).astype(np.float32),
+        'remaining_time': np.where(remaining == MISSING_SECONDS, np.nan, remaining).astype(np.float32),
+    }
+
+
+def write_archive(path, arrays):
+    """Write time-ordered history arrays to an archive file
+
+    arrays maps every history column to an equally long array. The file is
+    written under a temporary name, synced and then moved into place, so a
+    crash never leaves a truncated archive behind.
+    """
+    timestamps = np.asarray(arrays['timestamp'], dtype=np.int64)
+    total = len(timestamps)
+    index = np.zeros((total + BLOCK_RECORDS - 1) // BLOCK_RECORDS, dtype=INDEX_DTYPE)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+
+        for block, start in enumerate(range(0, total, BLOCK_RECORDS)):
+            end = min(start + BLOCK_RECORDS, total)
+            data = _encode_block(*(np.asarray(arrays[name])[start:end] for name in (
+                'timestamp', 'percentage', 'is_charging', 'power_plugged', 'temperature', 'remaining_time'
+            )))
+            index[block] = (timestamps[start], timestamps[end - 1], f.tell(), len(data), end - start)
+            f.write(data)
+
+        index_offset = f.tell()
+        f.write(index.tobytes())
+        f.seek(0)
+        f.write(HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, len(index), total, index_offset))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+class ArchiveFile:
+    """Memory-mapped reader for one archive file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, block_count, self.record_count, index_offset = HEADER.unpack_from(self._map, 0)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            self._map.close()
+            raise ValueError(f"Not a PowerPulse archive: {path}")
+
+        self.index = np.frombuffer(self._map, dtype=INDEX_DTYPE, count=block_count, offset=index_offset)
+
+    @property
+    def first_ts(self):
+        return int(self.index['first_ts'][0]) if len(self.index) else None
+
+    @property
+    def last_ts(self):
+        return int(self.index['last_ts'][-1]) if len(self.index) else None
+
+    def first_at_or_after(self, timestamp):
+        """Oldest sample timestamp at or after timestamp, decoding one block"""
+        block = int(np.searchsorted(self.index['last_ts'], timestamp, side='left'))
+        if block == len(self.index):
+            return None
+        entry = self.index[block]
+        offset, length = int(entry['offset']), int(entry['length'])
+        timestamps = _decode_block(self._map[offset:offset + length], int(entry['count']))['timestamp']
+        return int(timestamps[np.searchsorted(timestamps, timestamp, side='left')])
+
+    def read(self, start=None, end=None, columns=None):
+        """Read samples in [start, end) as a dict of history arrays"""
+        first = 0 if start is None else int(np.searchsorted(self.index['last_ts'], start, side='left'))
+        last = len(self.index) if end is None else int(np.searchsorted(self.index['first_ts'], end, side='left'))
+
+        blocks = []
+        for entry in self.index[first:last]:
+            offset, length = int(entry['offset']), int(entry['length'])
+            block = _decode_block(self._map[offset:offset + length], int(entry['count']))
+
+            mask = np.ones(len(block['timestamp']), dtype=bool)
+            if start is not None:
+                mask &= block['timestamp'] >= start
+            if end is not None:
+                mask &= block['timestamp'] < end
+            blocks.append({name: values[mask] for name, values in block.items()})
+
+        names = columns or ('timestamp', 'percentage', 'is_charging', 'power_plugged', 'temperature', 'remaining_time')
+        if not blocks:
+            empty = _decode_block(zlib.compress(b''), 0)
+            return {name: empty[name] for name in names}
+        return {name: np.concatenate([block[name] for block in blocks]) for name in names}
+
+    def close(self):
+        """Release the memory map"""
+        # The index is a view into the map and must be dropped first
+        self.index = None
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
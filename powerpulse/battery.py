@@ -9,126 +9,320 @@ import os
 import sys
 import subprocess
 
-# Cross-platform battery info
-if sys.platform == 'win32':
-    import psutil
-elif sys.platform == 'darwin':  # macOS
-    pass  # Import handled at function level
-elif sys.platform == 'linux':
-    pass  # Import handled at function level
-else:
+# Platform libraries are imported by the providers that use them
+if sys.platform not in ('win32', 'darwin', 'linux'):
     print(f"Unsupported platform: {sys.platform}")
     sys.exit(1)
 
 
 def get_battery_info():
-    """Get current battery information based on platform"""
-    if sys.platform == 'win32':
-        return get_battery_info_windows()
-    elif sys.platform == 'darwin':
-        return get_battery_info_macos()
-    elif sys.platform == 'linux':
-        return get_battery_info_linux()
-    return None
+    """Get current battery information from the best available provider"""
+    from powerpulse.providers import get_registry
+    return get_registry().read()
 
 
-def get_battery_info_linux():
-    """Get battery information on Linux using system commands"""
-    try:
-        # Try using upower for more detailed info
-        battery_path = None
-        try:
-            devices = subprocess.check_output(['upower', '--enumerate'], text=True).strip().split('\n')
-            for device in devices:
-                if 'battery' in device.lower():
-                    battery_path = device
-                    break
-            
-            if battery_path:
-                info = subprocess.check_output(['upower', '--show-info', battery_path], text=True)
-                
-                percentage = None
-                percentage_line = [l for l in info.split('\n') if 'percentage' in l.lower()]
-                if percentage_line:
-                    percentage = float(percentage_line[0].split(':')[1].strip().rstrip('%'))
-                
-                state = None
-                state_line = [l for l in info.split('\n') if 'state' in l.lower()]
-                if state_line:
-                    state = state_line[0].split(':')[1].strip()
-                
-                is_charging = state == 'charging'
-                power_plugged = state in ('charging', 'fully-charged')
-                
-                temp = None
-                temp_line = [l for l in info.split('\n') if 'temperature' in l.lower()]
-                if temp_line:
-                    temp = float(temp_line[0].split(':')[1].strip().split(' ')[0])
-                
-                time_remaining = None
-                time_line = [l for l in info.split('\n') if 'time to empty' in l.lower()]
-                if time_line and not is_charging:
-                    time_str = time_line[0].split(':')[1].strip()
-                    if 'hours' in time_str and 'minutes' in time_str:
-                        hours = float(time_str.split('hours')[0].strip())
-                        minutes = float(time_str.split('hours')[1].split('minutes')[0].strip())
-                        time_remaining = hours * 3600 + minutes * 60
-                
-                return {
-                    'percentage': percentage,
-                    'is_charging': is_charging,
-                    'power_plugged': power_plugged,
-                    'temperature': temp,
-                    'remaining_time': time_remaining
-                }
-        except Exception:
-            # Fallback to /sys/class/power_supply/
-            path = '/sys/class/power_supply/BAT0'
-            if not os.path.exists(path):
-                path = '/sys/class/power_supply/BAT1'
-                if not os.path.exists(path):
-                    return None
-            
-            with open(f"{path}/capacity", 'r') as f:
-                percentage = float(f.read().strip())
-            
-            with open(f"{path}/status", 'r') as f:
-                status = f.read().strip()
-            
-            is_charging = status.lower() == 'charging'
-            power_plugged = status.lower() in ('charging', 'full')
+# Kernel power supply class directory on Linux
+POWER_SUPPLY_ROOT = '/sys/class/power_supply'
+
+
+class SysfsBatteryReader:
+    """Battery reader for the Linux power_supply class in sysfs
+
+    Supplies are discovered once; the attribute files of every battery and
+    adapter stay open and are re-read with pread, so a sample costs a few
+    system calls and no process spawns.
+    """
+
+    # Battery attributes read when present, all reported by the kernel as
+    # integers (micro-units, tenths of a degree) except status
+    BATTERY_ATTRIBUTES = (
+        'status', 'capacity', 'temp', 'cycle_count',
+        'energy_now', 'energy_full', 'power_now', 'voltage_now',
+        'charge_now', 'charge_full', 'current_now',
+    )
+
+    def __init__(self, root=POWER_SUPPLY_ROOT):
+        self.root = root
+        self.batteries = []
+        self.adapters = []
+        self._discovered = False
+
+    def discover(self):
+        """Find batteries and adapters and open their attribute files"""
+        self.close()
+        
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            supply_type = self._read_file(os.path.join(path, 'type'))
             
-            # Temperature might be in different locations
-            temp = None
-            temp_path = f"{path}/temp"
-            if os.path.exists(temp_path):
-                with open(temp_path, 'r') as f:
-                    temp = float(f.read().strip()) / 10.0  # Usually in tenths of degrees
+            if supply_type == 'Battery':
+                # Skip peripheral batteries (mice, keyboards, headsets)
+                if self._read_file(os.path.join(path, 'scope')) == 'Device':
+                    continue
+                files = {}
+                for attribute in self.BATTERY_ATTRIBUTES:
+                    try:
+                        files[attribute] = os.open(os.path.join(path, attribute), os.O_RDONLY)
+                    except OSError:
+                        pass
+                if 'capacity' in files or 'energy_now' in files or 'charge_now' in files:
+                    self.batteries.append(files)
+                else:
+                    self._close_files(files)
+            elif supply_type is not None:
+                try:
+                    self.adapters.append(os.open(os.path.join(path, 'online'), os.O_RDONLY))
+                except OSError:
+                    pass
+        
+        self._discovered = True
+        return bool(self.batteries)
+
+    @staticmethod
+    def _read_file(path):
+        try:
+            with open(path, 'r') as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    @staticmethod
+    def _pread(fd):
+        return os.pread(fd, 64, 0).decode('ascii', 'replace').strip()
+
+    def _read_battery(self, files):
+        """Read every open attribute of one battery"""
+        values = {}
+        for attribute, fd in files.items():
+            try:
+                raw = self._pread(fd)
+            except OSError:
+                # Some attributes fail transiently (ENODATA) on certain firmware
+                continue
+            if attribute == 'status':
+                values[attribute] = raw
+            else:
+                try:
+                    values[attribute] = int(raw)
+                except ValueError:
+                    pass
+        return values
+
+    def read(self):
+        """Read the combined state of all batteries
+        
+        Returns the usual battery info dict plus energy_now (Wh), power_now
+        (W), voltage_now (V) and cycle_count when the kernel reports them,
+        or None if there is no battery. Raises OSError if a supply vanished,
+        in which case discover() should be run again.
+        """
+        if not self._discovered:
+            self.discover()
+        if not self.batteries:
+            return None
+        
+        batteries = [self._read_battery(files) for files in self.batteries]
+        statuses = [battery.get('status', 'Unknown') for battery in batteries]
+        is_charging = 'Charging' in statuses
+        
+        if self.adapters:
+            power_plugged = any(self._pread(fd) == '1' for fd in self.adapters)
+        else:
+            power_plugged = any(status in ('Charging', 'Full', 'Not charging') for status in statuses)
+        
+        # Level, capacity and rate in one unit family, so they can be divided
+        energy_now, energy_full, power_now = self._energy(batteries)
+        
+        if len(batteries) == 1 and 'capacity' in batteries[0]:
+            percentage = float(batteries[0]['capacity'])
+        elif energy_now is not None and energy_full:
+            # Weight several batteries by the energy they hold
+            percentage = min(100.0, 100.0 * energy_now / energy_full)
+        else:
+            capacities = [battery['capacity'] for battery in batteries if 'capacity' in battery]
+            if not capacities:
+                return None
+            percentage = float(sum(capacities)) / len(capacities)
+        
+        remaining_time = None
+        if power_now and energy_now is not None:
+            if is_charging and energy_full:
+                remaining_time = max(0, energy_full - energy_now) / power_now * 3600
+            elif not power_plugged:
+                remaining_time = energy_now / power_now * 3600
+        
+        temps = [battery['temp'] / 10.0 for battery in batteries if 'temp' in battery]
+        
+        info = {
+            'percentage': round(percentage, 1),
+            'is_charging': is_charging,
+            'power_plugged': power_plugged,
+            'temperature': max(temps) if temps else None,
+            'remaining_time': remaining_time,
+        }
+        
+        if all('energy_now' in battery for battery in batteries):
+            info['energy_now'] = sum(battery['energy_now'] for battery in batteries) / 1e6
+        watts = self._watts(batteries)
+        if watts is not None:
+            info['power_now'] = watts
+        voltages = [battery['voltage_now'] / 1e6 for battery in batteries if 'voltage_now' in battery]
+        if voltages:
+            info['voltage_now'] = voltages[0]
+        cycles = [battery['cycle_count'] for battery in batteries if 'cycle_count' in battery]
+        if cycles:
+            info['cycle_count'] = max(cycles)
+        
+        return info
+
+    def read_power(self):
+        """Read just the power draw, for high-frequency capture
+        
+        Returns (watts, is_charging); watts is None if the kernel reports
+        neither power_now nor current_now and voltage_now, or a supply
+        vanished (e.g. a battery was removed), which closes the reader so the
+        next call discovers the supplies again.
+        """
+        try:
+            if not self._discovered:
+                self.discover()
             
-            return {
-                'percentage': percentage,
-                'is_charging': is_charging,
-                'power_plugged': power_plugged,
-                'temperature': temp,
-                'remaining_time': None  # Would need additional calculation
-            }
-    except Exception as e:
-        print(f"Error getting battery info: {e}")
-    return None
+            batteries = []
+            charging = False
+            for files in self.batteries:
+                values = {}
+                for attribute in ('power_now', 'current_now', 'voltage_now', 'status'):
+                    if attribute in files:
+                        raw = self._pread(files[attribute])
+                        try:
+                            values[attribute] = raw if attribute == 'status' else int(raw)
+                        except ValueError:
+                            # Read while the kernel was updating it
+                            pass
+                charging = charging or values.get('status') == 'Charging'
+                batteries.append(values)
+        except OSError:
+            self.close()
+            return None, False
+        return self._watts(batteries), charging
+
+    @staticmethod
+    def _watts(batteries):
+        """Total power in watts from power_now, or current_now times voltage_now"""
+        if not batteries:
+            return None
+        total = 0
+        for battery in batteries:
+            if 'power_now' in battery:
+                total += abs(battery['power_now'])
+            elif 'current_now' in battery and 'voltage_now' in battery:
+                total += abs(battery['current_now']) * battery['voltage_now'] / 1e6
+            else:
+                return None
+        return total / 1e6
 
+    @staticmethod
+    def _energy(batteries):
+        """(now, full, rate) summed over all batteries in a single unit family
 
-def get_battery_info_windows():
-    """Get battery information on Windows using psutil"""
+        Energy (µWh, µW) is preferred, converting charge and current through
+        voltage_now where a battery reports those instead; otherwise charge
+        (µAh, µA). The family that gives both a level and a rate wins, so a
+        level is never divided by a rate of the other family. A value some
+        battery cannot give in the chosen family is None.
+        """
+        def energy(battery, attribute, fallback):
+            if attribute in battery:
+                return abs(battery[attribute])
+            if fallback in battery and battery.get('voltage_now'):
+                return abs(battery[fallback]) * battery['voltage_now'] / 1e6
+            return None
+
+        def charge(battery, attribute):
+            return abs(battery[attribute]) if attribute in battery else None
+
+        def total(values):
+            return None if any(value is None for value in values) else sum(values)
+
+        families = (
+            [(energy(b, 'energy_now', 'charge_now'), energy(b, 'energy_full', 'charge_full'),
+              energy(b, 'power_now', 'current_now')) for b in batteries],
+            [(charge(b, 'charge_now'), charge(b, 'charge_full'), charge(b, 'current_now')) for b in batteries],
+        )
+        totals = [tuple(total(values) for values in zip(*family)) for family in families]
+        for now, full, rate in totals:
+            if now is not None and rate is not None:
+                return now, full, rate
+        for now, full, rate in totals:
+            if now is not None:
+                return now, full, None
+        return None, None, None
+
+    @staticmethod
+    def _close_files(files):
+        for fd in files.values():
+            os.close(fd)
+
+    def close(self):
+        """Close every open attribute file"""
+        for files in self.batteries:
+            self._close_files(files)
+        for fd in self.adapters:
+            os.close(fd)
+        self.batteries = []
+        self.adapters = []
+        self._discovered = False
+
+
+def get_battery_info_upower():
+    """Get battery information on Linux using upower"""
     try:
-        battery = psutil.sensors_battery()
-        if battery:
-            return {
-                'percentage': battery.percent,
-                'is_charging': battery.power_plugged and battery.percent < 100,
-                'power_plugged': battery.power_plugged,
-                'temperature': None,  # Not directly available via psutil
-                'remaining_time': battery.secsleft if battery.secsleft != -1 else None
-            }
+        battery_path = None
+        devices = subprocess.check_output(['upower', '--enumerate'], text=True).strip().split('\n')
+        for device in devices:
+            if 'battery' in device.lower():
+                battery_path = device
+                break
+        
+        if not battery_path:
+            return None
+        
+        info = subprocess.check_output(['upower', '--show-info', battery_path], text=True)
+        
+        # Parse the "key: value" lines in a single pass
+        fields = {}
+        for line in info.split('\n'):
+            key, sep, value = line.partition(':')
+            if sep:
+                fields.setdefault(key.strip().lower(), value.strip())
+        
+        percentage = None
+        if 'percentage' in fields:
+            percentage = float(fields['percentage'].rstrip('%'))
+        
+        state = fields.get('state')
+        is_charging = state == 'charging'
+        power_plugged = state in ('charging', 'fully-charged')
+        
+        temp = None
+        if 'temperature' in fields:
+            temp = float(fields['temperature'].split(' ')[0])
+        
+        time_remaining = None
+        time_str = fields.get('time to empty')
+        if time_str and not is_charging:
+            amount, _, unit = time_str.partition(' ')
+            seconds_per_unit = {'hours': 3600, 'minutes': 60, 'seconds': 1}
+            if unit in seconds_per_unit:
+                time_remaining = float(amount.replace(',', '.')) * seconds_per_unit[unit]
+        
+        return {
+            'percentage': percentage,
+            'is_charging': is_charging,
+            'power_plugged': power_plugged,
+            'temperature': temp,
+            'remaining_time': time_remaining
+        }
     except Exception as e:
         print(f"Error getting battery info: {e}")
     return None
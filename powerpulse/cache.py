@@ -0,0 +1,185 @@
+"""
+Result cache for PowerPulse
+
+Statistics and plot data are functions of the history in their window, so
+this module memoizes them under (function, window, data key). The data key
+names the history a result was computed from: the storage backend, its
+rewrite generation and the first and newest sample in the window. A new
+sample, or the window sliding past its oldest sample, changes the key;
+repeated views over unchanged data are served from memory. Entries are
+evicted least recently used once their estimated size passes a cap.
+
+The CLI persists the cache to disk so consecutive runs share it.
+"""
+
+import os
+import sys
+import pickle
+import threading
+import functools
+from collections import OrderedDict
+
+import numpy as np
+
+from powerpulse import diag
+from powerpulse.database import APP_DATA_DIR, days_ago_epoch_ms, get_history_generation
+from powerpulse.storage import get_backend
+
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+CACHE_FILENAME = 'result_cache.pickle'
+
+# Bumped whenever cached result shapes change, to ignore older cache files
+CACHE_FORMAT = 2
+
+_MISSING = object()
+
+
+def estimate_size(value):
+    """Approximate memory held by a cached value, in bytes"""
+    if isinstance(value, np.ndarray):
+        return sys.getsizeof(value) + (0 if value.base is None else value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if hasattr(value, '__dict__'):
+        return sys.getsizeof(value) + estimate_size(vars(value))
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """Size-capped LRU mapping of result keys to values
+
+    Cached values are shared between callers and must not be modified.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (value, size)
+        self._bytes = 0
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                diag.count('cache.miss')
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            diag.count('cache.hit')
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+            self._changed = True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._changed = True
+
+    def info(self):
+        """Entry count, estimated bytes and hit/miss counts"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def load(self, path):
+        """Add the entries saved at path, if it holds a readable cache"""
+        try:
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"Error loading result cache: {e}")
+            return False
+        if not isinstance(saved, dict) or saved.get('format') != CACHE_FORMAT:
+            return False
+        for key, value in saved['entries']:
+            self.put(key, value)
+        with self._lock:
+            self._changed = False
+        return True
+
+    def save(self, path):
+        """Write the entries to path if they changed since the last load or save"""
+        with self._lock:
+            if not self._changed:
+                return False
+            entries = [(key, value) for key, (value, size) in self._entries.items()]
+            self._changed = False
+
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'format': CACHE_FORMAT, 'entries': entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error saving result cache: {e}")
+            return False
+        return True
+
+
+_cache = ResultCache()
+
+
+def get_cache():
+    """The process-wide result cache"""
+    return _cache
+
+
+def cache_path():
+    return os.path.join(APP_DATA_DIR, CACHE_FILENAME)
+
+
+def data_key(days):
+    """Identifies the stored history in the window of the last days"""
+    backend = get_backend()
+    first, last = backend.bounds(days_ago_epoch_ms(days))
+    return backend.name, get_history_generation(), first, last
+
+
+def cached(name):
+    """Memoize a function of a window in days against the data in the window
+
+    When the function is given an analysis context, the context's key
+    stands in for the data key.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(days=7, context=None):
+            args = (days,) if context is None else (days, context)
+            if not _cache.enabled:
+                return func(*args)
+            key = (name, days) + (data_key(days) if context is None else context.key)
+            value = _cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = func(*args)
+                _cache.put(key, value)
+            return value
+        return wrapper
+    return decorate
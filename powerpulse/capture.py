@@ -0,0 +1,228 @@
+"""
+High-frequency power capture for PowerPulse
+
+This module samples the battery's power draw at 1 Hz or faster into a
+fixed-size in-memory ring buffer. Only one summary row per window (mean,
+95th percentile and maximum watts) is written to the database; the raw
+samples stay in memory and are written out only when a dump is requested.
+"""
+
+import time
+import sqlite3
+import threading
+
+import numpy as np
+
+from powerpulse import battery
+from powerpulse.database import now_epoch_ms, save_power_summaries
+
+CAPTURE_RATE = 1.0          # samples per second
+RING_CAPACITY = 3600        # samples kept in memory (one hour at 1 Hz)
+SUMMARY_WINDOW = 60         # seconds summarized into one stored row
+SUMMARY_FLUSH_WINDOWS = 5   # summaries written per transaction
+
+POWER_SAMPLE_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('watts', '<f4'),
+    ('charging', '?'),
+])
+
+
+class PowerRingBuffer:
+    """Fixed-size buffer holding the most recent power samples"""
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self._data = np.zeros(capacity, dtype=POWER_SAMPLE_DTYPE)
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def append(self, timestamp, watts, charging):
+        """Add a sample, overwriting the oldest once the buffer is full"""
+        with self._lock:
+            self._data[self._next] = (timestamp, watts, charging)
+            self._next = (self._next + 1) % len(self._data)
+            self._count = min(self._count + 1, len(self._data))
+
+    def snapshot(self, start=None, end=None):
+        """Copy of the buffered samples in [start, end), oldest first"""
+        with self._lock:
+            if self._count < len(self._data):
+                data = self._data[:self._count].copy()
+            else:
+                data = np.concatenate((self._data[self._next:], self._data[:self._next]))
+
+        timestamps = data['timestamp']
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+        hi = len(data) if end is None else int(np.searchsorted(timestamps, end, side='left'))
+        return data[lo:hi]
+
+    def __len__(self):
+        return self._count
+
+
+def summarize(samples):
+    """Mean, 95th percentile and maximum watts of power samples"""
+    watts = samples['watts'][np.isfinite(samples['watts'])]
+    if not len(watts):
+        return None, None, None
+    return float(watts.mean()), float(np.percentile(watts, 95)), float(watts.max())
+
+
+def default_power_source():
+    """Fastest available power reader: sysfs, else the battery provider"""
+    reader = battery.SysfsBatteryReader()
+    try:
+        if reader.discover():
+            return reader.read_power
+    except OSError:
+        pass
+
+    def read_provider():
+        info = battery.get_battery_info()
+        if not info:
+            return None, False
+        return info.get('power_now'), info['is_charging']
+    return read_provider
+
+
+_active_capture = None
+
+
+def get_active_capture():
+    """The capture running in this process, if any"""
+    return _active_capture
+
+
+class PowerCapture:
+    """Samples power draw into a ring buffer and stores window summaries
+
+    source is a callable returning (watts, is_charging); by default power
+    is read from sysfs, or from the battery provider's power_now.
+    """
+
+    def __init__(self, rate=CAPTURE_RATE, capacity=RING_CAPACITY, window=SUMMARY_WINDOW, source=None):
+        if capacity < rate * window:
+            raise ValueError("Capture buffer must hold at least one summary window")
+        self.interval = 1.0 / rate
+        self.window_ms = int(window * 1000)
+        self.buffer = PowerRingBuffer(capacity)
+        self.source = source or default_power_source()
+        self.samples = 0
+        self.summaries_written = 0
+        self._window_start = None
+        self._pending = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample_once(self, timestamp=None):
+        """Read the power draw once into the buffer; returns the watts read"""
+        try:
+            watts, charging = self.source()
+        except (OSError, ValueError) as e:
+            print(f"Error reading power draw: {e}")
+            watts, charging = None, False
+
+        timestamp = timestamp or now_epoch_ms()
+        if self._window_start is None:
+            self._window_start = timestamp - timestamp % self.window_ms
+        elif timestamp >= self._window_start + self.window_ms:
+            self._close_window()
+            self._window_start = timestamp - timestamp % self.window_ms
+
+        self.buffer.append(timestamp, np.nan if watts is None else watts, charging)
+        self.samples += 1
+        return watts
+
+    def _close_window(self):
+        """Summarize the current window and queue it for storage"""
+        start = self._window_start
+        samples = self.buffer.snapshot(start, start + self.window_ms)
+        if len(samples):
+            mean, p95, peak = summarize(samples)
+            self._pending.append((
+                start, start + self.window_ms, len(samples), mean, p95, peak, int(samples['charging'].sum())
+            ))
+        if len(self._pending) >= SUMMARY_FLUSH_WINDOWS:
+            self.flush()
+
+    def flush(self):
+        """Write queued window summaries to the database"""
+        try:
+            self.summaries_written += save_power_summaries(self._pending)
+            self._pending = []
+        except sqlite3.Error as e:
+            print(f"Error saving power summaries: {e}")
+
+    def unsummarized(self, start=None):
+        """Buffered samples at or after start not yet stored as a window summary
+
+        That is the open window and the closed windows still queued for
+        storage; callers drop samples older than the newest stored window,
+        which a concurrent flush may have written meanwhile.
+        """
+        # Read once; the capture thread replaces both
+        pending, window_start = self._pending, self._window_start
+        if pending:
+            window_start = pending[0][0]
+        if window_start is None:
+            return np.empty(0, dtype=POWER_SAMPLE_DTYPE)
+        return self.buffer.snapshot(window_start if start is None else max(start, window_start))
+
+    def live_summary(self, seconds=SUMMARY_WINDOW):
+        """Mean, p95 and max watts over the last seconds of the buffer"""
+        return summarize(self.buffer.snapshot(now_epoch_ms() - int(seconds * 1000)))
+
+    def dump(self, path):
+        """Write the raw buffered samples to a .npy or .csv file"""
+        samples = self.buffer.snapshot()
+        if path.endswith('.csv'):
+            np.savetxt(path, np.column_stack((samples['timestamp'], samples['watts'], samples['charging'])),
+                       fmt=('%d', '%.3f', '%d'), delimiter=',', header='timestamp,watts,charging', comments='')
+        else:
+            np.save(path, samples)
+        return len(samples)
+
+    def run(self, duration=None):
+        """Capture on a fixed schedule until stop() or duration seconds"""
+        global _active_capture
+
+        _active_capture = self
+        started = deadline = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                if duration is not None and now - started >= duration:
+                    break
+                if now >= deadline:
+                    self.sample_once()
+                    deadline += self.interval
+                    if deadline <= now:
+                        deadline = now + self.interval
+                self._stop.wait(max(0, deadline - time.monotonic()))
+        finally:
+            # Store the partial last window too
+            if self._window_start is not None:
+                self._close_window()
+                self._window_start = None
+            self.flush()
+            if _active_capture is self:
+                _active_capture = None
+
+    def start(self, duration=None):
+        """Capture in a background thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, args=(duration,), daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        """Stop capturing and store the remaining summaries"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
@@ -6,37 +6,96 @@ This module implements the command-line interface for the application.
 
 import os
 import sys
+import json
 import time
+import shutil
+import atexit
+import signal
 import argparse
 import threading
 
+from powerpulse import diag
 from powerpulse.battery import get_battery_info
 from powerpulse.database import (
-    setup_database, save_battery_info, get_notification_settings,
-    update_notification_setting, clear_old_history
+    setup_database, get_notification_settings, update_notification_setting,
+    DB_PATH, archive_old_history, convert_history_layout, HISTORY_LAYOUTS, days_ago_epoch_ms, from_epoch_ms
 )
-from powerpulse.stats import calculate_statistics, generate_history_plot
+from powerpulse.storage import get_backend, set_backend, BACKENDS
+from powerpulse.providers import get_registry, set_provider, PROVIDERS
+from powerpulse.stats import (
+    calculate_statistics, calculate_power_statistics, generate_history_plot, generate_power_plot,
+    generate_daily_usage_plot, session_statistics
+)
+from powerpulse.running_stats import get_running_statistics, running_statistics
+from powerpulse.cache import get_cache, cache_path
+from powerpulse.synthetic import generate_trace, save_trace, write_sysfs_tree, trace_reading, ReplayProvider
+from powerpulse.capture import PowerCapture, CAPTURE_RATE, SUMMARY_WINDOW, RING_CAPACITY
 from powerpulse.notifications import check_notifications
+from powerpulse.events import open_listener, EVENT_POLL_INTERVAL
+from powerpulse.service import MonitoringService, query_service
+from powerpulse.sampling import (
+    Sampler, AdaptiveSampler, store_reading, DEFAULT_DEADBAND, HEARTBEAT_INTERVAL
+)
 from powerpulse.gui import launch_gui
 
 
+def monitoring_interval(args):
+    """Polling interval for monitor and service, longer when sampling on events"""
+    if args.interval is not None:
+        return args.interval
+    return EVENT_POLL_INTERVAL if getattr(args, 'events', False) else args.default_interval
+
+
+def make_sampler(args):
+    """Build the sampler for monitor and service from their options"""
+    interval = monitoring_interval(args)
+    listener = open_listener() if getattr(args, 'events', False) else None
+    adaptive = None
+    if getattr(args, 'adaptive', False):
+        adaptive = AdaptiveSampler(interval, deadband=args.deadband, heartbeat=args.heartbeat)
+    
+    return Sampler(interval, adaptive=adaptive, listener=listener)
+
+
 def cli_monitor(args):
     """CLI monitoring mode"""
     setup_database()
     
+    sampler = make_sampler(args)
+    sampler.subscribe(store_reading, stored_only=True)
+    sampler.subscribe(check_notifications)
+    sampler.subscribe(lambda info: print(
+        f"\rBattery: {info['percentage']}% - {'Charging' if info['is_charging'] else 'Discharging'}", end=''
+    ))
+    
     print(f"PowerPulse Battery Monitor")
-    print(f"Monitoring every {args.interval} seconds. Press Ctrl+C to exit.")
+    if sampler.listener:
+        print(f"Sampling on power supply events, polling every {sampler.interval} seconds. Press Ctrl+C to exit.")
+    else:
+        print(f"Monitoring every {sampler.interval} seconds. Press Ctrl+C to exit.")
     
     try:
-        while True:
-            info = get_battery_info()
-            if info:
-                save_battery_info(info)
-                check_notifications(info)
-                print(f"\rBattery: {info['percentage']}% - {'Charging' if info['is_charging'] else 'Discharging'}", end='')
-            time.sleep(args.interval)
+        sampler.run()
     except KeyboardInterrupt:
         print("\nMonitoring stopped.")
+    finally:
+        sampler.stop()
+        get_backend().flush()
+
+
+def power_statistics(days):
+    """Captured power statistics, with the live buffer of a capturing service
+    
+    A capture running in the service keeps its newest samples in memory, so
+    they are asked from the service's endpoint when it is reachable.
+    """
+    try:
+        response = query_service({'query': 'power', 'days': days}, timeout=2)
+        if 'error' not in response:
+            return response
+    except (OSError, ValueError):
+        pass
+    return calculate_power_statistics(days)
 
 
 def cli_stats(args):
@@ -44,7 +103,8 @@ def cli_stats(args):
     setup_database()
     
     days = args.days
-    stats = calculate_statistics(days)
+    stats = running_statistics(days)
+    get_running_statistics().save()
     
     print(f"\nBattery Statistics (Last {days} days)")
     print(f"----------------------------------------")
@@ -71,6 +131,19 @@ def cli_stats(args):
         print(f"Longest Battery Session: {stats['longest_session']:.2f} hours")
     else:
         print(f"Longest Battery Session: No data")
+    
+    if stats['median_session'] is not None:
+        print(f"Median Battery Session: {stats['median_session']:.2f} hours")
+    else:
+        print(f"Median Battery Session: No data")
+    
+    power = power_statistics(days)
+    if power['average_power'] is not None:
+        print(f"\nPower Draw (captured)")
+        print(f"----------------------------------------")
+        print(f"Average Power: {power['average_power']:.2f} W")
+        print(f"Highest Window p95: {power['peak_window_p95']:.2f} W")
+        print(f"Maximum Power: {power['max_power']:.2f} W")
 
 
 def cli_plot(args):
@@ -78,18 +151,90 @@ def cli_plot(args):
     setup_database()
     
     days = args.days
-    fig = generate_history_plot(days)
+    if getattr(args, 'power', False):
+        fig = generate_power_plot(days)
+    else:
+        fig = generate_history_plot(days)
     
     if fig:
-        print(f"Generating battery history plot for the last {days} days...")
+        print(f"Generating {'power draw' if getattr(args, 'power', False) else 'battery history'} plot for the last {days} days...")
         import matplotlib.pyplot as plt
         plt.show()
     else:
         print(f"No data available for the specified period.")
 
 
+def cli_sessions(args):
+    """List charging and discharging sessions"""
+    setup_database()
+    
+    days = args.days
+    sessions = get_backend().read_sessions(days_ago_epoch_ms(days))
+    if not sessions:
+        print(f"No data available for the specified period.")
+        return
+    
+    print(f"\nSessions (Last {days} days)")
+    print(f"{'Start':<17} {'End':<17} {'State':<12} {'Battery %':>14} {'Hours':>7} {'Energy':>9}")
+    for start_ts, end_ts, is_charging, start_pct, end_pct, samples, full_charges, energy_wh in sessions[-args.limit:]:
+        levels = f"{start_pct:.0f} -> {end_pct:.0f}" if start_pct is not None and end_pct is not None else "-"
+        energy = f"{energy_wh:.1f} Wh" if energy_wh is not None else "-"
+        print(f"{from_epoch_ms(start_ts):%Y-%m-%d %H:%M} {from_epoch_ms(end_ts):%Y-%m-%d %H:%M} "
+              f"{'Charging' if is_charging else 'Battery':<12} {levels:>14} "
+              f"{(end_ts - start_ts) / 3600000:>7.2f} {energy:>9}")
+    
+    stats = session_statistics(days)
+    print(f"\nBattery Sessions: {stats['battery_sessions']}")
+    if stats['median_session'] is not None:
+        print(f"Median Battery Session: {stats['median_session']:.2f} hours")
+        print(f"Longest Battery Session: {stats['longest_session']:.2f} hours")
+
+
+def cli_capture(args):
+    """Capture power draw at high frequency"""
+    setup_database()
+    
+    capture = PowerCapture(rate=args.rate, capacity=args.capacity, window=args.window)
+    
+    def dump_on_signal(signum, frame):
+        path = os.path.join(os.path.dirname(DB_PATH), f"capture-{time.strftime('%Y%m%d-%H%M%S')}.npy")
+        print(f"\nDumped {capture.dump(path)} samples to {path}")
+    
+    # On-demand raw dumps while capturing (POSIX only)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, dump_on_signal)
+    
+    print(f"Capturing power draw at {args.rate:g} Hz, summarizing every {args.window} seconds. Press Ctrl+C to stop.")
+    if hasattr(signal, 'SIGUSR1'):
+        print(f"Send SIGUSR1 (kill -USR1 {os.getpid()}) to dump the raw buffer.")
+    
+    def show_live():
+        while not stop_display.wait(1.0):
+            mean, p95, peak = capture.live_summary()
+            if mean is not None:
+                print(f"\rPower: {mean:.2f} W mean, {p95:.2f} W p95, {peak:.2f} W max (last {SUMMARY_WINDOW} s)", end='')
+    
+    stop_display = threading.Event()
+    threading.Thread(target=show_live, daemon=True).start()
+    
+    try:
+        capture.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_display.set()
+        capture.stop()
+        print(f"\nCapture stopped: {capture.samples} samples, {capture.summaries_written} summaries stored.")
+        if args.dump:
+            print(f"Dumped {capture.dump(args.dump)} samples to {args.dump}")
+
+
 def cli_info(args):
     """Display current battery information"""
+    if getattr(args, 'providers', False):
+        cli_providers()
+        return
+    
     info = get_battery_info()
     
     if not info:
@@ -111,6 +256,30 @@ def cli_info(args):
         print(f"Estimated {'Time to Full' if info['is_charging'] else 'Time Remaining'}: {hours}h {minutes}m")
 
 
+def cli_providers():
+    """Probe the battery providers and show what each one costs"""
+    registry = get_registry()
+    results = registry.probe()
+    active = registry.active.name if registry.active else None
+    
+    print("\nBattery Providers")
+    print(f"----------------------------------------")
+    for result in results:
+        if result['available']:
+            detail = f"{result['latency'] * 1000:.3f} ms/read, {result['richness']} fields"
+        elif result['error']:
+            detail = f"unavailable ({result['error']})"
+        else:
+            detail = "unavailable"
+        marker = '*' if result['name'] == active else ' '
+        print(f"{marker} {result['name']:<8} {detail}")
+    
+    if active:
+        print(f"\nUsing: {active}")
+    else:
+        print("\nNo battery provider available.")
+
+
 def cli_notification(args):
     """Configure notification settings"""
     setup_database()
@@ -143,40 +312,154 @@ def cli_cleanup(args):
     setup_database()
     days = args.days
     
-    deleted = clear_old_history(days)
+    deleted = get_backend().apply_retention(days)
     print(f"Cleaned up {deleted} records older than {days} days.")
 
 
+def cli_archive(args):
+    """Move old history data into compressed archives"""
+    setup_database()
+    days = args.days
+    
+    archived = archive_old_history(days)
+    print(f"Archived {archived} records older than {days} days.")
+
+
+def cli_compact(args):
+    """Convert stored history to another storage layout"""
+    setup_database()
+    
+    converted = convert_history_layout(args.layout)
+    print(f"Converted {converted} history partitions to the {args.layout} layout.")
+
+
+def cli_synth(args):
+    """Generate a synthetic battery trace for testing"""
+    setup_database()
+    
+    started = time.perf_counter()
+    trace = generate_trace(days=args.days, interval=args.interval, seed=args.seed)
+    rows = len(trace['timestamp'])
+    print(f"Generated {rows} samples over {args.days} days in {time.perf_counter() - started:.2f} s")
+    
+    if args.out:
+        save_trace(args.out, trace)
+        print(f"Saved trace to {args.out}")
+    
+    if args.load:
+        started = time.perf_counter()
+        stored = get_backend().append_arrays(trace)
+        get_backend().flush()
+        print(f"Loaded {stored} samples into the {get_backend().name} history in {time.perf_counter() - started:.2f} s")
+    
+    if args.sysfs and rows:
+        write_sysfs_tree(args.sysfs, trace_reading(trace, rows - 1))
+        print(f"Wrote a fake power_supply tree under {args.sysfs}")
+
+
 def cli_service(args):
     """Run PowerPulse as a background service"""
     # Ensure the database is set up
     setup_database()
     
-    print(f"Starting PowerPulse service (interval: {args.interval} seconds)")
-    
-    # Create a daemon thread for monitoring
-    def monitoring_service():
-        while True:
-            try:
-                info = get_battery_info()
-                if info:
-                    save_battery_info(info)
-                    check_notifications(info)
-                time.sleep(args.interval)
-            except Exception as e:
-                print(f"Error in monitoring service: {e}")
-                time.sleep(30)  # Shorter retry interval on error
-    
-    # Create and start the thread
-    monitor_thread = threading.Thread(target=monitoring_service, daemon=True)
-    monitor_thread.start()
-    
-    # Keep the main thread alive
-    try:
-        while True:
-            time.sleep(60)
-    except KeyboardInterrupt:
-        print("Service stopped.")
+    sampler = make_sampler(args)
+    capture = PowerCapture(rate=args.capture) if args.capture else None
+    service = MonitoringService(sampler, retention_days=args.retention_days, endpoint=args.endpoint,
+                                capture=capture)
+    
+    if sampler.listener:
+        print(f"Starting PowerPulse service (power supply events, polling every {sampler.interval} seconds)")
+    else:
+        print(f"Starting PowerPulse service (interval: {sampler.interval} seconds)")
+    if capture is not None:
+        print(f"Capturing power draw at {args.capture} samples per second")
+    
+    # Runs until SIGINT or SIGTERM
+    service.run()
+    print("Service stopped.")
+
+
+def diag_from_service(args):
+    """Query a running service's instrumentation; returns (snapshot, profile report)"""
+    request = {'query': 'diag', 'reset': args.reset}
+    if args.enable or args.disable:
+        request['enable'] = args.enable
+    
+    report = None
+    if args.profile_seconds:
+        query_service({'query': 'profile', 'action': 'start', 'kind': args.profiler})
+        print(f"Profiling the service for {args.profile_seconds} seconds...")
+        time.sleep(args.profile_seconds)
+        response = query_service({'query': 'profile', 'action': 'stop', 'save': bool(args.profile_out)}, timeout=60)
+        report = response['report']
+        if args.profile_out and response.get('path'):
+            shutil.copyfile(response['path'], args.profile_out)
+    
+    return query_service(request), report
+
+
+def diag_local(args):
+    """Time each pipeline stage in this process; returns (snapshot, profile report)"""
+    import matplotlib.pyplot as plt
+    
+    diag.enable()
+    if args.profile_seconds:
+        diag.start_profiler(args.profiler)
+    
+    # Readings are not stored, so the history is left untouched
+    registry = get_registry()
+    for _ in range(args.samples):
+        registry.read()
+        with diag.stage('notify.settings'):
+            get_notification_settings()
+    
+    calculate_statistics(7)
+    calculate_power_statistics(1)
+    for generate in (generate_history_plot, generate_daily_usage_plot):
+        fig = generate(7)
+        if fig is not None:
+            plt.close(fig)
+    
+    report = diag.stop_profiler(args.profile_out) if args.profile_seconds else None
+    return diag.snapshot(), report
+
+
+def cli_diag(args):
+    """Show per-stage timings from a running service or this process"""
+    setup_database()
+    
+    data = report = None
+    if not args.local:
+        try:
+            data, report = diag_from_service(args)
+        except (OSError, ValueError) as e:
+            print(f"No service endpoint reachable ({e}); measuring this process instead.")
+            print("Start the service with --endpoint to inspect it.")
+            print()
+    if data is None:
+        data, report = diag_local(args)
+    
+    if args.json:
+        print(json.dumps(dict(data, profile=report), indent=2))
+        return
+    
+    print(diag.format_report(data))
+    if data['stages'] and not data['enabled']:
+        print()
+        print("Instrumentation is off; run 'powerpulse diag --enable' to collect timings.")
+    if report:
+        print()
+        print(report)
+
+
+def report_diagnostics(profile_out=None):
+    """Print instrumentation and profiler results when the CLI exits"""
+    report = diag.stop_profiler(profile_out)
+    print()
+    print(diag.format_report(diag.snapshot()))
+    if report:
+        print()
+        print(report)
 
 
 def main():
@@ -186,10 +469,16 @@ def main():
     
     # Monitor command
     monitor_parser = subparsers.add_parser("monitor", help="Monitor battery status")
-    monitor_parser.add_argument("--interval", type=int, default=30, help="Monitoring interval in seconds")
+    monitor_parser.add_argument("--interval", type=int, help="Monitoring interval in seconds (default: 30, or 300 with --events)")
+    monitor_parser.add_argument("--events", action="store_true", help="Sample on power supply events and poll only as a fallback (Linux)")
+    monitor_parser.add_argument("--adaptive", action="store_true", help="Adapt the sampling rate and store only readings that changed")
+    monitor_parser.add_argument("--deadband", type=float, default=DEFAULT_DEADBAND, help="Percentage change needed to store a reading with --adaptive")
+    monitor_parser.add_argument("--heartbeat", type=int, default=HEARTBEAT_INTERVAL, help="Store a reading at least this often (seconds) with --adaptive")
+    monitor_parser.set_defaults(default_interval=30)
     
     # Info command
     info_parser = subparsers.add_parser("info", help="Display current battery information")
+    info_parser.add_argument("--providers", action="store_true", help="Probe the battery providers and show their cost per read")
     
     # Stats command
     stats_parser = subparsers.add_parser("stats", help="Display battery statistics")
@@ -198,6 +487,12 @@ def main():
     # Plot command
     plot_parser = subparsers.add_parser("plot", help="Show battery history plot")
     plot_parser.add_argument("--days", type=int, default=7, help="Number of days to plot")
+    plot_parser.add_argument("--power", action="store_true", help="Plot captured power draw instead of battery level")
+    
+    # Sessions command
+    sessions_parser = subparsers.add_parser("sessions", help="List charging and discharging sessions")
+    sessions_parser.add_argument("--days", type=int, default=7, help="Number of days to list")
+    sessions_parser.add_argument("--limit", type=int, default=50, help="Show at most this many of the newest sessions")
     
     # Notification command
     notif_parser = subparsers.add_parser("notification", help="Configure notifications")
@@ -212,9 +507,54 @@ def main():
     cleanup_parser = subparsers.add_parser("cleanup", help="Clean up old history data")
     cleanup_parser.add_argument("--days", type=int, default=30, help="Keep data newer than this many days")
     
+    # Archive command
+    archive_parser = subparsers.add_parser("archive", help="Move old history data into compressed archives")
+    archive_parser.add_argument("--days", type=int, default=30, help="Keep data newer than this many days live")
+    
+    # Compact command
+    compact_parser = subparsers.add_parser("compact", help="Convert history to the compact storage layout")
+    compact_parser.add_argument("--layout", choices=HISTORY_LAYOUTS, default="compact", help="Storage layout to convert to")
+    
+    # Capture command
+    capture_parser = subparsers.add_parser("capture", help="Capture power draw at high frequency")
+    capture_parser.add_argument("--rate", type=float, default=CAPTURE_RATE, help="Samples per second")
+    capture_parser.add_argument("--window", type=int, default=SUMMARY_WINDOW, help="Seconds summarized into each stored row")
+    capture_parser.add_argument("--capacity", type=int, default=RING_CAPACITY, help="Raw samples kept in memory")
+    capture_parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    capture_parser.add_argument("--dump", help="Write the raw buffer to this .npy or .csv file when done")
+    
+    # Synthetic trace command
+    synth_parser = subparsers.add_parser("synth", help="Generate synthetic battery history for testing")
+    synth_parser.add_argument("--days", type=float, default=30, help="Length of the trace in days")
+    synth_parser.add_argument("--interval", type=float, default=30, help="Seconds between samples")
+    synth_parser.add_argument("--seed", type=int, help="Random seed for a reproducible trace")
+    synth_parser.add_argument("--out", help="Save the trace to this .npy or .csv file")
+    synth_parser.add_argument("--load", action="store_true", help="Load the trace into the battery history")
+    synth_parser.add_argument("--sysfs", metavar="ROOT", help="Write the last reading as a fake power_supply tree under ROOT")
+    
     # Service command
     service_parser = subparsers.add_parser("service", help="Run as a background service")
-    service_parser.add_argument("--interval", type=int, default=60, help="Monitoring interval in seconds")
+    service_parser.add_argument("--interval", type=int, help="Monitoring interval in seconds (default: 60, or 300 with --events)")
+    service_parser.add_argument("--events", action="store_true", help="Sample on power supply events and poll only as a fallback (Linux)")
+    service_parser.add_argument("--adaptive", action="store_true", help="Adapt the sampling rate and store only readings that changed")
+    service_parser.add_argument("--deadband", type=float, default=DEFAULT_DEADBAND, help="Percentage change needed to store a reading with --adaptive")
+    service_parser.add_argument("--heartbeat", type=int, default=HEARTBEAT_INTERVAL, help="Store a reading at least this often (seconds) with --adaptive")
+    service_parser.add_argument("--retention-days", type=int, default=0, help="Periodically drop history older than this many days (default: keep all)")
+    service_parser.add_argument("--endpoint", action="store_true", help="Serve status and statistics queries on a local socket")
+    service_parser.add_argument("--capture", type=float, metavar="RATE", help="Also capture power draw at this many samples per second")
+    service_parser.set_defaults(default_interval=60)
+    
+    # Diagnostics command
+    diag_parser = subparsers.add_parser("diag", help="Show per-stage timings from a running service or this process")
+    diag_parser.add_argument("--local", action="store_true", help="Measure this process instead of querying the service")
+    diag_parser.add_argument("--samples", type=int, default=5, help="Battery reads to time when measuring this process")
+    diag_parser.add_argument("--enable", action="store_true", help="Turn on instrumentation in the running service")
+    diag_parser.add_argument("--disable", action="store_true", help="Turn off instrumentation in the running service")
+    diag_parser.add_argument("--reset", action="store_true", help="Clear the service's counters after reading them")
+    diag_parser.add_argument("--profile", dest="profile_seconds", type=float, metavar="SECONDS", help="Also profile for this many seconds")
+    diag_parser.add_argument("--profiler", choices=sorted(diag.PROFILERS), default="sampling", help="Profiler to attach (default: sampling)")
+    diag_parser.add_argument("--profile-out", metavar="PATH", help="Save the raw profile to this file")
+    diag_parser.add_argument("--json", action="store_true", help="Print the raw statistics as JSON")
     
     # GUI command
     gui_parser = subparsers.add_parser("gui", help="Launch the GUI")
@@ -222,12 +562,44 @@ def main():
     # Parse arguments
     parser.add_argument("--gui", action="store_true", help="Launch the GUI (shortcut)")
     parser.add_argument("--version", action="store_true", help="Show version information")
+    parser.add_argument("--backend", choices=BACKENDS, help="Storage backend for battery history (default: storage_backend setting)")
+    parser.add_argument("--provider", choices=sorted(PROVIDERS), help="Battery data provider (default: probe for the best one)")
+    parser.add_argument("--replay", metavar="TRACE", help="Read the battery from a recorded or synthetic trace file")
+    parser.add_argument("--replay-speed", type=float, help="Trace seconds per wall-clock second (default: next sample on every read)")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute statistics and plot data instead of using the result cache")
+    parser.add_argument("--diag", action="store_true", help="Time each pipeline stage and print the timings on exit")
+    parser.add_argument("--profile", choices=sorted(diag.PROFILERS), help="Profile the command and print the hottest functions on exit")
+    parser.add_argument("--profile-out", metavar="PATH", help="Save the raw --profile output to this file")
     
     args = parser.parse_args()
     
     # Set up the database on first run
     setup_database()
     
+    if args.backend:
+        set_backend(args.backend)
+    
+    if args.provider:
+        set_provider(args.provider)
+    
+    if args.replay:
+        set_provider(ReplayProvider(args.replay, speed=args.replay_speed))
+    
+    # Results are cached on disk between runs
+    cache = get_cache()
+    if args.no_cache:
+        cache.enabled = False
+    elif args.command in ("stats", "plot", "sessions"):
+        cache.load(cache_path())
+        atexit.register(cache.save, cache_path())
+    
+    if args.command != "diag" and (args.diag or args.profile):
+        if args.diag:
+            diag.enable()
+        if args.profile:
+            diag.start_profiler(args.profile)
+        atexit.register(report_diagnostics, args.profile_out)
+    
     # Handle version request
     if args.version:
         from powerpulse import __version__
@@ -245,12 +617,24 @@ def main():
         cli_stats(args)
     elif args.command == "plot":
         cli_plot(args)
+    elif args.command == "sessions":
+        cli_sessions(args)
     elif args.command == "notification":
         cli_notification(args)
     elif args.command == "cleanup":
         cli_cleanup(args)
+    elif args.command == "archive":
+        cli_archive(args)
+    elif args.command == "compact":
+        cli_compact(args)
+    elif args.command == "capture":
+        cli_capture(args)
+    elif args.command == "synth":
+        cli_synth(args)
     elif args.command == "service":
         cli_service(args)
+    elif args.command == "diag":
+        cli_diag(args)
     elif args.command == "gui" or args.gui:
         launch_gui()
     else:
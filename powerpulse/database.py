@@ -5,9 +5,19 @@ This module handles database operations for storing battery history and settings
 """
 
 import os
+import time
+import queue
+import atexit
 import sqlite3
 import datetime
+import threading
 from pathlib import Path
+from contextlib import contextmanager
+
+import numpy as np
+
+from powerpulse import diag
+from powerpulse.archive import ArchiveFile, write_archive, ARCHIVE_SUFFIX
 
 # Get application data directory
 if os.name == 'nt':  # Windows
@@ -21,84 +31,1456 @@ os.makedirs(APP_DATA_DIR, exist_ok=True)
 # Database file path
 DB_PATH = os.path.join(APP_DATA_DIR, 'battery_history.db')
 
+# Schema version stored in PRAGMA user_version
+SCHEMA_VERSION = 10
 
-def setup_database():
-    """Set up the SQLite database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Create tables if they don't exist
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS battery_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT,
+# Number of read-only connections kept open alongside the writer
+READER_POOL_SIZE = 4
+
+# Prepared statements cached per connection (sqlite3 keys them by SQL text)
+STATEMENT_CACHE_SIZE = 64
+
+# Buffered samples are flushed once either threshold is reached
+WRITE_BUFFER_MAX_ROWS = 20
+WRITE_BUFFER_MAX_AGE = 300  # seconds
+
+# A full charge is counted when a charging sample reaches this level
+FULL_CHARGE_LEVEL = 99.5
+
+# Columns of the sessions table, in order
+SESSION_COLUMNS = (
+    'start_ts', 'end_ts', 'is_charging', 'start_percentage', 'end_percentage',
+    'samples', 'full_charges', 'energy_wh',
+)
+
+# History columns and the dtypes used for columnar (NumPy) reads;
+# missing temperature/remaining_time values become NaN
+HISTORY_COLUMNS = ('timestamp', 'percentage', 'is_charging', 'power_plugged', 'temperature', 'remaining_time')
+HISTORY_ARRAY_DTYPES = {
+    'timestamp': np.int64,
+    'percentage': np.float32,
+    'is_charging': np.bool_,
+    'power_plugged': np.bool_,
+    'temperature': np.float32,
+    'remaining_time': np.float32,
+}
+
+# Rollup resolutions, finest first, with their bucket width in milliseconds
+ROLLUP_RESOLUTIONS = ('minute', 'hour', 'day')
+ROLLUP_WIDTH_MS = {
+    'minute': 60 * 1000,
+    'hour': 3600 * 1000,
+    'day': 24 * 3600 * 1000,
+}
+
+# History is stored in one table per week; weeks start on Monday (UTC), and
+# the epoch itself fell on a Thursday
+PARTITION_WIDTH_MS = 7 * 24 * 3600 * 1000
+PARTITION_ORIGIN_MS = 4 * 24 * 3600 * 1000
+PARTITION_PREFIX = 'battery_history_'
+
+# Partition storage layouts. 'compact' stores the percentage and temperature
+# in tenths as integers, packs the two flags into one bit-field and keeps
+# optional fields as NULLs, which SQLite encodes in a single header byte.
+HISTORY_LAYOUTS = ('standard', 'compact')
+FLAG_CHARGING = 1
+FLAG_PLUGGED = 2
+
+_PARTITION_DDL = {
+    'standard': '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        timestamp INTEGER PRIMARY KEY,
         percentage REAL,
         is_charging INTEGER,
         power_plugged INTEGER,
         temperature REAL,
         remaining_time REAL
     )
+    ''',
+    'compact': '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        timestamp INTEGER PRIMARY KEY,
+        percentage INTEGER,
+        flags INTEGER NOT NULL,
+        temperature INTEGER,
+        remaining_time INTEGER
+    )
+    ''',
+}
+
+# SQL expressions decoding each history column from a partition layout
+_LAYOUT_COLUMNS = {
+    'standard': {name: name for name in (
+        'timestamp', 'percentage', 'is_charging', 'power_plugged', 'temperature', 'remaining_time'
+    )},
+    'compact': {
+        'timestamp': 'timestamp',
+        'percentage': 'percentage / 10.0',
+        'is_charging': f'flags & {FLAG_CHARGING}',
+        'power_plugged': f'(flags & {FLAG_PLUGGED}) >> 1',
+        'temperature': 'temperature / 10.0',
+        'remaining_time': 'remaining_time',
+    },
+}
+
+# Gaps longer than this (suspend, shutdown) do not count as time spent charging
+MAX_SAMPLE_GAP_MS = 15 * 60 * 1000
+
+# Pragmas applied to every pooled connection
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-8000',
+    'PRAGMA mmap_size=67108864',
+    'PRAGMA busy_timeout=5000',
+)
+
+
+class ConnectionManager:
+    """Long-lived SQLite connections shared by every thread in the process
+
+    All writes go through a single connection guarded by a lock, so the
+    GUI thread and the monitoring thread never race on a transaction. Reads
+    borrow a connection from a small pool; in WAL mode they never block the
+    writer and always see the last committed transaction.
+    """
+
+    def __init__(self, path, pool_size=READER_POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._writer = None
+        self._readers = queue.LifoQueue()
+        self._all_readers = []
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()
+        self._watcher = None
+        self._watch_lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        """Open a connection with the tuned pragmas applied"""
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Yield the writer connection inside a transaction
+
+        Nested uses on the same thread join the outer transaction, which is
+        committed (or rolled back) only when the outermost block exits. A
+        nested block runs in a savepoint, so if it raises only its own
+        changes are undone and the outer block may carry on.
+        """
+        with self._write_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection manager is closed")
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            if self._write_depth:
+                with self._savepoint(conn):
+                    self._write_depth += 1
+                    try:
+                        yield conn
+                    finally:
+                        self._write_depth -= 1
+                return
+            self._write_depth = 1
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                self._write_depth = 0
+
+    @contextmanager
+    def _savepoint(self, conn):
+        """Run a nested writer block in a savepoint of the open transaction"""
+        if not conn.in_transaction:
+            # Otherwise releasing the savepoint would commit on its own
+            conn.execute('BEGIN')
+        name = f'nested_{self._write_depth}'
+        conn.execute(f'SAVEPOINT {name}')
+        try:
+            yield
+        except BaseException:
+            conn.execute(f'ROLLBACK TO {name}')
+            conn.execute(f'RELEASE {name}')
+            raise
+        else:
+            conn.execute(f'RELEASE {name}')
+
+    @contextmanager
+    def reader(self):
+        """Yield a pooled read connection for the calling thread"""
+        held = getattr(self._local, 'reader', None)
+        if held is not None:
+            # Re-entrant use on the same thread shares the borrowed connection
+            yield held
+            return
+        
+        conn = self._acquire_reader()
+        self._local.reader = conn
+        try:
+            yield conn
+        finally:
+            self._local.reader = None
+            if self._closed:
+                conn.close()
+            else:
+                self._readers.put(conn)
+
+    def _acquire_reader(self):
+        """Take an idle reader, opening a new one while under the pool size"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection manager is closed")
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._pool_lock:
+            if len(self._all_readers) < self.pool_size:
+                conn = self._connect()
+                self._all_readers.append(conn)
+                return conn
+        
+        return self._readers.get()
+
+    def data_version(self):
+        """PRAGMA data_version of a connection used for nothing else
+        
+        The value changes whenever any other connection, in this process
+        or another, commits to the database, so it is a cheap way to detect
+        modifications. Having its own connection means the check never
+        waits behind the writer.
+        """
+        with self._watch_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection manager is closed")
+            if self._watcher is None:
+                self._watcher = self._connect()
+            return self._watcher.execute('PRAGMA data_version').fetchone()[0]
+
+    def close(self):
+        """Close every connection owned by this manager"""
+        self._closed = True
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._watch_lock:
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+        
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self._all_readers = []
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_connection_manager():
+    """Get the process-wide connection manager for the current DB_PATH"""
+    global _manager
+    
+    manager = _manager
+    if manager is not None and manager.path == DB_PATH and not manager._closed:
+        return manager
+    
+    with _manager_lock:
+        if _manager is None or _manager.path != DB_PATH or _manager._closed:
+            if _manager is not None:
+                _manager.close()
+            _manager = ConnectionManager(DB_PATH)
+        return _manager
+
+
+class SampleBuffer:
+    """Write-behind buffer collecting battery samples between flushes
+
+    Rows stay in the buffer until the flush that wrote them has committed,
+    so a failed write never loses samples and readers never miss a row.
+    """
+
+    def __init__(self, max_rows=WRITE_BUFFER_MAX_ROWS, max_age=WRITE_BUFFER_MAX_AGE):
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self._rows = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    def add(self, row):
+        """Buffer a row and report whether a flush is due"""
+        with self._lock:
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.append(row)
+            return (len(self._rows) >= self.max_rows
+                    or time.monotonic() - self._oldest >= self.max_age)
+
+    def pending(self, start_ms=None):
+        """Snapshot of buffered rows at or after start_ms"""
+        with self._lock:
+            if start_ms is None:
+                return list(self._rows)
+            return [row for row in self._rows if row[0] >= start_ms]
+
+    def discard(self, count):
+        """Drop the oldest count rows once they have been committed"""
+        with self._lock:
+            del self._rows[:count]
+            self._oldest = time.monotonic() if self._rows else None
+
+    def __len__(self):
+        return len(self._rows)
+
+
+_sample_buffer = SampleBuffer()
+
+
+class SettingsCache:
+    """Process-wide cache of the settings and notifications tables
+
+    Both tables are loaded with a single query and kept up to date by the
+    update functions in this module (write-through). Changes made by other
+    processes are detected through the connection manager's data_version
+    and a settings_version counter bumped by triggers, so lookups do no
+    table reads while nothing writes to the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._settings = None
+        self._notifications = None
+        self._version = None
+        self._data_version = None
+
+    def _load(self, conn):
+        """Reload both tables and the settings version in one query"""
+        settings = {}
+        notifications = []
+        version = None
+        for source, key, value, enabled in conn.execute('''
+        SELECT 'setting', key, value, NULL FROM settings
+        UNION ALL
+        SELECT 'notification', type, level, enabled
+        FROM (SELECT type, level, enabled FROM notifications ORDER BY id)
+        UNION ALL
+        SELECT 'version', NULL, version, NULL FROM settings_meta
+        '''):
+            if source == 'setting':
+                settings[key] = value
+            elif source == 'notification':
+                notifications.append((key, value, enabled))
+            else:
+                version = value
+        
+        self._settings = settings
+        self._notifications = notifications
+        self._version = version
+
+    def _validate(self):
+        """Make sure the cached tables reflect the current database"""
+        manager = get_connection_manager()
+        
+        data_version = manager.data_version()
+        
+        with self._lock:
+            if self._path == manager.path and self._settings is not None and data_version == self._data_version:
+                return self._settings, self._notifications
+            
+            with manager.reader() as conn:
+                if self._path != manager.path or self._settings is None:
+                    self._load(conn)
+                else:
+                    version = conn.execute('SELECT version FROM settings_meta').fetchone()[0]
+                    if version != self._version:
+                        self._load(conn)
+            
+            self._path = manager.path
+            self._data_version = data_version
+            return self._settings, self._notifications
+
+    def get_setting(self, key, default=None):
+        """Look up a cached setting value"""
+        settings, _ = self._validate()
+        return settings.get(key, default)
+
+    def get_notification_settings(self):
+        """Cached (type, level, enabled) rows in table order"""
+        _, notifications = self._validate()
+        return list(notifications)
+
+    def write_through(self, conn):
+        """Refresh the cache from the writer connection after a settings write"""
+        with self._lock:
+            self._load(conn)
+            self._path = get_connection_manager().path
+            # The watcher sees this commit too; the next lookup then only
+            # compares the settings version
+            self._data_version = None
+
+    def invalidate(self):
+        """Force the next lookup to reload from the database"""
+        with self._lock:
+            self._settings = None
+
+
+_settings_cache = SettingsCache()
+
+
+def close_connections():
+    """Flush buffered samples and close all pooled database connections"""
+    global _manager
+    
+    try:
+        flush_battery_history()
+    except sqlite3.Error as e:
+        print(f"Error flushing battery history: {e}")
+    
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+            _manager = None
+
+
+atexit.register(close_connections)
+
+
+def to_epoch_ms(value):
+    """Convert a datetime (naive means local time) to epoch milliseconds"""
+    return int(round(value.timestamp() * 1000))
+
+
+def from_epoch_ms(value):
+    """Convert epoch milliseconds to a naive local datetime"""
+    return datetime.datetime.fromtimestamp(value / 1000)
+
+
+def now_epoch_ms():
+    """Current wall-clock time in epoch milliseconds"""
+    return time.time_ns() // 1_000_000
+
+
+def days_ago_epoch_ms(days):
+    """Epoch milliseconds for the instant the given number of days ago"""
+    return now_epoch_ms() - int(days * 24 * 3600 * 1000)
+
+
+def _iso_to_epoch_ms(value):
+    """Convert a legacy ISO-8601 timestamp column value to epoch milliseconds"""
+    if value is None:
+        return None
+    try:
+        return to_epoch_ms(datetime.datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def partition_bounds(timestamp):
+    """Start and end (exclusive) of the weekly partition holding timestamp"""
+    start = timestamp - (timestamp - PARTITION_ORIGIN_MS) % PARTITION_WIDTH_MS
+    return start, start + PARTITION_WIDTH_MS
+
+
+def partition_name(start):
+    """Table name of the weekly partition starting at start"""
+    day = datetime.datetime.fromtimestamp(start / 1000, datetime.timezone.utc)
+    return PARTITION_PREFIX + day.strftime('%Y%m%d')
+
+
+def _create_partition_catalog(conn):
+    """Create the catalog table listing the weekly history partitions"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS history_partitions (
+        name TEXT PRIMARY KEY,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL,
+        row_count INTEGER NOT NULL DEFAULT 0,
+        layout TEXT NOT NULL DEFAULT 'standard'
+    )
     ''')
     
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS notifications (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        type TEXT,
-        level INTEGER,
-        enabled INTEGER
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(history_partitions)')}
+    if 'layout' not in columns:
+        conn.execute("ALTER TABLE history_partitions ADD COLUMN layout TEXT NOT NULL DEFAULT 'standard'")
+
+
+def _history_layout(conn):
+    """Layout used for newly created partitions"""
+    try:
+        row = conn.execute("SELECT value FROM settings WHERE key = 'history_layout'").fetchone()
+    except sqlite3.OperationalError:
+        # The settings table does not exist yet while migrating
+        row = None
+    return row[0] if row and row[0] in HISTORY_LAYOUTS else 'standard'
+
+
+def _ensure_partition(conn, start):
+    """Create the weekly partition starting at start if needed
+    
+    Returns the partition's (name, layout).
+    """
+    name = partition_name(start)
+    row = conn.execute('SELECT layout FROM history_partitions WHERE name = ?', (name,)).fetchone()
+    if row:
+        return name, row[0]
+    
+    layout = _history_layout(conn)
+    conn.execute(_PARTITION_DDL[layout].format(table=name))
+    conn.execute('''
+    INSERT INTO history_partitions (name, start_ts, end_ts, layout)
+    VALUES (?, ?, ?, ?)
+    ''', (name, start, start + PARTITION_WIDTH_MS, layout))
+    return name, layout
+
+
+def _overlapping_partitions(conn, start=None, end=None):
+    """(name, layout) of the partitions overlapping [start, end), oldest first"""
+    return conn.execute('''
+    SELECT name, layout FROM history_partitions
+    WHERE end_ts > ? AND start_ts < ?
+    ORDER BY start_ts
+    ''', (start if start is not None else -2**62, end if end is not None else 2**62)).fetchall()
+
+
+def _select_history_sql(table, layout, columns):
+    """SELECT for a time range of one partition, decoded to standard columns"""
+    expressions = ', '.join(_LAYOUT_COLUMNS[layout][name] for name in columns)
+    return f'''
+    SELECT {expressions}
+    FROM {table}
+    WHERE timestamp >= ? AND timestamp < ?
+    ORDER BY timestamp
+    '''
+
+
+def _read_history(conn, columns, start=None, end=None):
+    """Read history rows in [start, end) from archives and partitions"""
+    lower = start if start is not None else -2**62
+    upper = end if end is not None else 2**62
+    rows = []
+    for path in _overlapping_archives(conn, start, end):
+        arrays = _read_archive(path, columns, start, end)
+        if arrays is not None:
+            rows.extend(_arrays_to_rows(arrays, columns))
+    for name, layout in _overlapping_partitions(conn, start, end):
+        rows.extend(conn.execute(_select_history_sql(name, layout, columns), (lower, upper)))
+    return rows
+
+
+def _encode_compact(row):
+    """Encode a standard history row for a compact partition"""
+    timestamp, percentage, is_charging, power_plugged, temperature, remaining_time = row
+    return (
+        timestamp,
+        None if percentage is None else int(round(percentage * 10)),
+        (FLAG_CHARGING if is_charging else 0) | (FLAG_PLUGGED if power_plugged else 0),
+        None if temperature is None else int(round(temperature * 10)),
+        None if remaining_time is None else int(round(remaining_time)),
+    )
+
+
+def _write_history(conn, rows):
+    """Insert time-ordered history rows into their weekly partitions"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(partition_bounds(row[0])[0], []).append(row)
+    
+    for start, group in groups.items():
+        name, layout = _ensure_partition(conn, start)
+        if layout == 'compact':
+            cursor = conn.executemany(INSERT_COMPACT_HISTORY_SQL.format(table=name), map(_encode_compact, group))
+        else:
+            cursor = conn.executemany(INSERT_HISTORY_SQL.format(table=name), group)
+        conn.execute('''
+        UPDATE history_partitions SET row_count = row_count + ? WHERE name = ?
+        ''', (cursor.rowcount, name))
+
+
+def archive_dir():
+    """Directory holding the compressed history archives"""
+    return os.path.join(os.path.dirname(DB_PATH), 'archive')
+
+
+def _create_archive_catalog(conn):
+    """Create the catalog table listing archived partitions
+    
+    first_ts and last_ts are the oldest and newest archived samples, so
+    bounds queries need not open the files.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS history_archives (
+        name TEXT PRIMARY KEY,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL,
+        row_count INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        first_ts INTEGER,
+        last_ts INTEGER
     )
     ''')
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(history_archives)')}
+    if 'first_ts' not in columns:
+        conn.execute('ALTER TABLE history_archives ADD COLUMN first_ts INTEGER')
+        conn.execute('ALTER TABLE history_archives ADD COLUMN last_ts INTEGER')
+        for name, filename in conn.execute('SELECT name, filename FROM history_archives').fetchall():
+            try:
+                with ArchiveFile(os.path.join(archive_dir(), filename)) as archive:
+                    bounds = archive.first_ts, archive.last_ts
+            except FileNotFoundError:
+                continue
+            conn.execute('''
+            UPDATE history_archives SET first_ts = ?, last_ts = ? WHERE name = ?
+            ''', (*bounds, name))
+
+
+def _overlapping_archives(conn, start=None, end=None):
+    """Paths of the archive files overlapping [start, end), oldest first"""
+    return [os.path.join(archive_dir(), row[0]) for row in conn.execute('''
+    SELECT filename FROM history_archives
+    WHERE end_ts > ? AND start_ts < ?
+    ORDER BY start_ts
+    ''', (start if start is not None else -2**62, end if end is not None else 2**62))]
+
+
+def _first_archived(conn, start=None):
+    """Timestamp of the oldest archived sample at or after start, or None
+    
+    Answered from the catalog unless start falls inside an archive; then
+    only the block holding start is decoded.
+    """
+    row = conn.execute('''
+    SELECT filename, first_ts FROM history_archives
+    WHERE last_ts >= ?
+    ORDER BY start_ts
+    LIMIT 1
+    ''', (start if start is not None else -2**62,)).fetchone()
+    if row is None:
+        return None
+    filename, first_ts = row
+    if start is None or first_ts >= start:
+        return first_ts
+    try:
+        with ArchiveFile(os.path.join(archive_dir(), filename)) as archive:
+            return archive.first_at_or_after(start)
+    except FileNotFoundError:
+        print(f"Missing history archive: {filename}")
+        return None
+
+
+def _read_archive(path, columns, start=None, end=None):
+    """Read one archive file as history arrays, or None if it is missing"""
+    try:
+        with ArchiveFile(path) as archive:
+            return archive.read(start, end, columns)
+    except FileNotFoundError:
+        print(f"Missing history archive: {path}")
+        return None
+
+
+def _arrays_to_rows(arrays, columns):
+    """Convert history arrays into tuples shaped like the SQL rows"""
+    values = []
+    for name in columns:
+        column = arrays[name]
+        if column.dtype == np.bool_:
+            values.append(column.astype(np.int64).tolist())
+        elif name == 'timestamp':
+            values.append(column.tolist())
+        else:
+            # Archived values are stored in tenths; undo the float32 rounding
+            values.append([None if value != value else value
+                           for value in np.round(column.astype(np.float64), 1).tolist()])
+    return list(zip(*values))
+
+
+# Suffix of archive files written during a transaction, moved into place
+# once it has committed
+STAGED_ARCHIVE_SUFFIX = '.new'
+
+
+def _stage_archive(path, arrays, staged):
+    """Write an archive beside path, to be installed after the commit"""
+    write_archive(path + STAGED_ARCHIVE_SUFFIX, arrays)
+    staged.append(path)
+
+
+def _install_staged_archives(staged, committed):
+    """Move staged archives into place, or discard them if the commit failed"""
+    for path in staged:
+        if committed:
+            os.replace(path + STAGED_ARCHIVE_SUFFIX, path)
+        else:
+            try:
+                os.remove(path + STAGED_ARCHIVE_SUFFIX)
+            except FileNotFoundError:
+                pass
+
+
+def _recover_staged_archives(conn):
+    """Finish archive writes interrupted between commit and install
+    
+    A staged file whose sample count matches the catalog belongs to a
+    committed transaction; any other one is left over from a failed one.
+    """
+    directory = archive_dir()
+    if not os.path.isdir(directory):
+        return
+    catalog = {filename: row_count for filename, row_count in conn.execute(
+        'SELECT filename, row_count FROM history_archives')}
+    for entry in os.listdir(directory):
+        if not entry.endswith(ARCHIVE_SUFFIX + STAGED_ARCHIVE_SUFFIX):
+            continue
+        filename = entry[:-len(STAGED_ARCHIVE_SUFFIX)]
+        path = os.path.join(directory, filename)
+        try:
+            with ArchiveFile(path + STAGED_ARCHIVE_SUFFIX) as archive:
+                committed = archive.record_count == catalog.get(filename)
+        except (OSError, ValueError):
+            committed = False
+        _install_staged_archives([path], committed)
+
+
+def archive_old_history(days_to_keep=30):
+    """Move whole partitions older than days_to_keep into compressed archives
+    
+    Archived samples stay readable through the history functions; rollups
+    are kept. Returns the number of samples archived.
+    """
+    flush_battery_history()
+    threshold = days_ago_epoch_ms(days_to_keep)
+    os.makedirs(archive_dir(), exist_ok=True)
+    archived = 0
+    staged = []
+    committed = False
+    
+    # The files are written under a staging name and only moved into place
+    # once the catalog changes have committed
+    try:
+        with get_connection_manager().writer() as conn:
+            partitions = conn.execute('''
+            SELECT name, start_ts, end_ts, layout FROM history_partitions
+            WHERE end_ts <= ?
+            ORDER BY start_ts
+            ''', (threshold,)).fetchall()
+            
+            for name, start_ts, end_ts, layout in partitions:
+                dtype = np.dtype([(column, HISTORY_ARRAY_DTYPES[column]) for column in HISTORY_COLUMNS])
+                records = np.fromiter(conn.execute(_select_history_sql(name, layout, HISTORY_COLUMNS), (-2**62, 2**62)),
+                                      dtype=dtype)
+                arrays = {column: records[column] for column in HISTORY_COLUMNS}
+                
+                filename = name + ARCHIVE_SUFFIX
+                path = os.path.join(archive_dir(), filename)
+                existing = conn.execute('SELECT row_count FROM history_archives WHERE name = ?', (name,)).fetchone()
+                if existing:
+                    # Samples arrived for an already archived week; merge them
+                    previous = _read_archive(path, HISTORY_COLUMNS)
+                    if previous is not None:
+                        order = np.argsort(np.concatenate([previous['timestamp'], arrays['timestamp']]), kind='stable')
+                        arrays = {column: np.concatenate([previous[column], arrays[column]])[order]
+                                  for column in HISTORY_COLUMNS}
+                
+                _stage_archive(path, arrays, staged)
+                timestamps = arrays['timestamp']
+                conn.execute('''
+                INSERT OR REPLACE INTO history_archives (name, start_ts, end_ts, row_count, filename, first_ts, last_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (name, start_ts, end_ts, len(timestamps), filename,
+                      int(timestamps[0]) if len(timestamps) else None,
+                      int(timestamps[-1]) if len(timestamps) else None))
+                conn.execute(f'DROP TABLE {name}')
+                conn.execute('DELETE FROM history_partitions WHERE name = ?', (name,))
+                archived += len(records)
+        committed = True
+    finally:
+        _install_staged_archives(staged, committed)
+    
+    return archived
+
+
+def convert_history_layout(layout='compact', vacuum=True):
+    """Rewrite every history partition in the given storage layout
+    
+    Also makes the layout the default for new partitions. Returns the
+    number of partitions converted.
+    """
+    if layout not in HISTORY_LAYOUTS:
+        raise ValueError(f"Unknown history layout: {layout}")
+    
+    flush_battery_history()
+    converted = 0
+    
+    with get_connection_manager().writer() as conn:
+        partitions = conn.execute('''
+        SELECT name FROM history_partitions WHERE layout != ? ORDER BY start_ts
+        ''', (layout,)).fetchall()
+        
+        for (name,) in partitions:
+            staging = f'{name}_convert'
+            conn.execute(f'DROP TABLE IF EXISTS {staging}')
+            conn.execute(_PARTITION_DDL[layout].format(table=staging))
+            
+            if layout == 'compact':
+                conn.execute(f'''
+                INSERT INTO {staging} (timestamp, percentage, flags, temperature, remaining_time)
+                SELECT timestamp,
+                       CAST(ROUND(percentage * 10) AS INTEGER),
+                       (CASE WHEN is_charging THEN {FLAG_CHARGING} ELSE 0 END)
+                       | (CASE WHEN power_plugged THEN {FLAG_PLUGGED} ELSE 0 END),
+                       CAST(ROUND(temperature * 10) AS INTEGER),
+                       CAST(ROUND(remaining_time) AS INTEGER)
+                FROM {name}
+                ''')
+            else:
+                columns = _LAYOUT_COLUMNS['compact']
+                conn.execute(f'''
+                INSERT INTO {staging}
+                (timestamp, percentage, is_charging, power_plugged, temperature, remaining_time)
+                SELECT {', '.join(columns[column] for column in HISTORY_COLUMNS)}
+                FROM {name}
+                ''')
+            
+            conn.execute(f'DROP TABLE {name}')
+            conn.execute(f'ALTER TABLE {staging} RENAME TO {name}')
+            conn.execute('UPDATE history_partitions SET layout = ? WHERE name = ?', (layout, name))
+            converted += 1
+        
+        conn.execute('''
+        INSERT OR REPLACE INTO settings (key, value) VALUES ('history_layout', ?)
+        ''', (layout,))
+        _settings_cache.write_through(conn)
+    
+    if vacuum and converted:
+        # VACUUM cannot run inside a transaction; the writer has none open here
+        with get_connection_manager().writer() as conn:
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    
+    return converted
+
+
+def _migrate_unpartitioned_history(conn, text_timestamps, chunk_size=50000):
+    """Move rows from the legacy single battery_history table into partitions"""
+    timestamp = 'timestamp'
+    if text_timestamps:
+        conn.create_function('iso_to_epoch_ms', 1, _iso_to_epoch_ms, deterministic=True)
+        timestamp = 'iso_to_epoch_ms(timestamp)'
+    
+    cursor = conn.execute(f'''
+    SELECT {timestamp} AS ts, percentage, is_charging, power_plugged, temperature, remaining_time
+    FROM battery_history
+    WHERE ts IS NOT NULL
+    ORDER BY ts
+    ''')
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        _write_history(conn, rows)
     
-    # Insert default notification settings if not present
-    cursor.execute('SELECT COUNT(*) FROM notifications')
-    if cursor.fetchone()[0] == 0:
+    conn.execute('DROP TABLE battery_history')
+
+
+def _create_rollup_tables(conn):
+    """Create the minute/hour/day rollup tables"""
+    for resolution in ROLLUP_RESOLUTIONS:
+        conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS battery_rollup_{resolution} (
+            bucket INTEGER PRIMARY KEY,
+            first_ts INTEGER NOT NULL,
+            last_ts INTEGER NOT NULL,
+            min_percentage REAL,
+            max_percentage REAL,
+            sum_percentage REAL,
+            last_percentage REAL,
+            samples INTEGER NOT NULL,
+            charging_samples INTEGER NOT NULL,
+            plugged_samples INTEGER NOT NULL,
+            charging_ms INTEGER NOT NULL
+        )
+        ''')
+
+
+def setup_database():
+    """Set up the SQLite database"""
+    with get_connection_manager().writer() as conn:
+        cursor = conn.cursor()
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        
+        # Create tables if they don't exist, migrating older layouts in place
+        _create_partition_catalog(conn)
+        _create_archive_catalog(conn)
+        _recover_staged_archives(conn)
+        columns = {row[1]: row[2].upper() for row in cursor.execute('PRAGMA table_info(battery_history)')}
+        if columns:
+            _migrate_unpartitioned_history(conn, columns.get('timestamp') == 'TEXT')
+        
+        _create_rollup_tables(conn)
+        if version < 2:
+            _rebuild_rollups(conn)
+        
+        # Summaries of high-frequency power captures, one row per window
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS power_summary (
+            window_start INTEGER PRIMARY KEY,
+            window_end INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            mean_watts REAL,
+            p95_watts REAL,
+            max_watts REAL,
+            charging_samples INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        
+        _create_sessions_table(conn)
+        if version < 9:
+            _rebuild_sessions(conn)
+        
+        # State of the incremental statistics engine (see running_stats):
+        # per-hour sums, completed battery sessions and the ingest watermark
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_window_bucket (
+            bucket INTEGER PRIMARY KEY,
+            rows INTEGER NOT NULL,
+            charge_ms INTEGER NOT NULL,
+            discharge_ms INTEGER NOT NULL,
+            charged REAL NOT NULL,
+            discharged REAL NOT NULL,
+            cycles INTEGER NOT NULL,
+            full_charges INTEGER NOT NULL,
+            falling REAL NOT NULL,
+            first_ts INTEGER,
+            first_percentage REAL,
+            first_charging INTEGER
+        )
+        ''')
         cursor.execute('''
-        INSERT INTO notifications (type, level, enabled)
-        VALUES 
-            ('low_battery', 20, 1),
-            ('full_charge', 100, 1),
-            ('custom_level', 80, 0)
+        CREATE TABLE IF NOT EXISTS stats_window_session (
+            start_ts INTEGER PRIMARY KEY,
+            end_ts INTEGER NOT NULL
+        )
         ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_window_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL DEFAULT 0,
+            backend TEXT,
+            watermark INTEGER,
+            last_percentage REAL,
+            last_charging INTEGER,
+            open_session_start INTEGER
+        )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO stats_window_state (id) VALUES (1)')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT,
+            level INTEGER,
+            enabled INTEGER
+        )
+        ''')
+        
+        # Insert default notification settings if not present
+        cursor.execute('SELECT COUNT(*) FROM notifications')
+        if cursor.fetchone()[0] == 0:
+            cursor.execute('''
+            INSERT INTO notifications (type, level, enabled)
+            VALUES 
+                ('low_battery', 20, 1),
+                ('full_charge', 100, 1),
+                ('custom_level', 80, 0)
+            ''')
+        
+        # Create settings table if it doesn't exist
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+        
+        # Insert default settings if not present
+        default_settings = {
+            'update_interval': '30',
+            'start_on_boot': '0',
+            'start_minimized': '0',
+            'theme': 'clam',
+        }
+        
+        cursor.execute('SELECT COUNT(*) FROM settings')
+        if cursor.fetchone()[0] == 0:
+            for key, value in default_settings.items():
+                cursor.execute('INSERT INTO settings (key, value) VALUES (?, ?)', (key, value))
+        
+        # Version counter bumped whenever settings or notifications change,
+        # so other processes know to reload their settings cache
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings_meta (
+            version INTEGER NOT NULL
+        )
+        ''')
+        cursor.execute('SELECT COUNT(*) FROM settings_meta')
+        if cursor.fetchone()[0] == 0:
+            cursor.execute('INSERT INTO settings_meta (version) VALUES (0)')
+        
+        for table in ('settings', 'notifications'):
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS bump_settings_version_{table}_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE settings_meta SET version = version + 1;
+                END
+                ''')
+        
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    
+    _settings_cache.invalidate()
+
+
+INSERT_HISTORY_SQL = '''
+INSERT OR IGNORE INTO {table}
+(timestamp, percentage, is_charging, power_plugged, temperature, remaining_time)
+VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_COMPACT_HISTORY_SQL = '''
+INSERT OR IGNORE INTO {table}
+(timestamp, percentage, flags, temperature, remaining_time)
+VALUES (?, ?, ?, ?, ?)
+'''
+
+
+def rollup_bucket(timestamp, resolution):
+    """Start of the rollup bucket containing an epoch-millisecond timestamp
     
-    # Create settings table if it doesn't exist
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS settings (
-        key TEXT PRIMARY KEY,
-        value TEXT
+    Minute and hour buckets are aligned to the epoch; day buckets start at
+    local midnight so they match calendar dates.
+    """
+    if resolution == 'day':
+        day = from_epoch_ms(timestamp).date()
+        return to_epoch_ms(datetime.datetime.combine(day, datetime.time()))
+    return timestamp - timestamp % ROLLUP_WIDTH_MS[resolution]
+
+
+def next_rollup_bucket(timestamp, resolution):
+    """Start of the first rollup bucket beginning at or after timestamp"""
+    bucket = rollup_bucket(timestamp, resolution)
+    if bucket == timestamp:
+        return bucket
+    if resolution == 'day':
+        day = from_epoch_ms(bucket).date() + datetime.timedelta(days=1)
+        return to_epoch_ms(datetime.datetime.combine(day, datetime.time()))
+    return bucket + ROLLUP_WIDTH_MS[resolution]
+
+
+def rollup_buckets(timestamps, resolution):
+    """rollup_bucket for each of an ascending array of timestamps"""
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if resolution != 'day':
+        return timestamps - timestamps % ROLLUP_WIDTH_MS[resolution]
+    if not len(timestamps):
+        return timestamps.copy()
+    
+    # Local midnights covering the range
+    midnights = [rollup_bucket(int(timestamps[0]), 'day')]
+    while midnights[-1] <= timestamps[-1]:
+        midnights.append(next_rollup_bucket(midnights[-1] + 1, 'day'))
+    midnights = np.array(midnights, dtype=np.int64)
+    return midnights[np.searchsorted(midnights, timestamps, side='right') - 1]
+
+
+def _aggregate_rollups(rows, resolution, previous_ts=None):
+    """Fold time-ordered history rows into rollup accumulators keyed by bucket
+    
+    Each accumulator is [first_ts, last_ts, min, max, sum, last, samples,
+    charging_samples, plugged_samples, charging_ms]. Charging time is the
+    gap since the previous sample, credited when the sample reports charging.
+    """
+    buckets = {}
+    minute_to_day = {}
+    
+    for row in rows:
+        timestamp, percentage, is_charging, power_plugged = row[0], row[1], row[2], row[3]
+        if percentage is None:
+            continue
+        
+        if resolution == 'day':
+            # Day boundaries always fall on a minute boundary
+            minute = timestamp - timestamp % ROLLUP_WIDTH_MS['minute']
+            bucket = minute_to_day.get(minute)
+            if bucket is None:
+                bucket = minute_to_day[minute] = rollup_bucket(minute, 'day')
+        else:
+            bucket = timestamp - timestamp % ROLLUP_WIDTH_MS[resolution]
+        
+        charging_ms = 0
+        if is_charging and previous_ts is not None and 0 < timestamp - previous_ts <= MAX_SAMPLE_GAP_MS:
+            charging_ms = timestamp - previous_ts
+        previous_ts = timestamp
+        
+        acc = buckets.get(bucket)
+        if acc is None:
+            buckets[bucket] = [timestamp, timestamp, percentage, percentage, percentage, percentage,
+                               1, int(bool(is_charging)), int(bool(power_plugged)), charging_ms]
+        else:
+            acc[1] = timestamp
+            if percentage < acc[2]:
+                acc[2] = percentage
+            if percentage > acc[3]:
+                acc[3] = percentage
+            acc[4] += percentage
+            acc[5] = percentage
+            acc[6] += 1
+            acc[7] += bool(is_charging)
+            acc[8] += bool(power_plugged)
+            acc[9] += charging_ms
+    
+    return buckets
+
+
+def _format_rollups(buckets):
+    """Rollup accumulators as rows ordered by bucket, with the mean percentage"""
+    return [
+        (bucket, acc[0], acc[1], acc[2], acc[3], acc[4] / acc[6], acc[5], acc[6], acc[7], acc[8], acc[9])
+        for bucket, acc in sorted(buckets.items())
+    ]
+
+
+def aggregate_rollups(rows, resolution):
+    """Aggregate time-ordered history rows into rows shaped like get_battery_rollups"""
+    return _format_rollups(_aggregate_rollups(rows, resolution))
+
+
+def _merge_rollup(acc, other):
+    """Merge a later rollup accumulator into an earlier one for the same bucket"""
+    acc[0] = min(acc[0], other[0])
+    if other[1] >= acc[1]:
+        acc[1] = other[1]
+        acc[5] = other[5]
+    acc[2] = min(acc[2], other[2])
+    acc[3] = max(acc[3], other[3])
+    acc[4] += other[4]
+    acc[6] += other[6]
+    acc[7] += other[7]
+    acc[8] += other[8]
+    acc[9] += other[9]
+
+
+def _upsert_rollup_sql(resolution):
+    """UPSERT statement folding one accumulator into a rollup table"""
+    return f'''
+    INSERT INTO battery_rollup_{resolution}
+    (bucket, first_ts, last_ts, min_percentage, max_percentage, sum_percentage,
+     last_percentage, samples, charging_samples, plugged_samples, charging_ms)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (bucket) DO UPDATE SET
+        first_ts = MIN(first_ts, excluded.first_ts),
+        last_ts = MAX(last_ts, excluded.last_ts),
+        last_percentage = CASE WHEN excluded.last_ts >= last_ts
+                               THEN excluded.last_percentage ELSE last_percentage END,
+        min_percentage = MIN(min_percentage, excluded.min_percentage),
+        max_percentage = MAX(max_percentage, excluded.max_percentage),
+        sum_percentage = sum_percentage + excluded.sum_percentage,
+        samples = samples + excluded.samples,
+        charging_samples = charging_samples + excluded.charging_samples,
+        plugged_samples = plugged_samples + excluded.plugged_samples,
+        charging_ms = charging_ms + excluded.charging_ms
+    '''
+
+
+UPSERT_ROLLUP_SQL = {resolution: _upsert_rollup_sql(resolution) for resolution in ROLLUP_RESOLUTIONS}
+
+
+def _update_rollups(conn, rows, previous_ts=None):
+    """Fold newly written history rows into every rollup table"""
+    for resolution in ROLLUP_RESOLUTIONS:
+        buckets = _aggregate_rollups(rows, resolution, previous_ts)
+        conn.executemany(UPSERT_ROLLUP_SQL[resolution],
+                         [(bucket, *acc) for bucket, acc in buckets.items()])
+
+
+def _last_history_timestamp(conn):
+    """Timestamp of the newest persisted sample, or None"""
+    for (name,) in conn.execute('''
+    SELECT name FROM history_partitions WHERE row_count > 0 ORDER BY start_ts DESC
+    '''):
+        last = conn.execute(f'SELECT MAX(timestamp) FROM {name}').fetchone()[0]
+        if last is not None:
+            return last
+    
+    # Everything may have been archived
+    return conn.execute('SELECT MAX(last_ts) FROM history_archives').fetchone()[0]
+
+
+def _history_chunks(conn, columns, start=None, chunk_size=50000):
+    """Stream stored history rows at or after start in time-ordered chunks"""
+    for path in _overlapping_archives(conn, start):
+        arrays = _read_archive(path, columns, start)
+        if arrays is not None and len(arrays['timestamp']):
+            yield _arrays_to_rows(arrays, columns)
+    
+    for name, layout in _overlapping_partitions(conn, start):
+        cursor = conn.execute(
+            _select_history_sql(name, layout, columns),
+            (start if start is not None else -2**62, 2**62),
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+
+def _rebuild_rollups(conn, chunk_size=50000):
+    """Recompute every rollup table from the raw history"""
+    for resolution in ROLLUP_RESOLUTIONS:
+        conn.execute(f'DELETE FROM battery_rollup_{resolution}')
+    
+    columns = ('timestamp', 'percentage', 'is_charging', 'power_plugged')
+    previous_ts = None
+    for rows in _history_chunks(conn, columns, chunk_size=chunk_size):
+        _update_rollups(conn, rows, previous_ts)
+        previous_ts = rows[-1][0]
+
+
+def _create_sessions_table(conn):
+    """Table of continuous charging and discharging runs, one row per run
+    
+    A session runs from its first sample to the sample where the charging
+    state changes (which also starts the next session), or to the newest
+    sample. samples excludes that closing sample; full_charges counts the
+    samples in the session reaching FULL_CHARGE_LEVEL while charging;
+    energy_wh is the captured power integrated over the session, if known.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS sessions (
+        start_ts INTEGER PRIMARY KEY,
+        end_ts INTEGER NOT NULL,
+        is_charging INTEGER NOT NULL,
+        start_percentage REAL,
+        end_percentage REAL,
+        samples INTEGER NOT NULL,
+        full_charges INTEGER NOT NULL,
+        energy_wh REAL
     )
     ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS sessions_charging ON sessions (is_charging, start_ts)
+    ''')
+
+
+# Energy of a session from the power capture windows that lie inside it
+SESSION_ENERGY_SQL = '''
+SELECT SUM(mean_watts * (window_end - window_start)) / 3600000.0 FROM power_summary
+WHERE window_start >= {start} AND window_end <= {end} AND mean_watts IS NOT NULL
+'''
+
+UPSERT_SESSION_SQL = f'''
+INSERT OR REPLACE INTO sessions
+({', '.join(SESSION_COLUMNS)})
+VALUES (?, ?, ?, ?, ?, ?, ?, ({SESSION_ENERGY_SQL.format(start='?', end='?')}))
+'''
+
+
+def _crosses_full(before, after):
+    return before is not None and after is not None and before < FULL_CHARGE_LEVEL <= after
+
+
+def _fold_sessions(current, rows):
+    """Extend the open session with time-ordered history rows
+    
+    current is the open session as a list in SESSION_COLUMNS order, or
+    None. Returns the sessions closed by a change of charging state and
+    the new open session.
+    """
+    closed = []
+    for row in rows:
+        timestamp, percentage, charging = row[0], row[1], int(bool(row[2]))
+        if current is None:
+            current = [timestamp, timestamp, charging, percentage, percentage, 1, 0, None]
+            continue
+        
+        full = int(bool(charging) and _crosses_full(current[4], percentage))
+        current[1] = timestamp
+        current[4] = percentage
+        if charging == current[2]:
+            current[5] += 1
+            current[6] += full
+        else:
+            # The sample where the state changes closes this session and
+            # starts the next one
+            closed.append(current)
+            current = [timestamp, timestamp, charging, percentage, percentage, 1, full, None]
+    return closed, current
+
+
+def sessions_from_arrays(timestamps, percentages, charging):
+    """Sessions of time-ordered history arrays, as SESSION_COLUMNS tuples
     
-    # Insert default settings if not present
-    default_settings = {
-        'update_interval': '30',
-        'start_on_boot': '0',
-        'start_minimized': '0',
-        'theme': 'clam',
-    }
+    The vectorized counterpart of _fold_sessions for stores that keep no
+    sessions table; the first session starts at the first row.
+    """
+    if not len(timestamps):
+        return []
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    percentages = np.asarray(percentages, dtype=np.float64)
+    charging = np.asarray(charging, dtype=bool)
     
-    cursor.execute('SELECT COUNT(*) FROM settings')
-    if cursor.fetchone()[0] == 0:
-        for key, value in default_settings.items():
-            cursor.execute('INSERT INTO settings (key, value) VALUES (?, ?)', (key, value))
+    starts = np.concatenate(([0], np.flatnonzero(charging[1:] != charging[:-1]) + 1))
+    ends = np.append(starts[1:], len(timestamps) - 1)
+    samples = np.diff(np.append(starts, len(timestamps)))
+    full = np.flatnonzero(charging[1:] & (percentages[1:] >= FULL_CHARGE_LEVEL)
+                          & (percentages[:-1] < FULL_CHARGE_LEVEL)) + 1
+    full_charges = np.bincount(np.searchsorted(starts, full, side='right') - 1, minlength=len(starts))
     
-    conn.commit()
-    conn.close()
+    def value(percentage):
+        return None if percentage != percentage else percentage
+    
+    return [
+        (start_ts, end_ts, int(state), value(start_pct), value(end_pct), count, fulls, None)
+        for start_ts, end_ts, state, start_pct, end_pct, count, fulls in zip(
+            timestamps[starts].tolist(), timestamps[ends].tolist(), charging[starts].tolist(),
+            percentages[starts].tolist(), percentages[ends].tolist(), samples.tolist(), full_charges.tolist()
+        )
+    ]
+
+
+def _last_session(conn):
+    row = conn.execute(f'''
+    SELECT {', '.join(SESSION_COLUMNS)} FROM sessions ORDER BY start_ts DESC LIMIT 1
+    ''').fetchone()
+    return list(row) if row else None
+
+
+def _update_sessions(conn, rows):
+    """Fold newly written history rows into the sessions table
+    
+    Rows not newer than the open session (late or duplicate samples) are
+    ignored.
+    """
+    current = _last_session(conn)
+    rows = [row for row in rows if current is None or row[0] > current[1]]
+    if not rows:
+        return
+    closed, current = _fold_sessions(current, rows)
+    conn.executemany(UPSERT_SESSION_SQL, [(*session[:7], session[0], session[1])
+                                          for session in closed + [current]])
+
+
+def _rebuild_sessions(conn, chunk_size=50000):
+    """Recompute the sessions table from the raw history"""
+    conn.execute('DELETE FROM sessions')
+    for rows in _history_chunks(conn, ('timestamp', 'percentage', 'is_charging'), chunk_size=chunk_size):
+        _update_sessions(conn, rows)
+
+
+def get_sessions(start=None):
+    """Sessions overlapping [start, now), oldest first, as SESSION_COLUMNS rows
+    
+    The first session may begin before start. Buffered samples are folded
+    into the newest sessions.
+    """
+    pending = _sample_buffer.pending()
+    columns = ', '.join(SESSION_COLUMNS)
+    lower = start if start is not None else -2**62
+    
+    with get_connection_manager().reader() as conn:
+        first = conn.execute('SELECT MAX(start_ts) FROM sessions WHERE start_ts <= ?', (lower,)).fetchone()[0]
+        sessions = [list(row) for row in conn.execute(f'''
+        SELECT {columns} FROM sessions WHERE start_ts >= ? ORDER BY start_ts
+        ''', (first if first is not None else lower,))]
+        last = _last_session(conn)
+    
+    pending = [row for row in pending if last is None or row[0] > last[1]]
+    if pending:
+        if sessions and sessions[-1][0] == last[0]:
+            sessions.pop()
+        closed, current = _fold_sessions(last, pending)
+        sessions.extend(closed)
+        sessions.append(current)
+    
+    return [tuple(session) for session in sessions if session[1] >= lower]
+
+
+def import_history(arrays, chunk_size=100000):
+    """Bulk-load time-ordered history arrays, e.g. a recorded or synthetic trace
+    
+    arrays maps every history column to an equally long array. Rollups are
+    updated incrementally when the rows are newer than everything stored,
+    and rebuilt otherwise. Returns the number of rows written.
+    """
+    flush_battery_history()
+    total = len(arrays['timestamp'])
+    if total == 0:
+        return 0
+    
+    with get_connection_manager().writer() as conn:
+        previous_ts = _last_history_timestamp(conn)
+        appending = previous_ts is None or int(arrays['timestamp'][0]) > previous_ts
+        
+        for start in range(0, total, chunk_size):
+            chunk = {name: np.asarray(arrays[name])[start:start + chunk_size] for name in HISTORY_COLUMNS}
+            rows = _arrays_to_rows(chunk, HISTORY_COLUMNS)
+            _write_history(conn, rows)
+            if appending:
+                _update_rollups(conn, rows, previous_ts)
+                _update_sessions(conn, rows)
+                previous_ts = rows[-1][0]
+        
+        if not appending:
+            _rebuild_rollups(conn)
+            _rebuild_sessions(conn)
+            reset_running_statistics(conn)
+    
+    return total
+
+
+def rebuild_rollups():
+    """Recompute the minute/hour/day rollups and the sessions from the raw battery history"""
+    flush_battery_history()
+    with get_connection_manager().writer() as conn:
+        _rebuild_rollups(conn)
+        _rebuild_sessions(conn)
 
 
 def save_battery_info(battery_info):
-    """Save battery information to the database"""
+    """Save battery information to the database
+    
+    Samples are buffered and written in batches; call flush_battery_history
+    to force pending samples to disk. A 'timestamp' key (epoch milliseconds)
+    records when the reading was taken; otherwise the current time is used.
+    """
     if not battery_info:
         return False
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    INSERT INTO battery_history 
-    (timestamp, percentage, is_charging, power_plugged, temperature, remaining_time)
-    VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        datetime.datetime.now().isoformat(),
+    due = _sample_buffer.add((
+        battery_info.get('timestamp') or now_epoch_ms(),
         battery_info['percentage'],
         int(battery_info['is_charging']),
         int(battery_info['power_plugged']),
@@ -106,112 +1488,420 @@ def save_battery_info(battery_info):
         battery_info['remaining_time']
     ))
     
-    conn.commit()
-    conn.close()
+    if due:
+        flush_battery_history()
     return True
 
 
-def get_battery_history(days=7):
-    """Get battery history for the specified number of days"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def flush_battery_history():
+    """Write all buffered samples in a single transaction
+    
+    Returns the number of rows written.
+    """
+    with _sample_buffer.flush_lock:
+        rows = _sample_buffer.pending()
+        if not rows:
+            return 0
+        
+        with diag.stage('persist.commit'), get_connection_manager().writer() as conn:
+            previous_ts = _last_history_timestamp(conn)
+            _write_history(conn, rows)
+            _update_rollups(conn, rows, previous_ts)
+            _update_sessions(conn, rows)
+        _sample_buffer.discard(len(rows))
+    
+    return len(rows)
+
+
+def choose_rollup_resolution(days, max_points):
+    """Pick the coarsest rollup that still gives max_points over the range
+    
+    Returns None when even minute rollups would be too coarse, meaning the
+    raw samples should be read instead.
+    """
+    span_ms = days * ROLLUP_WIDTH_MS['day']
+    for resolution in reversed(ROLLUP_RESOLUTIONS):
+        if span_ms / ROLLUP_WIDTH_MS[resolution] >= max_points:
+            return resolution
+    return None
+
+
+def _rollups_as_history(rollups):
+    """History rows standing in for rollup buckets: the first timestamp,
+    mean percentage and majority charging/plugged state of each bucket"""
+    return [
+        (first_ts, mean, int(charging * 2 > samples), int(plugged * 2 > samples), None, None)
+        for (bucket, first_ts, last_ts, low, high, mean, last,
+             samples, charging, plugged, charging_ms) in rollups
+    ]
+
+
+def get_battery_history(days=7, max_points=None):
+    """Get battery history for the specified number of days
+    
+    Rows are (timestamp, percentage, is_charging, power_plugged, temperature,
+    remaining_time) with the timestamp in epoch milliseconds. When max_points
+    is given, the coarsest rollup resolution providing at least that many
+    points is used instead of the raw samples; each row then carries the
+    bucket's mean percentage and majority charging/plugged state.
+    """
+    resolution = choose_rollup_resolution(days, max_points) if max_points else None
+    if resolution is not None:
+        return _rollups_as_history(get_battery_rollups(days, resolution))
     
     # Calculate the date threshold
-    date_threshold = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+    date_threshold = days_ago_epoch_ms(days)
     
-    cursor.execute('''
-    SELECT timestamp, percentage, is_charging, power_plugged, temperature, remaining_time
-    FROM battery_history
-    WHERE timestamp >= ?
-    ORDER BY timestamp
-    ''', (date_threshold,))
+    # Snapshot the write buffer first so a concurrent flush cannot hide rows
+    pending = _sample_buffer.pending(date_threshold)
     
-    history = cursor.fetchall()
-    conn.close()
+    with get_connection_manager().reader() as conn:
+        history = _read_history(conn, HISTORY_COLUMNS, date_threshold)
     
+    # Include samples that are still waiting in the write buffer
+    last = history[-1][0] if history else None
+    history.extend(row for row in pending if last is None or row[0] > last)
     return history
 
 
-def get_notification_settings():
-    """Get notification settings from the database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def get_battery_history_arrays(start=None, end=None, columns=HISTORY_COLUMNS, max_points=None):
+    """Get battery history in [start, end) as contiguous NumPy arrays
+    
+    start and end are epoch milliseconds (None leaves that side open).
+    Returns a dict mapping each requested column to an array typed per
+    HISTORY_ARRAY_DTYPES. Rows are decoded straight from the cursor into a
+    structured array, so there is no per-row Python object beyond the
+    sqlite3 tuple; archived weeks are decoded block-wise. With max_points, rollups are read as in
+    get_battery_history.
+    """
+    columns = tuple(columns)
+    for name in columns:
+        if name not in HISTORY_ARRAY_DTYPES:
+            raise ValueError(f"Unknown history column: {name}")
+    
+    # The timestamp is always read so buffered rows can be merged in order
+    selected = ('timestamp',) + tuple(name for name in columns if name != 'timestamp')
+    dtype = np.dtype([(name, HISTORY_ARRAY_DTYPES[name]) for name in selected])
+    
+    if max_points:
+        lower = start if start is not None else 0
+        days = ((end if end is not None else now_epoch_ms()) - lower) / ROLLUP_WIDTH_MS['day']
+        resolution = choose_rollup_resolution(days, max_points)
+        if resolution is not None:
+            rows = _rollups_as_history(get_rollups_range(lower, end, resolution))
+            index = [HISTORY_COLUMNS.index(name) for name in selected]
+            records = np.fromiter((tuple(row[i] for i in index) for row in rows), dtype=dtype, count=len(rows))
+            return {name: np.ascontiguousarray(records[name]) for name in columns}
+    
+    pending = _sample_buffer.pending(start)
+    if end is not None:
+        pending = [row for row in pending if row[0] < end]
     
-    cursor.execute('SELECT type, level, enabled FROM notifications')
-    settings = cursor.fetchall()
+    chunks = []
+    with get_connection_manager().reader() as conn:
+        for path in _overlapping_archives(conn, start, end):
+            arrays = _read_archive(path, selected, start, end)
+            if arrays is not None and len(arrays['timestamp']):
+                chunk = np.empty(len(arrays['timestamp']), dtype=dtype)
+                for name in selected:
+                    chunk[name] = arrays[name]
+                chunks.append(chunk)
+        
+        lower = start if start is not None else -2**62
+        upper = end if end is not None else 2**62
+        for name, layout in _overlapping_partitions(conn, start, end):
+            cursor = conn.execute(_select_history_sql(name, layout, selected), (lower, upper))
+            chunk = np.fromiter(cursor, dtype=dtype)
+            if len(chunk):
+                chunks.append(chunk)
     
-    conn.close()
+    # Include samples that are still waiting in the write buffer
+    last = int(chunks[-1]['timestamp'][-1]) if chunks else None
+    index = [HISTORY_COLUMNS.index(name) for name in selected]
+    pending = [tuple(row[i] for i in index) for row in pending if last is None or row[0] > last]
+    if pending:
+        chunks.append(np.fromiter(pending, dtype=dtype, count=len(pending)))
     
-    return settings
+    records = np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+    return {name: np.ascontiguousarray(records[name]) for name in columns}
 
 
-def update_notification_setting(notification_type, level=None, enabled=None):
-    """Update a notification setting"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def get_history_bounds(start=None):
+    """Timestamps of the first and the newest sample at or after start
     
-    if level is not None:
-        cursor.execute('''
-        UPDATE notifications 
-        SET level = ? 
-        WHERE type = ?
-        ''', (level, notification_type))
+    (None, None) when there are none. Buffered samples count. Each bound
+    is a primary-key lookup, so this is cheap enough to run per query.
+    """
+    pending = _sample_buffer.pending(start)
+    first = last = None
     
-    if enabled is not None:
-        cursor.execute('''
-        UPDATE notifications 
-        SET enabled = ? 
-        WHERE type = ?
-        ''', (1 if enabled else 0, notification_type))
+    with get_connection_manager().reader() as conn:
+        first = _first_archived(conn, start)
+        if first is None:
+            lower = start if start is not None else -2**62
+            for name, layout in _overlapping_partitions(conn, start):
+                first = conn.execute(f'SELECT MIN(timestamp) FROM {name} WHERE timestamp >= ?', (lower,)).fetchone()[0]
+                if first is not None:
+                    break
+        
+        if first is not None:
+            last = _last_history_timestamp(conn)
     
-    conn.commit()
-    conn.close()
+    if pending:
+        first = pending[0][0] if first is None else min(first, pending[0][0])
+        last = pending[-1][0] if last is None else max(last, pending[-1][0])
+    return first, last
 
 
-def get_setting(key, default=None):
-    """Get a setting value from the database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def get_history_generation():
+    """Counter bumped whenever stored history is rewritten rather than appended"""
+    with get_connection_manager().reader() as conn:
+        row = conn.execute('SELECT generation FROM stats_window_state WHERE id = 1').fetchone()
+    return row[0] if row else 0
+
+
+def get_battery_rollups(days=7, resolution='day'):
+    """Get rollup buckets covering the specified number of days
     
-    cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-    result = cursor.fetchone()
+    Rows are (bucket, first_ts, last_ts, min_percentage, max_percentage,
+    mean_percentage, last_percentage, samples, charging_samples,
+    plugged_samples, charging_ms). The partially covered first bucket is
+    aggregated from raw samples and buffered samples are folded in, so the
+    result matches aggregating get_battery_history(days) directly.
+    """
+    return get_rollups_range(days_ago_epoch_ms(days), None, resolution)
+
+
+def get_rollups_range(start, end=None, resolution='day'):
+    """Get rollup buckets covering [start, end), shaped like get_battery_rollups
     
-    conn.close()
+    Buckets only partly inside the range are aggregated from raw samples,
+    so the result matches aggregating the raw rows of the range directly.
+    """
+    columns = ('timestamp', 'percentage', 'is_charging', 'power_plugged')
+    head_end = next_rollup_bucket(start, resolution)
+    tail_start = None
+    if end is not None:
+        tail_start = max(rollup_bucket(end, resolution), head_end)
+        head_end = min(head_end, end)
+    pending = _sample_buffer.pending(start)
+    if end is not None:
+        pending = [row for row in pending if row[0] < end]
     
-    if result:
-        return result[0]
-    return default
+    with get_connection_manager().reader() as conn:
+        head_rows = _read_history(conn, columns, start, head_end)
+        
+        stored = conn.execute(f'''
+        SELECT bucket, first_ts, last_ts, min_percentage, max_percentage, sum_percentage,
+               last_percentage, samples, charging_samples, plugged_samples, charging_ms
+        FROM battery_rollup_{resolution}
+        WHERE bucket >= ? AND bucket < ?
+        ORDER BY bucket
+        ''', (head_end, tail_start if tail_start is not None else 2**62)).fetchall()
 
+        if not head_rows and stored:
+            # The first sample in range then opens a stored bucket, whose
+            # charging time counts the gap since a sample before the range
+            head_rows = _read_history(conn, columns, stored[0][0], next_rollup_bucket(stored[0][0] + 1, resolution))
+            stored = stored[1:]
 
-def update_setting(key, value):
-    """Update a setting value in the database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+        tail_rows = _read_history(conn, columns, tail_start, end) if end is not None and tail_start < end else []
+        
+        last = _last_history_timestamp(conn)
+    
+    buckets = _aggregate_rollups(head_rows, resolution)
+    for row in stored:
+        buckets[row[0]] = list(row[1:])
     
-    cursor.execute('''
-    INSERT OR REPLACE INTO settings (key, value)
-    VALUES (?, ?)
-    ''', (key, str(value)))
+    # Fold in the partly covered last bucket, then samples that are still
+    # waiting in the write buffer
+    previous = max((acc[1] for acc in buckets.values()), default=None)
+    pending = [row for row in pending if last is None or row[0] > last]
+    for rows, previous_ts in ((tail_rows, previous), (pending, last)):
+        for bucket, acc in _aggregate_rollups(rows, resolution, previous_ts).items():
+            if bucket in buckets:
+                _merge_rollup(buckets[bucket], acc)
+            else:
+                buckets[bucket] = acc
     
-    conn.commit()
-    conn.close()
+    return _format_rollups(buckets)
+
+
+def save_power_summaries(rows):
+    """Store power capture summaries
+    
+    Rows are (window_start, window_end, samples, mean_watts, p95_watts,
+    max_watts, charging_samples); a window already stored is replaced.
+    """
+    if not rows:
+        return 0
+    
+    with get_connection_manager().writer() as conn:
+        conn.executemany('''
+        INSERT OR REPLACE INTO power_summary
+            (window_start, window_end, samples, mean_watts, p95_watts, max_watts, charging_samples)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        
+        # Sessions spanning the new windows now know more of their energy
+        start = min(row[0] for row in rows)
+        end = max(row[1] for row in rows)
+        energy = SESSION_ENERGY_SQL.format(start='sessions.start_ts', end='sessions.end_ts')
+        conn.execute(f'''
+        UPDATE sessions SET energy_wh = ({energy})
+        WHERE end_ts >= ? AND start_ts < ?
+        ''', (start, end))
+    return len(rows)
+
+
+def get_power_summaries(start=None, end=None):
+    """Get power capture summaries with window_start in [start, end), oldest first"""
+    with get_connection_manager().reader() as conn:
+        return conn.execute('''
+        SELECT window_start, window_end, samples, mean_watts, p95_watts, max_watts, charging_samples
+        FROM power_summary
+        WHERE window_start >= ? AND window_start < ?
+        ORDER BY window_start
+        ''', (start if start is not None else -2**63, end if end is not None else 2**63 - 1)).fetchall()
+
+
+def get_notification_settings():
+    """Get notification settings from the database"""
+    return _settings_cache.get_notification_settings()
+
+
+def update_notification_setting(notification_type, level=None, enabled=None):
+    """Update a notification setting"""
+    with get_connection_manager().writer() as conn:
+        if level is not None:
+            conn.execute('''
+            UPDATE notifications 
+            SET level = ? 
+            WHERE type = ?
+            ''', (level, notification_type))
+        
+        if enabled is not None:
+            conn.execute('''
+            UPDATE notifications 
+            SET enabled = ? 
+            WHERE type = ?
+            ''', (1 if enabled else 0, notification_type))
+        
+        _settings_cache.write_through(conn)
+
+
+def get_setting(key, default=None):
+    """Get a setting value from the database"""
+    return _settings_cache.get_setting(key, default)
+
+
+def update_setting(key, value):
+    """Update a setting value in the database"""
+    with get_connection_manager().writer() as conn:
+        conn.execute('''
+        INSERT OR REPLACE INTO settings (key, value)
+        VALUES (?, ?)
+        ''', (key, str(value)))
+        
+        _settings_cache.write_through(conn)
 
 
 def clear_old_history(days_to_keep=30):
-    """Remove battery history older than specified days"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    """Remove battery history older than specified days
     
+    Partitions entirely before the threshold are dropped whole; only the
+    partition straddling it needs a (primary-key range) DELETE. Archives
+    are treated the same way: expired ones are deleted and the one
+    straddling the threshold is rewritten without the older samples.
+    """
     # Calculate the date threshold
-    date_threshold = (datetime.datetime.now() - datetime.timedelta(days=days_to_keep)).isoformat()
+    date_threshold = days_ago_epoch_ms(days_to_keep)
+    deleted_rows = 0
+    removed_files = []
+    staged = []
+    committed = False
     
-    cursor.execute('''
-    DELETE FROM battery_history
-    WHERE timestamp < ?
-    ''', (date_threshold,))
+    try:
+        with get_connection_manager().writer() as conn:
+            archives = conn.execute('''
+            SELECT name, end_ts, row_count, filename FROM history_archives
+            WHERE start_ts < ?
+            ''', (date_threshold,)).fetchall()
+            
+            for name, end_ts, row_count, filename in archives:
+                path = os.path.join(archive_dir(), filename)
+                arrays = _read_archive(path, HISTORY_COLUMNS) if end_ts > date_threshold else None
+                keep = arrays['timestamp'] >= date_threshold if arrays is not None else None
+                if end_ts <= date_threshold or (keep is not None and not keep.any()):
+                    conn.execute('DELETE FROM history_archives WHERE name = ?', (name,))
+                    removed_files.append(path)
+                    deleted_rows += row_count
+                    continue
+                if keep is None or keep.all():
+                    continue
+                _stage_archive(path, {column: values[keep] for column, values in arrays.items()}, staged)
+                conn.execute('''
+                UPDATE history_archives SET row_count = ?, first_ts = ? WHERE name = ?
+                ''', (int(keep.sum()), int(arrays['timestamp'][keep][0]), name))
+                deleted_rows += int((~keep).sum())
+            
+            expired = conn.execute('''
+            SELECT name, end_ts, row_count FROM history_partitions
+            WHERE start_ts < ?
+            ''', (date_threshold,)).fetchall()
+            
+            for name, end_ts, row_count in expired:
+                if end_ts <= date_threshold:
+                    conn.execute(f'DROP TABLE IF EXISTS {name}')
+                    conn.execute('DELETE FROM history_partitions WHERE name = ?', (name,))
+                    deleted_rows += row_count
+                else:
+                    cursor = conn.execute(f'DELETE FROM {name} WHERE timestamp < ?', (date_threshold,))
+                    conn.execute('''
+                    UPDATE history_partitions SET row_count = row_count - ? WHERE name = ?
+                    ''', (cursor.rowcount, name))
+                    deleted_rows += cursor.rowcount
+            
+            # Drop rollup buckets that now lie entirely before the threshold
+            for resolution in ROLLUP_RESOLUTIONS:
+                conn.execute(f'''
+                DELETE FROM battery_rollup_{resolution}
+                WHERE bucket < ? AND last_ts < ?
+                ''', (date_threshold, date_threshold))
+            
+            conn.execute('DELETE FROM power_summary WHERE window_end <= ?', (date_threshold,))
+            conn.execute('DELETE FROM sessions WHERE end_ts < ?', (date_threshold,))
+            
+            if deleted_rows:
+                reset_running_statistics(conn)
+        committed = True
+    finally:
+        _install_staged_archives(staged, committed)
     
-    deleted_rows = cursor.rowcount
-    conn.commit()
-    conn.close()
+    # Archive files go only once the catalog no longer lists them
+    for path in removed_files:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
     
     return deleted_rows
+
+
+def reset_running_statistics(conn=None):
+    """Discard the incremental statistics state after history was rewritten
+    
+    Bumping the generation tells running aggregators in other processes
+    to rebuild from the history instead of saving their stale state.
+    """
+    if conn is None:
+        with get_connection_manager().writer() as conn:
+            return reset_running_statistics(conn)
+    
+    conn.execute('DELETE FROM stats_window_bucket')
+    conn.execute('DELETE FROM stats_window_session')
+    conn.execute('''
+    UPDATE stats_window_state
+    SET generation = generation + 1, backend = NULL, watermark = NULL,
+        last_percentage = NULL, last_charging = NULL, open_session_start = NULL
+    ''')
@@ -0,0 +1,339 @@
+"""
+Diagnostics for PowerPulse
+
+This module times the stages of the monitoring pipeline (provider reads,
+persisting, notifications, statistics, rendering) into per-stage counters
+and latency histograms, and can attach a cProfile or sampling profiler.
+Instrumentation is off by default; while disabled, an instrumented call
+costs one flag check.
+"""
+
+import io
+import os
+import sys
+import time
+import threading
+import functools
+from collections import Counter
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket
+# takes everything slower
+HISTOGRAM_BOUNDS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# Seconds between stack samples for the sampling profiler
+SAMPLING_INTERVAL = 0.005
+
+_enabled = os.environ.get('POWERPULSE_DIAG', '') not in ('', '0')
+_lock = threading.Lock()
+_stages = {}
+_counters = Counter()
+_started = time.time()
+
+
+class StageStats:
+    """Call count, errors and a latency histogram for one stage"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def add(self, seconds, error=False):
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(HISTOGRAM_BOUNDS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, q):
+        """Approximate percentile, interpolated within its histogram bucket"""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                # Bucket edges, narrowed to the observed range
+                low = max(HISTOGRAM_BOUNDS[i - 1] if i else 0.0, self.min)
+                high = min(HISTOGRAM_BOUNDS[i] if i < len(HISTOGRAM_BOUNDS) else self.max, self.max)
+                return low + (high - low) * max(0.0, rank - seen) / count
+            seen += count
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'histogram': self.buckets,
+        }
+
+
+def enable(flag=True):
+    """Turn instrumentation on or off for this process"""
+    global _enabled
+    _enabled = bool(flag)
+
+
+def is_enabled():
+    return _enabled
+
+
+def record(name, seconds, error=False):
+    """Add one timed call of a stage"""
+    with _lock:
+        stats = _stages.get(name)
+        if stats is None:
+            stats = _stages[name] = StageStats()
+        stats.add(seconds, error)
+
+
+def count(name, n=1):
+    """Bump a counter"""
+    if _enabled:
+        with _lock:
+            _counters[name] += n
+
+
+class _Stage:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.perf_counter() - self.started, exc_type is not None)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """Context manager timing a block as one call of a stage"""
+    return _Stage(name) if _enabled else _NULL_STAGE
+
+
+def timed(name):
+    """Decorator timing every call of a function as a stage"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    """Current stage statistics and counters as plain, JSON-ready data"""
+    with _lock:
+        stages = {name: stats.to_dict() for name, stats in _stages.items()}
+        counters = dict(_counters)
+    return {
+        'enabled': _enabled,
+        'pid': os.getpid(),
+        'since': _started,
+        'histogram_bounds': list(HISTOGRAM_BOUNDS),
+        'stages': stages,
+        'counters': counters,
+        'profiler': _profiler.kind if _profiler is not None else None,
+    }
+
+
+def reset():
+    """Forget all recorded stages and counters"""
+    global _started
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _started = time.time()
+
+
+def _ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.2f}"
+
+
+def format_report(data):
+    """Human-readable table of a snapshot()"""
+    lines = []
+    elapsed = time.time() - data['since']
+    state = 'enabled' if data['enabled'] else 'disabled'
+    lines.append(f"Instrumentation {state} in process {data['pid']}, collecting for {elapsed:.0f} s")
+    if data.get('profiler'):
+        lines.append(f"Profiler running: {data['profiler']}")
+
+    stages = data['stages']
+    if stages:
+        lines.append("")
+        lines.append(f"{'Stage':<22}{'Calls':>8}{'Errors':>8}{'Mean ms':>10}{'p50 ms':>10}"
+                     f"{'p95 ms':>10}{'p99 ms':>10}{'Max ms':>10}{'Total s':>10}")
+        lines.append("-" * 98)
+        for name in sorted(stages):
+            s = stages[name]
+            lines.append(f"{name:<22}{s['count']:>8}{s['errors']:>8}{_ms(s['mean']):>10}{_ms(s['p50']):>10}"
+                         f"{_ms(s['p95']):>10}{_ms(s['p99']):>10}{_ms(s['max']):>10}{s['total']:>10.2f}")
+    else:
+        lines.append("No stages recorded")
+
+    if data['counters']:
+        lines.append("")
+        for name in sorted(data['counters']):
+            lines.append(f"{name:<22}{data['counters'][name]:>8}")
+    return "\n".join(lines)
+
+
+class SamplingProfiler:
+    """Samples the stacks of every other thread at a fixed interval
+
+    Cheaper than cProfile on a long-running service, and it sees time
+    spent blocked in system calls and subprocesses as well.
+    """
+
+    kind = 'sampling'
+
+    def __init__(self, interval=SAMPLING_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.own = Counter()
+        self.cumulative = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                self.samples += 1
+                self.own[self._describe(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    where = self._describe(frame)
+                    if where not in seen:
+                        seen.add(where)
+                        self.cumulative[where] += 1
+                    frame = frame.f_back
+
+    @staticmethod
+    def _describe(frame):
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='powerpulse-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def report(self, limit=25):
+        lines = [f"{self.samples} stack samples every {self.interval * 1000:.0f} ms", ""]
+        lines.append(f"{'Own %':>8}{'Total %':>9}  Function")
+        for where, hits in self.cumulative.most_common(limit):
+            own = self.own.get(where, 0)
+            lines.append(f"{own * 100 / max(self.samples, 1):>8.1f}{hits * 100 / max(self.samples, 1):>9.1f}  {where}")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            f.write(self.report(limit=None) + "\n")
+
+
+class CProfileProfiler:
+    """Deterministic profiler for the thread that starts it
+
+    Before Python 3.12 other threads are not profiled; use the sampling
+    profiler to see the service's worker threads.
+    """
+
+    kind = 'cprofile'
+
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def report(self, limit=25):
+        import pstats
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+PROFILERS = {
+    'cprofile': CProfileProfiler,
+    'sampling': SamplingProfiler,
+}
+
+_profiler = None
+
+
+def start_profiler(kind='sampling'):
+    """Attach a profiler to this process; returns it"""
+    global _profiler
+
+    if kind not in PROFILERS:
+        raise ValueError(f"Unknown profiler: {kind}")
+    stop_profiler()
+    _profiler = PROFILERS[kind]()
+    _profiler.start()
+    return _profiler
+
+
+def stop_profiler(path=None, limit=25):
+    """Detach the profiler; returns its report, also saved to path if given"""
+    global _profiler
+
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    profiler.stop()
+    if path:
+        profiler.dump(path)
+    return profiler.report(limit)
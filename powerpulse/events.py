@@ -0,0 +1,133 @@
+"""
+Power supply event listener for PowerPulse
+
+This module listens for kernel uevents from the power_supply class over a
+netlink socket, so monitoring can sample as soon as the adapter is plugged
+or the battery changes state instead of waiting for the next poll.
+"""
+
+import time
+import socket
+import select
+
+# Not exported by the socket module
+NETLINK_KOBJECT_UEVENT = 15
+
+# Multicast group the kernel sends uevents to (udev rebroadcasts on group 2)
+UEVENT_KERNEL_GROUP = 1
+
+RECV_BUFFER_SIZE = 16384
+
+# Quiet period used to coalesce the burst of uevents one change produces
+# (adapter and battery usually report together)
+SETTLE_DELAY = 0.2
+MAX_SETTLE = 1.0
+
+# Fallback poll interval in seconds when sampling on events
+EVENT_POLL_INTERVAL = 300
+
+
+def parse_uevent(data):
+    """Parse a kernel uevent message into a dict, or None if malformed
+
+    Kernel messages look like b'change@/devices/...\\0ACTION=change\\0KEY=value\\0...'.
+    Messages rebroadcast by udev start with b'libudev' and are ignored.
+    """
+    if not data or data.startswith(b'libudev'):
+        return None
+
+    parts = data.split(b'\0')
+    header = parts[0].decode('utf-8', 'replace')
+    if '@' not in header:
+        return None
+
+    event = {}
+    for part in parts[1:]:
+        key, sep, value = part.decode('utf-8', 'replace').partition('=')
+        if sep:
+            event[key] = value
+    event.setdefault('ACTION', header.split('@', 1)[0])
+    event.setdefault('DEVPATH', header.split('@', 1)[1])
+    return event
+
+
+def open_uevent_socket():
+    """Open a netlink socket subscribed to kernel uevents"""
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC, NETLINK_KOBJECT_UEVENT)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.bind((0, UEVENT_KERNEL_GROUP))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class UeventListener:
+    """Waits for power_supply uevents on a netlink socket
+
+    sock may be any object with recv() and fileno(), such as one end of a
+    socket.socketpair(), so tests can feed the listener their own messages.
+    """
+
+    def __init__(self, sock=None, subsystem='power_supply'):
+        self.sock = sock if sock is not None else open_uevent_socket()
+        self.subsystem = subsystem
+
+    def receive(self):
+        """Read one message and return it if it matches the subsystem"""
+        try:
+            data = self.sock.recv(RECV_BUFFER_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return None
+        event = parse_uevent(data)
+        if event and event.get('SUBSYSTEM') == self.subsystem:
+            return event
+        return None
+
+    def _readable(self, timeout):
+        try:
+            ready, _, _ = select.select([self.sock], [], [], timeout)
+        except InterruptedError:
+            return False
+        return bool(ready)
+
+    def wait(self, timeout=None):
+        """Block until power supply events arrive or timeout seconds pass
+
+        Returns the events received, coalescing a burst into one call, or an
+        empty list on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        events = []
+        while not events:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not self._readable(remaining):
+                return events
+            event = self.receive()
+            if event:
+                events.append(event)
+
+        settle_deadline = time.monotonic() + MAX_SETTLE
+        while time.monotonic() < settle_deadline and self._readable(SETTLE_DELAY):
+            event = self.receive()
+            if event:
+                events.append(event)
+        return events
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        """Close the underlying socket"""
+        self.sock.close()
+
+
+def open_listener():
+    """Open a power supply event listener, or return None if unsupported"""
+    try:
+        return UeventListener()
+    except (OSError, AttributeError) as e:
+        # AttributeError: no AF_NETLINK outside Linux
+        print(f"Power supply events unavailable, polling instead: {e}")
+        return None
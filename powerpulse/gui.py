@@ -6,7 +6,6 @@ This module implements the graphical user interface for the application.
 
 import os
 import sys
-import time
 import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
@@ -14,11 +13,15 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 from powerpulse.battery import get_battery_info
 from powerpulse.database import (
-    setup_database, save_battery_info, get_notification_settings,
-    update_notification_setting, get_setting, update_setting
+    setup_database, get_notification_settings, update_notification_setting,
+    get_setting, update_setting
 )
-from powerpulse.stats import calculate_statistics, generate_history_plot, generate_daily_usage_plot
+from powerpulse.storage import get_backend
+from powerpulse.stats import generate_history_plot, generate_daily_usage_plot
+from powerpulse.running_stats import get_running_statistics, running_statistics
+from powerpulse.analysis import get_context
 from powerpulse.notifications import check_notifications
+from powerpulse.sampling import Sampler, store_reading
 
 
 class PowerPulseGUI:
@@ -46,8 +49,8 @@ class PowerPulseGUI:
         self.current_time = tk.StringVar(value="--")
         self.update_interval = tk.IntVar(value=int(get_setting('update_interval', '30')))
         self.monitoring_active = False
-        self.monitoring_thread = None
-        self.update_gui_job = None
+        self.sampler = None
+        self.latest_info = None
         
         # Create tabs
         self.tab_control = ttk.Notebook(self.root)
@@ -73,6 +76,9 @@ class PowerPulseGUI:
         # Set up system tray icon if available
         self.setup_tray_icon()
         
+        # Readings from the sampler thread arrive as a virtual event
+        self.root.bind('<<BatteryReading>>', self.show_latest_reading)
+        
         # Initial battery check
         self.update_battery_info()
         
@@ -146,6 +152,11 @@ class PowerPulseGUI:
     
     def exit_app(self, icon=None, item=None):
         """Exit the application from tray icon"""
+        self.monitoring_active = False
+        if self.sampler:
+            self.sampler.stop(timeout=5)
+        get_backend().flush()
+        get_running_statistics().save()
         if self.tray_icon:
             self.tray_icon.stop()
         self.root.quit()
@@ -444,9 +455,9 @@ X-GNOME-Autostart-enabled=true
             self.monitoring_active = False
             self.monitor_button.config(text="Start Monitoring")
             
-            if self.update_gui_job:
-                self.root.after_cancel(self.update_gui_job)
-                self.update_gui_job = None
+            if self.sampler:
+                self.sampler.stop()
+                self.sampler = None
         else:
             # Start monitoring
             self.monitoring_active = True
@@ -455,34 +466,30 @@ X-GNOME-Autostart-enabled=true
             # Update interval setting
             update_setting('update_interval', self.update_interval.get())
             
-            # Start the monitoring thread
-            if not self.monitoring_thread or not self.monitoring_thread.is_alive():
-                self.monitoring_thread = threading.Thread(target=self.monitoring_loop, daemon=True)
-                self.monitoring_thread.start()
-            
-            # Schedule regular GUI updates
-            self.update_gui()
+            # Sample in the background; each reading is stored, checked for
+            # notifications and shown once
+            self.sampler = Sampler(self.update_interval.get())
+            self.sampler.subscribe(store_reading)
+            self.sampler.subscribe(check_notifications)
+            self.sampler.subscribe(self.on_battery_reading)
+            self.sampler.start()
     
-    def monitoring_loop(self):
-        """Background thread for battery monitoring"""
-        while self.monitoring_active:
-            # Save battery info to database
-            info = get_battery_info()
-            if info:
-                save_battery_info(info)
-                check_notifications(info)
-            
-            # Sleep for the specified interval
-            time.sleep(self.update_interval.get())
+    def on_battery_reading(self, info):
+        """Sampler subscriber; hands the reading to the Tk thread"""
+        self.latest_info = info
+        try:
+            self.root.event_generate('<<BatteryReading>>', when='tail')
+        except tk.TclError:
+            # The window is being destroyed
+            pass
     
-    def update_gui(self):
-        """Update the GUI with latest battery information"""
-        if self.monitoring_active:
-            self.update_battery_info()
-            self.update_gui_job = self.root.after(self.update_interval.get() * 1000, self.update_gui)
+    def show_latest_reading(self, event=None):
+        """Display the most recent reading published by the sampler"""
+        if self.latest_info:
+            self.show_battery_info(self.latest_info)
     
     def update_battery_info(self):
-        """Update the current battery information display"""
+        """Read the battery now and update the display"""
         info = get_battery_info()
         
         if not info:
@@ -491,11 +498,10 @@ X-GNOME-Autostart-enabled=true
             self.current_time.set("")
             return
         
-        # Save to database if monitoring is active
-        if self.monitoring_active:
-            save_battery_info(info)
-            check_notifications(info)
-        
+        return self.show_battery_info(info)
+    
+    def show_battery_info(self, info):
+        """Update the current battery information display"""
         # Update display
         self.current_percentage.set(f"{int(info['percentage'])}%")
         
@@ -526,7 +532,7 @@ X-GNOME-Autostart-enabled=true
         
         # Generate a new plot
         days = self.history_days.get()
-        fig = generate_history_plot(days)
+        fig = generate_history_plot(days, context=get_context(days))
         
         if fig:
             canvas = FigureCanvasTkAgg(fig, self.history_plot_frame)
@@ -544,7 +550,7 @@ X-GNOME-Autostart-enabled=true
         
         # Generate a new plot
         days = self.history_days.get()
-        fig = generate_daily_usage_plot(days)
+        fig = generate_daily_usage_plot(days, context=get_context(days))
         
         if fig:
             canvas = FigureCanvasTkAgg(fig, self.daily_usage_frame)
@@ -562,7 +568,7 @@ X-GNOME-Autostart-enabled=true
         
         # Calculate new statistics
         days = self.stats_days.get()
-        stats = calculate_statistics(days)
+        stats = running_statistics(days)
         
         # Display statistics in a grid
         row = 0
@@ -601,6 +607,12 @@ X-GNOME-Autostart-enabled=true
         if stats['longest_session'] is not None:
             ttk.Label(stat_frame, text="Longest Battery Session:").grid(row=row, column=0, sticky="w", padx=(0, 10), pady=5)
             ttk.Label(stat_frame, text=f"{stats['longest_session']:.2f} hours").grid(row=row, column=1, sticky="w")
+            row += 1
+        
+        if stats['median_session'] is not None:
+            ttk.Label(stat_frame, text="Median Battery Session:").grid(row=row, column=0, sticky="w", padx=(0, 10), pady=5)
+            ttk.Label(stat_frame, text=f"{stats['median_session']:.2f} hours").grid(row=row, column=1, sticky="w")
+            row += 1
         
         # If no stats available
         if not any(value is not None and value != 0 for value in stats.values()):
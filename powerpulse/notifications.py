@@ -6,16 +6,19 @@ This module handles system notifications for battery events.
 
 import sys
 import subprocess
+from powerpulse import diag
 from powerpulse.database import get_notification_settings
 
 
+@diag.timed('notify')
 def check_notifications(battery_info):
     """Check if any notification thresholds have been met"""
     if not battery_info:
         return
     
     # Get notification settings
-    notifications = get_notification_settings()
+    with diag.stage('notify.settings'):
+        notifications = get_notification_settings()
     
     for notification_type, level, enabled in notifications:
         if not enabled:
@@ -31,6 +34,7 @@ def check_notifications(battery_info):
             send_notification(f"Battery Level Reached", f"Battery reached {battery_info['percentage']}%")
 
 
+@diag.timed('notify.send')
 def send_notification(title, message):
     """Send system notification based on platform"""
     print(f"{title}: {message}")  # Always print to console
@@ -0,0 +1,327 @@
+"""
+Battery data providers for PowerPulse
+
+This module wraps each way of reading the battery (sysfs, upower, psutil,
+pmset, or a fake source for tests) in a provider with a common interface,
+and a registry that probes the available providers once, ranks them by how
+much they report and how long a read takes, and keeps using the winner
+until it fails repeatedly.
+"""
+
+import sys
+import time
+import shutil
+import threading
+
+from powerpulse import battery, diag
+
+# Fields every provider fills in; richness counts the ones that are not None
+INFO_FIELDS = ('percentage', 'is_charging', 'power_plugged', 'temperature', 'remaining_time')
+
+# Reads per provider when probing, to average out first-read costs
+PROBE_READS = 3
+
+# Consecutive failed reads before the registry probes again
+MAX_FAILURES = 3
+
+
+class BatteryProvider:
+    """Interface implemented by every battery data source"""
+
+    name = None
+
+    def available(self):
+        """Cheap check whether the provider can work on this machine"""
+        return True
+
+    def read(self):
+        """Read the battery; returns an info dict or None"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the provider"""
+        pass
+
+
+class SysfsProvider(BatteryProvider):
+    """Linux power_supply class read directly from sysfs"""
+
+    name = 'sysfs'
+
+    def __init__(self, root=battery.POWER_SUPPLY_ROOT):
+        self.reader = battery.SysfsBatteryReader(root)
+
+    def available(self):
+        try:
+            return self.reader.discover()
+        except OSError:
+            return False
+
+    def read(self):
+        try:
+            return self.reader.read()
+        except OSError:
+            # A supply disappeared; rediscover on the next read
+            self.reader.close()
+            return None
+
+    def close(self):
+        self.reader.close()
+
+
+class UpowerProvider(BatteryProvider):
+    """Linux UPower daemon queried through the upower command"""
+
+    name = 'upower'
+
+    def available(self):
+        return sys.platform == 'linux' and shutil.which('upower') is not None
+
+    def read(self):
+        return battery.get_battery_info_upower()
+
+
+class PsutilProvider(BatteryProvider):
+    """psutil.sensors_battery, available on most platforms"""
+
+    name = 'psutil'
+
+    def available(self):
+        try:
+            import psutil
+        except ImportError:
+            return False
+        return hasattr(psutil, 'sensors_battery')
+
+    def read(self):
+        import psutil
+
+        battery_info = psutil.sensors_battery()
+        if battery_info is None:
+            return None
+        secsleft = battery_info.secsleft
+        return {
+            'percentage': battery_info.percent,
+            'is_charging': bool(battery_info.power_plugged) and battery_info.percent < 100,
+            'power_plugged': bool(battery_info.power_plugged),
+            'temperature': None,  # Not available via psutil
+            'remaining_time': secsleft if isinstance(secsleft, int) and secsleft >= 0 else None
+        }
+
+
+class PmsetProvider(BatteryProvider):
+    """macOS pmset and system_profiler"""
+
+    name = 'pmset'
+
+    def available(self):
+        return sys.platform == 'darwin' and shutil.which('pmset') is not None
+
+    def read(self):
+        return battery.get_battery_info_macos()
+
+
+class FakeProvider(BatteryProvider):
+    """Fixed or scripted readings, for tests and demos
+
+    readings is a single info dict, or a sequence of them that is replayed
+    in a loop. The fake provider is never chosen automatically.
+    """
+
+    name = 'fake'
+
+    DEFAULT_READING = {
+        'percentage': 75.0,
+        'is_charging': False,
+        'power_plugged': False,
+        'temperature': 30.0,
+        'remaining_time': 3 * 3600,
+        'power_now': 8.5
+    }
+
+    def __init__(self, readings=None):
+        if readings is None:
+            readings = self.DEFAULT_READING
+        if isinstance(readings, dict):
+            readings = [readings]
+        self.readings = list(readings)
+        self._position = 0
+
+    def read(self):
+        if not self.readings:
+            return None
+        reading = self.readings[self._position % len(self.readings)]
+        self._position += 1
+        return dict(reading)
+
+
+# Provider factories by name; automatic ones take part in probing
+PROVIDERS = {}
+_AUTOMATIC = []
+
+
+def register_provider(name, factory, automatic=True):
+    """Register a provider factory under a name"""
+    PROVIDERS[name] = factory
+    if automatic and name not in _AUTOMATIC:
+        _AUTOMATIC.append(name)
+
+
+register_provider('sysfs', SysfsProvider)
+register_provider('upower', UpowerProvider)
+register_provider('psutil', PsutilProvider)
+register_provider('pmset', PmsetProvider)
+register_provider('fake', FakeProvider, automatic=False)
+
+
+def _replay_provider():
+    # Imported lazily: the synthetic module builds on this one
+    from powerpulse.synthetic import ReplayProvider
+    return ReplayProvider()
+
+
+register_provider('replay', _replay_provider, automatic=False)
+
+
+def probe_provider(provider, reads=PROBE_READS):
+    """Measure one provider; returns a dict describing the result"""
+    result = {
+        'name': provider.name,
+        'available': False,
+        'richness': 0,
+        'latency': None,
+        'error': None
+    }
+    try:
+        if not provider.available():
+            return result
+
+        info = None
+        started = time.perf_counter()
+        for _ in range(reads):
+            info = provider.read()
+            if not info:
+                break
+        elapsed = time.perf_counter() - started
+    except Exception as e:
+        result['error'] = str(e)
+        return result
+
+    if info:
+        result['available'] = True
+        result['latency'] = elapsed / reads
+        result['richness'] = sum(1 for field in INFO_FIELDS if info.get(field) is not None)
+    return result
+
+
+class ProviderRegistry:
+    """Chooses and caches the best battery provider for this machine"""
+
+    def __init__(self, names=None):
+        self.names = names
+        self.results = []
+        self.active = None
+        self.forced = None
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def probe(self):
+        """Probe every automatic provider and make the best one active
+
+        Providers are ranked by richness (fields reported), then by latency
+        per read. Returns the probe results, best first.
+        """
+        with self._lock:
+            self._close_active()
+            if self.forced is not None:
+                candidates = [self.forced]
+            else:
+                candidates = [PROVIDERS[name]() for name in (self.names or _AUTOMATIC)]
+
+            results = []
+            for provider in candidates:
+                result = probe_provider(provider)
+                result['provider'] = provider
+                results.append(result)
+
+            results.sort(key=lambda r: (not r['available'], -r['richness'], r['latency'] or 0))
+            for result in results:
+                provider = result.pop('provider')
+                if result['available'] and self.active is None:
+                    self.active = provider
+                else:
+                    provider.close()
+
+            self.results = results
+            self.failures = 0
+            return results
+
+    def use(self, provider):
+        """Force a provider (an instance or a registered name)"""
+        if isinstance(provider, str):
+            if provider not in PROVIDERS:
+                raise ValueError(f"Unknown battery provider: {provider}")
+            provider = PROVIDERS[provider]()
+        with self._lock:
+            self._close_active()
+            self.forced = provider
+            self.active = provider
+            self.results = []
+            self.failures = 0
+
+    def read(self):
+        """Read the battery through the active provider"""
+        if self.active is None:
+            self.probe()
+            if self.active is None:
+                return None
+
+        try:
+            with diag.stage(f"read.{self.active.name}"):
+                info = self.active.read()
+        except Exception as e:
+            print(f"Error getting battery info: {e}")
+            info = None
+
+        if info:
+            self.failures = 0
+            return info
+
+        self.failures += 1
+        diag.count('read.failures')
+        if self.failures >= MAX_FAILURES and self.forced is None:
+            # Let the next read pick a provider afresh
+            with self._lock:
+                self._close_active()
+        return None
+
+    def _close_active(self):
+        if self.active is not None and self.active is not self.forced:
+            self.active.close()
+        self.active = None
+
+    def close(self):
+        """Close the active provider"""
+        with self._lock:
+            if self.active is not None:
+                self.active.close()
+            self.active = None
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Get the process-wide provider registry"""
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = ProviderRegistry()
+        return _registry
+
+
+def set_provider(provider):
+    """Use a specific provider for this process instead of probing"""
+    get_registry().use(provider)
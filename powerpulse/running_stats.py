@@ -0,0 +1,471 @@
+"""
+Incremental battery statistics for PowerPulse
+
+calculate_statistics re-reads and re-scans its whole window on every call.
+This module keeps the same figures up to date as samples arrive instead:
+each pair of consecutive samples is folded once into an hourly bucket of
+sums (time charging and discharging, percentage gained and lost, cycles,
+full charges), completed battery sessions are kept in a list, and every
+supported window holds running totals that drop whole buckets as the
+window slides. A query reads raw samples only for the partly covered first
+hour, as get_battery_rollups does, so the results match a full scan.
+
+The state is saved to the database together with a watermark (the newest
+sample folded in); any process catches up from the watermark on its next
+update, so statistics survive restarts without a rescan.
+"""
+
+import bisect
+import threading
+
+import numpy as np
+
+from powerpulse import diag
+from powerpulse.cache import cached
+from powerpulse.database import get_connection_manager, now_epoch_ms, MAX_SAMPLE_GAP_MS, FULL_CHARGE_LEVEL
+from powerpulse.storage import get_backend
+from powerpulse.stats import calculate_statistics, MS_PER_HOUR, MS_PER_DAY
+
+BUCKET_MS = MS_PER_HOUR
+
+# Windows (days) kept as running totals; other windows up to the largest
+# are summed from the buckets, longer ones fall back to calculate_statistics
+WINDOW_DAYS = (1, 3, 7, 14, 30, 90, 365)
+MAX_WINDOW_DAYS = max(WINDOW_DAYS)
+
+# Additive sums kept per bucket, in stats_window_bucket column order
+SUMS = ('rows', 'charge_ms', 'discharge_ms', 'charged', 'discharged', 'cycles', 'full_charges', 'falling')
+INTEGER_SUMS = ('rows', 'charge_ms', 'discharge_ms', 'cycles', 'full_charges')
+
+COLUMNS = ('timestamp', 'percentage', 'is_charging')
+
+
+def _hour_floor(ts):
+    return ts - ts % BUCKET_MS
+
+
+def _hour_ceil(ts):
+    return -(-ts // BUCKET_MS) * BUCKET_MS
+
+
+def _horizon(now):
+    """Oldest bucket any supported window can still need"""
+    return _hour_floor(now - MAX_WINDOW_DAYS * MS_PER_DAY)
+
+
+def _pair_sums(timestamps, percentages, charging):
+    """Contribution of each pair of consecutive rows (row i, row i + 1)
+
+    Counted the same way calculate_statistics counts them.
+    """
+    time_diff = np.diff(timestamps)
+    percentage_diff = np.diff(percentages)
+    charging_after = charging[1:]
+    counted = (time_diff > 0) & (time_diff <= MAX_SAMPLE_GAP_MS)
+    charging_intervals = counted & charging_after
+    discharging_intervals = counted & ~charging_after
+    return {
+        'charge_ms': np.where(charging_intervals, time_diff, 0),
+        'discharge_ms': np.where(discharging_intervals, time_diff, 0),
+        'charged': np.where(charging_intervals & (percentage_diff > 0), percentage_diff, 0.0),
+        'discharged': np.where(discharging_intervals & (percentage_diff < 0), -percentage_diff, 0.0),
+        'cycles': ~charging[:-1] & charging_after,
+        'full_charges': (charging_after & (percentages[1:] >= FULL_CHARGE_LEVEL)
+                         & (percentages[:-1] < FULL_CHARGE_LEVEL)),
+        'falling': np.where(percentage_diff < 0, -percentage_diff, 0.0),
+    }
+
+
+def _empty_statistics():
+    return {
+        'average_discharge_rate': None,
+        'average_charge_rate': None,
+        'discharge_cycles': 0,
+        'full_charges': 0,
+        'average_daily_usage': None,
+        'longest_session': None,
+        'median_session': None
+    }
+
+
+class RunningStatistics:
+    """Sliding-window battery statistics maintained as samples are stored
+
+    update() folds in the rows stored since the watermark, in time linear
+    in the number of new rows; statistics(days) then needs only the raw
+    rows of the window's first, partly covered hour. save() persists the
+    state for the next process.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.generation = None
+        self._clear()
+
+    def _clear(self):
+        self.backend = None
+        self.watermark = None
+        self.last = None            # (timestamp, percentage, charging) of the newest row
+        self.open_start = None      # start of the session still on battery
+        self.buckets = {}           # bucket -> [sums in SUMS order]
+        self.firsts = {}            # bucket -> first row in the bucket
+        self.order = []             # bucket keys, ascending
+        self.session_starts = []    # completed sessions, ascending
+        self.session_ends = []
+        self.windows = {}           # days -> [edge, [sums in SUMS order]]
+        self._dirty = set()
+        self._new_sessions = []
+        self._replace = True
+
+    def _reset_windows(self, now):
+        """Recompute every window's running totals from the buckets"""
+        # One pass from the newest bucket back, shortest window first
+        self.windows = {}
+        totals = [0] * len(SUMS)
+        end = len(self.order)
+        for days in sorted(WINDOW_DAYS):
+            edge = _hour_ceil(now - days * MS_PER_DAY)
+            start = bisect.bisect_left(self.order, edge)
+            for key in self.order[start:end]:
+                for i, value in enumerate(self.buckets[key]):
+                    totals[i] += value
+            end = min(start, end)
+            self.windows[days] = [edge, list(totals)]
+
+    def _sum_from(self, edge):
+        totals = [0] * len(SUMS)
+        for key in self.order[bisect.bisect_left(self.order, edge):]:
+            for i, value in enumerate(self.buckets[key]):
+                totals[i] += value
+        return totals
+
+    # Ingest
+
+    def _extend(self, timestamps, percentages, charging):
+        """Fold time-ordered rows newer than the watermark into the state"""
+        if not len(timestamps):
+            return
+
+        if self.last is not None:
+            all_ts = np.concatenate(([self.last[0]], timestamps))
+            all_pct = np.concatenate(([self.last[1]], percentages))
+            all_chg = np.concatenate(([self.last[2]], charging))
+        else:
+            all_ts, all_pct, all_chg = timestamps, percentages, charging
+
+        # Pairs belong to the bucket of their first row, rows to their own
+        pair_buckets = _hour_floor(all_ts[:-1])
+        row_buckets = _hour_floor(timestamps)
+        keys = np.unique(np.concatenate((pair_buckets[:1], row_buckets)))
+        totals = {'rows': np.bincount(np.searchsorted(keys, row_buckets), minlength=len(keys))}
+        pair_index = np.searchsorted(keys, pair_buckets)
+        for name, values in _pair_sums(all_ts, all_pct, all_chg).items():
+            totals[name] = np.bincount(pair_index, weights=values, minlength=len(keys))
+
+        _, first_rows = np.unique(row_buckets, return_index=True)
+        for i in first_rows.tolist():
+            key = int(row_buckets[i])
+            if key not in self.firsts:
+                self.firsts[key] = (int(timestamps[i]), float(percentages[i]), bool(charging[i]))
+
+        columns = [totals[name].tolist() for name in SUMS]
+        integer = [name in INTEGER_SUMS for name in SUMS]
+        windows = list(self.windows.values())
+        for index, key in enumerate(keys.tolist()):
+            values = [int(column[index]) if is_int else column[index]
+                      for column, is_int in zip(columns, integer)]
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [0] * len(SUMS)
+                bisect.insort(self.order, key)
+            for i, value in enumerate(values):
+                bucket[i] += value
+            for edge, window in windows:
+                if key >= edge:
+                    for i, value in enumerate(values):
+                        window[i] += value
+            self._dirty.add(key)
+
+        # Sessions on battery run from the first discharging row to the row
+        # where charging resumes
+        discharging = ~charging
+        before = np.concatenate(([self.open_start is not None], discharging[:-1]))
+        starts = timestamps[discharging & ~before].tolist()
+        ends = timestamps[~discharging & before].tolist()
+        if self.open_start is not None:
+            starts.insert(0, self.open_start)
+        for start, end in zip(starts, ends):
+            self.session_starts.append(start)
+            self.session_ends.append(end)
+            self._new_sessions.append((start, end))
+        self.open_start = starts[len(ends)] if len(starts) > len(ends) else None
+
+        self.last = (int(timestamps[-1]), float(percentages[-1]), bool(charging[-1]))
+        self.watermark = self.last[0]
+
+    def _advance(self, now):
+        """Slide every window to now and expire buckets no window needs"""
+        for days, window in self.windows.items():
+            edge = _hour_ceil(now - days * MS_PER_DAY)
+            if edge <= window[0]:
+                continue
+            lo = bisect.bisect_left(self.order, window[0])
+            hi = bisect.bisect_left(self.order, edge)
+            totals = window[1]
+            for key in self.order[lo:hi]:
+                for i, value in enumerate(self.buckets[key]):
+                    totals[i] -= value
+            window[0] = edge
+
+        horizon = _horizon(now)
+        expired = bisect.bisect_left(self.order, horizon)
+        for key in self.order[:expired]:
+            del self.buckets[key]
+            self.firsts.pop(key, None)
+            self._dirty.discard(key)
+        del self.order[:expired]
+
+        # Sessions are only looked up by their end
+        expired = bisect.bisect_left(self.session_ends, horizon)
+        del self.session_starts[:expired]
+        del self.session_ends[:expired]
+
+    @diag.timed('stats.update')
+    def update(self, now=None):
+        """Fold in the rows stored since the watermark and slide the windows"""
+        with self._lock:
+            now = now_epoch_ms() if now is None else now
+            self._check_generation(now)
+
+            horizon = _horizon(now)
+            backend = get_backend()
+            if self.backend != backend.name or self.watermark is None or self.watermark < horizon:
+                # Nothing usable to continue from: rebuild from the horizon
+                generation = self.generation
+                self._clear()
+                self.generation = generation
+                self.backend = backend.name
+                self._reset_windows(now)
+                start = horizon
+            else:
+                start = self.watermark + 1
+
+            rows = backend.read_range(start, columns=COLUMNS)
+            self._extend(rows['timestamp'].astype(np.int64), rows['percentage'].astype(np.float64),
+                         rows['is_charging'].astype(bool))
+            self._advance(now)
+
+    # Queries
+
+    def _session_end(self, ts):
+        """End of the session on battery that contains the row at ts"""
+        index = bisect.bisect_right(self.session_ends, ts)
+        if index < len(self.session_ends):
+            return self.session_ends[index]
+        return self.last[0]
+
+    @diag.timed('stats.running')
+    def statistics(self, days=7, now=None):
+        """Same figures as calculate_statistics(days), from the running state"""
+        if days > MAX_WINDOW_DAYS:
+            return calculate_statistics(days)
+
+        with self._lock:
+            now = now_epoch_ms() if now is None else now
+            self.update(now)
+
+            start = now - int(days * MS_PER_DAY)
+            edge = _hour_ceil(start)
+            window = self.windows.get(days)
+            totals = window[1] if window is not None and window[0] == edge else self._sum_from(edge)
+            sums = dict(zip(SUMS, totals))
+
+            first_index = bisect.bisect_left(self.order, edge)
+            first = self.firsts[self.order[first_index]] if first_index < len(self.order) else None
+
+            # Raw rows of the partly covered first hour, plus the pair that
+            # crosses into the first whole bucket
+            head = get_backend().read_range(start, edge, columns=COLUMNS)
+            head_ts = head['timestamp'].astype(np.int64)
+            head_pct = head['percentage'].astype(np.float64)
+            head_chg = head['is_charging'].astype(bool)
+            if len(head_ts) and first is not None:
+                pairs = _pair_sums(np.append(head_ts, first[0]), np.append(head_pct, first[1]),
+                                   np.append(head_chg, first[2]))
+            else:
+                pairs = _pair_sums(head_ts, head_pct, head_chg)
+            for name, values in pairs.items():
+                sums[name] += values.sum()
+
+            rows = len(head_ts) + sums['rows']
+            if not rows:
+                return _empty_statistics()
+            last_ts = self.last[0] if first is not None else int(head_ts[-1])
+
+            stats = _empty_statistics()
+            discharge_hours = sums['discharge_ms'] / MS_PER_HOUR
+            charge_hours = sums['charge_ms'] / MS_PER_HOUR
+            stats['average_discharge_rate'] = (float(sums['discharged'] / discharge_hours)
+                                               if sums['discharged'] > 0 else None)
+            stats['average_charge_rate'] = float(sums['charged'] / charge_hours) if sums['charged'] > 0 else None
+            stats['discharge_cycles'] = int(sums['cycles'])
+            stats['full_charges'] = int(sums['full_charges'])
+
+            if rows >= 2:
+                if not len(head_ts):
+                    head_ts = np.array([first[0]], dtype=np.int64)
+                    head_chg = np.array([first[2]])
+
+                total_days = (last_ts - int(head_ts[0])) / MS_PER_DAY
+                if total_days > 0:
+                    stats['average_daily_usage'] = float(sums['falling'] / total_days)
+
+                # Sessions starting in the first hour (or at the window's
+                # first row), then completed and open sessions after it
+                starts = np.flatnonzero(~head_chg & np.concatenate(([True], head_chg[:-1])))
+                ends = np.flatnonzero(head_chg & np.concatenate(([False], ~head_chg[:-1])))
+                durations = (head_ts[ends] - head_ts[starts[:len(ends)]]).tolist()
+                if len(starts) > len(ends):
+                    durations.append(self._session_end(int(head_ts[-1])) - int(head_ts[starts[-1]]))
+                later = bisect.bisect_right(self.session_starts, int(head_ts[-1]))
+                durations.extend(end - begin for begin, end in
+                                 zip(self.session_starts[later:], self.session_ends[later:]))
+                if self.open_start is not None and self.open_start > head_ts[-1]:
+                    durations.append(self.last[0] - self.open_start)
+                stats['longest_session'] = max(durations) / MS_PER_HOUR if durations else 0
+                stats['median_session'] = float(np.median(durations)) / MS_PER_HOUR if durations else 0
+
+            return stats
+
+    # Persistence
+
+    def _check_generation(self, now):
+        """Reload the saved state when this process has none or it was reset"""
+        with get_connection_manager().reader() as conn:
+            row = conn.execute('SELECT generation FROM stats_window_state WHERE id = 1').fetchone()
+        if row is not None and row[0] != self.generation:
+            self.load(now)
+
+    def load(self, now=None):
+        """Replace the in-memory state with the saved one"""
+        with self._lock:
+            now = now_epoch_ms() if now is None else now
+            horizon = _horizon(now)
+            self._clear()
+            with get_connection_manager().reader() as conn:
+                state = conn.execute('''
+                SELECT generation, backend, watermark, last_percentage, last_charging, open_session_start
+                FROM stats_window_state WHERE id = 1
+                ''').fetchone()
+                if state is None:
+                    return
+                generation, backend, watermark, last_percentage, last_charging, open_start = state
+                self.generation = generation
+                if backend is None or watermark is None or watermark < horizon:
+                    return
+
+                for row in conn.execute('''
+                SELECT bucket, rows, charge_ms, discharge_ms, charged, discharged, cycles, full_charges,
+                       falling, first_ts, first_percentage, first_charging
+                FROM stats_window_bucket WHERE bucket >= ? ORDER BY bucket
+                ''', (horizon,)):
+                    self.buckets[row[0]] = list(row[1:9])
+                    self.firsts[row[0]] = (row[9], np.nan if row[10] is None else row[10], bool(row[11]))
+                    self.order.append(row[0])
+
+                for start, end in conn.execute('''
+                SELECT start_ts, end_ts FROM stats_window_session WHERE end_ts >= ? ORDER BY start_ts
+                ''', (horizon,)):
+                    self.session_starts.append(start)
+                    self.session_ends.append(end)
+
+            self.backend = backend
+            self.watermark = watermark
+            self.last = (watermark, np.nan if last_percentage is None else last_percentage, bool(last_charging))
+            self.open_start = open_start
+            self._replace = False
+            self._reset_windows(now)
+
+    def save(self):
+        """Write the state changed since the last save
+
+        Nothing is written when another process has saved newer state or
+        the history was rewritten meanwhile (see reset_running_statistics).
+        """
+        with self._lock:
+            if self.generation is None or (not self._dirty and not self._new_sessions and not self._replace):
+                return False
+
+            with get_connection_manager().writer() as conn:
+                row = conn.execute('SELECT generation, watermark FROM stats_window_state WHERE id = 1').fetchone()
+                if row is None or row[0] != self.generation:
+                    self.generation = None
+                    return False
+                if row[1] is not None and (self.watermark is None or row[1] > self.watermark):
+                    self._dirty.clear()
+                    self._new_sessions = []
+                    return False
+
+                if self._replace:
+                    conn.execute('DELETE FROM stats_window_bucket')
+                    conn.execute('DELETE FROM stats_window_session')
+                    keys = self.order
+                    sessions = list(zip(self.session_starts, self.session_ends))
+                else:
+                    keys = sorted(self._dirty)
+                    sessions = self._new_sessions
+
+                conn.executemany('''
+                INSERT OR REPLACE INTO stats_window_bucket
+                (bucket, rows, charge_ms, discharge_ms, charged, discharged, cycles, full_charges,
+                 falling, first_ts, first_percentage, first_charging)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [(key, *self.buckets[key], *self._first_row(key)) for key in keys])
+                conn.executemany('''
+                INSERT OR REPLACE INTO stats_window_session (start_ts, end_ts) VALUES (?, ?)
+                ''', sessions)
+
+                if self.order:
+                    conn.execute('DELETE FROM stats_window_bucket WHERE bucket < ?', (self.order[0],))
+                if self.session_ends:
+                    conn.execute('DELETE FROM stats_window_session WHERE end_ts < ?', (self.session_ends[0],))
+
+                last_ts, last_percentage, last_charging = self.last if self.last else (None, None, None)
+                conn.execute('''
+                UPDATE stats_window_state
+                SET backend = ?, watermark = ?, last_percentage = ?, last_charging = ?, open_session_start = ?
+                WHERE id = 1
+                ''', (self.backend, self.watermark, _sql_float(last_percentage),
+                      None if last_charging is None else int(last_charging), self.open_start))
+
+            self._dirty.clear()
+            self._new_sessions = []
+            self._replace = False
+            return True
+
+    def _first_row(self, key):
+        ts, percentage, charging = self.firsts.get(key, (None, None, None))
+        return ts, _sql_float(percentage), None if charging is None else int(charging)
+
+
+def _sql_float(value):
+    return None if value is None or value != value else float(value)
+
+
+_running = None
+_running_lock = threading.Lock()
+
+
+def get_running_statistics():
+    """The process-wide running statistics"""
+    global _running
+    with _running_lock:
+        if _running is None:
+            _running = RunningStatistics()
+        return _running
+
+
+@cached('stats')
+def running_statistics(days=7):
+    """Battery statistics for the last days, answered from the running state"""
+    return get_running_statistics().statistics(days)
@@ -0,0 +1,311 @@
+"""
+Battery sampling for PowerPulse
+
+This module implements the sampler shared by every front end: it reads the
+battery on a drift-free schedule and publishes each reading to subscribers
+(storage, notifications, GUI, console). It also decides how often to read
+and which readings are worth storing. With adaptive sampling, readings are
+stored only when a value moves by more than a deadband or when a heartbeat
+is due, and the interval shortens during fast discharge or near a
+notification threshold and backs off while the battery is stable.
+"""
+
+import time
+import threading
+
+from powerpulse import diag
+from powerpulse.battery import get_battery_info
+from powerpulse.database import get_notification_settings, now_epoch_ms, MAX_SAMPLE_GAP_MS, FULL_CHARGE_LEVEL
+from powerpulse.storage import get_backend
+
+# Percentage points a reading must move before it is stored again
+DEFAULT_DEADBAND = 1.0
+TEMPERATURE_DEADBAND = 1.0
+
+# Store a reading at least this often (seconds) even if nothing changed.
+# Statistics treat longer gaps between rows as time when no monitor ran,
+# so the heartbeat must stay below MAX_SAMPLE_GAP_MS.
+HEARTBEAT_INTERVAL = 600
+MAX_HEARTBEAT = MAX_SAMPLE_GAP_MS // 1000 - 60
+
+# Interval adjustments
+MIN_INTERVAL = 5
+FAST_DISCHARGE_RATE = 20.0  # % per hour
+THRESHOLD_MARGIN = 2.0      # percentage points around a notification level
+
+
+class ChangeFilter:
+    """Decides which readings are stored: changes beyond a deadband, or heartbeats
+
+    State flips and readings crossing FULL_CHARGE_LEVEL are always stored,
+    so cycles and full charges count the same as with every reading stored.
+    """
+
+    def __init__(self, deadband=DEFAULT_DEADBAND, heartbeat=HEARTBEAT_INTERVAL):
+        self.deadband = deadband
+        self.heartbeat = min(heartbeat, MAX_HEARTBEAT)
+        self.last = None
+        self.last_time = None
+
+    def should_persist(self, info, now=None):
+        """Return True if the reading should be stored, and remember it if so"""
+        now = time.monotonic() if now is None else now
+        persist = (
+            self.last is None
+            or now - self.last_time >= self.heartbeat
+            or info['is_charging'] != self.last['is_charging']
+            or info['power_plugged'] != self.last['power_plugged']
+            or _crossed(info['percentage'], self.last['percentage'], FULL_CHARGE_LEVEL)
+            or _moved(info['percentage'], self.last['percentage'], self.deadband)
+            or _moved(info['temperature'], self.last['temperature'], TEMPERATURE_DEADBAND)
+        )
+        if persist:
+            self.last = info
+            self.last_time = now
+        return persist
+
+    def reset(self):
+        """Store the next reading regardless of what came before"""
+        self.last = None
+        self.last_time = None
+
+
+def _crossed(value, previous, level):
+    """True if value and previous lie on different sides of level"""
+    if value is None or previous is None:
+        return False
+    return (value >= level) != (previous >= level)
+
+
+def _moved(value, previous, deadband):
+    """True if value differs from previous by at least deadband"""
+    if value is None or previous is None:
+        return (value is None) != (previous is None)
+    return abs(value - previous) >= deadband
+
+
+class AdaptiveSampler:
+    """Chooses the next sampling interval and which readings to store
+
+    Call observe() with every reading; it returns whether to store the
+    reading and updates interval, the seconds to wait before the next one.
+    """
+
+    def __init__(self, base_interval=30, deadband=DEFAULT_DEADBAND, heartbeat=HEARTBEAT_INTERVAL):
+        self.base_interval = base_interval
+        self.filter = ChangeFilter(deadband, heartbeat)
+        self.interval = base_interval
+        self.discharge_rate = None
+        self._reference = None
+        self._previous = None
+        self._stable_count = 0
+
+    def observe(self, info, now=None):
+        """Take a reading into account; returns True if it should be stored"""
+        now = time.monotonic() if now is None else now
+        self._update_rate(info, now)
+        self.interval = self._next_interval(info)
+        self._previous = info
+        return self.filter.should_persist(info, now)
+
+    def reset(self):
+        """Forget past readings, e.g. after the machine was suspended"""
+        self.filter.reset()
+        self.interval = self.base_interval
+        self.discharge_rate = None
+        self._reference = None
+        self._previous = None
+        self._stable_count = 0
+
+    def _update_rate(self, info, now):
+        """Track the discharge rate from the last percentage change"""
+        percentage = info['percentage']
+        reference = self._reference
+        if (percentage is None or info['power_plugged'] or reference is None
+                or reference[2] != info['power_plugged']):
+            self._reference = (percentage, now, info['power_plugged'])
+            self.discharge_rate = None
+            return
+
+        if percentage != reference[0] and now > reference[1]:
+            self.discharge_rate = (reference[0] - percentage) / ((now - reference[1]) / 3600)
+            self._reference = (percentage, now, info['power_plugged'])
+
+    def _next_interval(self, info):
+        previous = self._previous
+        changed = (
+            previous is None
+            or info['percentage'] != previous['percentage']
+            or info['is_charging'] != previous['is_charging']
+            or info['power_plugged'] != previous['power_plugged']
+        )
+        self._stable_count = 0 if changed else self._stable_count + 1
+
+        if self._near_threshold(info):
+            return max(MIN_INTERVAL, self.base_interval // 4)
+        if self.discharge_rate is not None and self.discharge_rate >= FAST_DISCHARGE_RATE:
+            return max(MIN_INTERVAL, self.base_interval // 2)
+        if self._stable_count:
+            # Back off while nothing changes, but never past the heartbeat
+            backoff = self.base_interval * 2 ** min(self._stable_count, 10)
+            return max(self.base_interval, min(backoff, self.filter.heartbeat))
+        return self.base_interval
+
+    @staticmethod
+    def _near_threshold(info):
+        """True if the battery is approaching an enabled notification level"""
+        percentage = info['percentage']
+        if percentage is None:
+            return False
+        for notification_type, level, enabled in get_notification_settings():
+            if not enabled:
+                continue
+            if notification_type == 'low_battery':
+                # Discharging towards the low level
+                if not info['power_plugged'] and level < percentage <= level + THRESHOLD_MARGIN:
+                    return True
+            elif info['is_charging'] and level - THRESHOLD_MARGIN <= percentage < level:
+                # Charging towards the full or custom level
+                return True
+        return False
+
+
+# Wall and monotonic clocks drifting apart by more than this many seconds
+# between two wakeups means the machine was suspended in between
+SUSPEND_THRESHOLD = 5.0
+
+
+def store_reading(info):
+    """Sampler subscriber that stores readings in the active storage backend"""
+    get_backend().append(info)
+
+
+class Sampler:
+    """Reads the battery on a schedule and publishes each reading once
+
+    Readings are taken on fixed monotonic deadlines, so slow reads do not
+    make the schedule drift, and after a suspend the sampler reads right
+    away and restarts the schedule. With an AdaptiveSampler the interval
+    varies and only the readings it selects reach stored_only subscribers.
+    With an events listener, power supply events trigger extra readings.
+    """
+
+    def __init__(self, interval=30, adaptive=None, listener=None, read=get_battery_info):
+        self.interval = interval
+        self.adaptive = adaptive
+        self.listener = listener
+        self.read = read
+        self.last_info = None
+        self.samples = 0
+        self.suspends = 0
+        self._subscribers = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._clocks = None
+
+    def subscribe(self, callback, stored_only=False):
+        """Call callback(info) for every reading, or only for stored ones"""
+        self._subscribers.append((callback, stored_only))
+
+    def unsubscribe(self, callback):
+        """Stop calling callback"""
+        # Bound methods are created anew on each access, so compare by equality
+        self._subscribers = [(c, s) for c, s in self._subscribers if c != callback]
+
+    def current_interval(self):
+        """Seconds until the next scheduled reading"""
+        return self.adaptive.interval if self.adaptive else self.interval
+
+    @diag.timed('sample')
+    def sample_once(self):
+        """Take one reading and publish it; returns the reading or None"""
+        try:
+            info = self.read()
+        except Exception as e:
+            print(f"Error getting battery info: {e}")
+            return None
+        if not info:
+            return None
+        
+        # Stamp the reading so subscribers that defer writes keep the read time
+        info.setdefault('timestamp', now_epoch_ms())
+        store = self.adaptive.observe(info) if self.adaptive else True
+        if not store:
+            diag.count('sample.skipped')
+        self.last_info = info
+        self.samples += 1
+        
+        for callback, stored_only in list(self._subscribers):
+            if stored_only and not store:
+                continue
+            try:
+                callback(info)
+            except Exception as e:
+                print(f"Error in sampler subscriber: {e}")
+        return info
+
+    def check_suspend(self):
+        """Return True if the machine was suspended since the last check"""
+        clocks = (time.time(), time.monotonic())
+        previous, self._clocks = self._clocks, clocks
+        if previous is None:
+            return False
+        
+        # The monotonic clock stops while suspended, the wall clock does not
+        slept = (clocks[0] - previous[0]) - (clocks[1] - previous[1])
+        if slept > SUSPEND_THRESHOLD:
+            self.suspends += 1
+            if self.adaptive:
+                self.adaptive.reset()
+            return True
+        return False
+
+    def _wait(self, timeout):
+        """Wait up to timeout seconds; returns True if an event cut it short"""
+        if self.listener is None:
+            self._stop.wait(timeout)
+            return False
+        return bool(self.listener.wait(timeout))
+
+    def run(self):
+        """Sample until stop() is called"""
+        self.check_suspend()
+        deadline = time.monotonic()
+        
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if self.check_suspend():
+                # Read immediately and restart the schedule from now
+                deadline = now
+            
+            if now >= deadline:
+                self.sample_once()
+                deadline += self.current_interval()
+                if deadline <= now:
+                    # Reads fell behind; skip the missed ticks instead of bursting
+                    deadline = now + self.current_interval()
+            
+            if self._wait(max(0, deadline - time.monotonic())) and not self._stop.is_set():
+                # A power supply event: read now, keep the schedule
+                self.sample_once()
+
+    def start(self):
+        """Run the sampler in a background thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        """Stop sampling and wait for the background thread"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+            if thread.is_alive():
+                # Still blocked on the listener; it exits at its next wakeup
+                return
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
@@ -0,0 +1,373 @@
+"""
+Background service for PowerPulse
+
+This module runs the monitoring service on a single asyncio event loop.
+Sampling, notification delivery, batched history writes, retention and the
+optional local query endpoint are independent tasks; blocking work runs on
+a few dedicated worker threads so that, for example, a slow notification
+never delays the next sample.
+"""
+
+import os
+import json
+import errno
+import time
+import signal
+import socket
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from powerpulse import database, diag
+from powerpulse.storage import get_backend
+from powerpulse.notifications import check_notifications
+from powerpulse.events import SETTLE_DELAY
+from powerpulse.running_stats import get_running_statistics, running_statistics
+from powerpulse.stats import calculate_power_statistics
+
+# Seconds between flushes of buffered history when readings are sparse
+FLUSH_INTERVAL = database.WRITE_BUFFER_MAX_AGE
+
+# Seconds between retention passes
+RETENTION_INTERVAL = 6 * 3600
+
+# Local query endpoint: a Unix socket next to the database, or a loopback
+# TCP port where Unix sockets are unavailable
+ENDPOINT_SOCKET = 'service.sock'
+ENDPOINT_PORT = 47815
+
+# Where a profile requested through the endpoint is saved; clients never
+# choose the path, since the Windows endpoint is reachable by any local user
+SERVICE_PROFILE_FILENAME = 'service_profile'
+
+
+def endpoint_address():
+    """Address of the local query endpoint"""
+    if hasattr(socket, 'AF_UNIX'):
+        return os.path.join(os.path.dirname(database.DB_PATH), ENDPOINT_SOCKET)
+    return ('127.0.0.1', ENDPOINT_PORT)
+
+
+def service_profile_path():
+    """File a profile saved through the endpoint is written to"""
+    return os.path.join(database.APP_DATA_DIR, SERVICE_PROFILE_FILENAME)
+
+
+def query_service(request, timeout=5):
+    """Send one request to a running service and return its response"""
+    address = endpoint_address()
+    family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+        response = b''
+        while not response.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    return json.loads(response.decode('utf-8'))
+
+
+class MonitoringService:
+    """Asyncio runtime for the monitoring service
+
+    The sampler (see powerpulse.sampling) supplies the schedule, adaptive
+    sampling and the optional power supply event listener; the service
+    drives it from the event loop and fans readings out to its tasks. An
+    optional PowerCapture runs on its own thread for the service's
+    lifetime, and its live buffer is served through the power query.
+    """
+
+    def __init__(self, sampler, retention_days=0, endpoint=False, capture=None):
+        self.sampler = sampler
+        self.retention_days = retention_days
+        self.endpoint = endpoint
+        self.capture = capture
+        self.started = None
+        self.rows_written = 0
+        self.notifications_checked = 0
+
+        # One thread each, so no kind of work can hold up another
+        self._sample_executor = ThreadPoolExecutor(1, thread_name_prefix='powerpulse-sample')
+        self._notify_executor = ThreadPoolExecutor(1, thread_name_prefix='powerpulse-notify')
+        self._storage_executor = ThreadPoolExecutor(1, thread_name_prefix='powerpulse-storage')
+        self._query_executor = ThreadPoolExecutor(1, thread_name_prefix='powerpulse-query')
+
+        self._loop = None
+        self._stop = None
+        self._power_event = None
+        self._notify_event = None
+        self._write_queue = None
+        self._latest = None
+        self._socket_path = None
+
+        sampler.subscribe(self._on_reading)
+        sampler.subscribe(self._on_stored, stored_only=True)
+
+    # Sampler subscribers; called on the sampling thread
+
+    def _on_reading(self, info):
+        self._loop.call_soon_threadsafe(self._queue_notification, info)
+
+    def _on_stored(self, info):
+        self._loop.call_soon_threadsafe(self._write_queue.put_nowait, info)
+
+    def _queue_notification(self, info):
+        # Thresholds only depend on the latest reading, so a backlog collapses
+        self._latest = info
+        self._notify_event.set()
+
+    def _on_uevent(self):
+        if self.sampler.listener.receive():
+            self._power_event.set()
+
+    # Tasks
+
+    async def _sample_loop(self):
+        loop = self._loop
+        sampler = self.sampler
+        sampler.check_suspend()
+        deadline = loop.time()
+
+        while True:
+            now = loop.time()
+            if sampler.check_suspend():
+                deadline = now
+
+            if now >= deadline:
+                await loop.run_in_executor(self._sample_executor, sampler.sample_once)
+                deadline += sampler.current_interval()
+                if deadline <= now:
+                    deadline = now + sampler.current_interval()
+
+            try:
+                await asyncio.wait_for(self._power_event.wait(), max(0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                continue
+
+            # Let the burst of events from one change settle, then read once
+            await asyncio.sleep(SETTLE_DELAY)
+            self._power_event.clear()
+            await loop.run_in_executor(self._sample_executor, sampler.sample_once)
+
+    async def _notify_loop(self):
+        while True:
+            await self._notify_event.wait()
+            self._notify_event.clear()
+            info, self._latest = self._latest, None
+            if info:
+                await self._loop.run_in_executor(self._notify_executor, check_notifications, info)
+                self.notifications_checked += 1
+
+    def _store(self, batch):
+        backend = get_backend()
+        for info in batch:
+            backend.append(info)
+        if batch:
+            get_running_statistics().update()
+        return len(batch)
+
+    def _flush(self):
+        flushed = get_backend().flush()
+        get_running_statistics().save()
+        return flushed
+
+    async def _write_loop(self):
+        while True:
+            try:
+                info = await asyncio.wait_for(self._write_queue.get(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                await self._loop.run_in_executor(self._storage_executor, self._flush)
+                continue
+
+            batch = [info]
+            while not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+            self.rows_written += await self._loop.run_in_executor(self._storage_executor, self._store, batch)
+
+    async def _retention_loop(self):
+        while True:
+            try:
+                removed = await self._loop.run_in_executor(
+                    self._storage_executor, lambda: get_backend().apply_retention(self.retention_days)
+                )
+                if removed:
+                    print(f"Removed {removed} history records older than {self.retention_days} days")
+            except Exception as e:
+                print(f"Error applying retention: {e}")
+            await asyncio.sleep(RETENTION_INTERVAL)
+
+    # Query endpoint
+
+    def status(self):
+        """Snapshot of the service state, as served to the status query"""
+        return {
+            'uptime': time.monotonic() - self.started if self.started else 0,
+            'interval': self.sampler.current_interval(),
+            'samples': self.sampler.samples,
+            'suspends': self.sampler.suspends,
+            'rows_written': self.rows_written,
+            'pending_writes': self._write_queue.qsize() if self._write_queue else 0,
+            'notifications_checked': self.notifications_checked,
+            'events': self.sampler.listener is not None,
+            'capture_samples': self.capture.samples if self.capture is not None else None,
+            'last_reading': self.sampler.last_info,
+        }
+
+    async def handle_query(self, request):
+        """Answer one endpoint request: status, stats, power, diag or profile"""
+        query = request.get('query', 'status')
+        if query == 'status':
+            return self.status()
+        if query == 'diag':
+            if 'enable' in request:
+                diag.enable(request['enable'])
+            if request.get('reset'):
+                diag.reset()
+            return diag.snapshot()
+        if query == 'profile':
+            # start with a profiler kind, then stop to collect the report
+            if request.get('action') == 'start':
+                diag.start_profiler(request.get('kind', 'sampling'))
+                return {'profiler': request.get('kind', 'sampling')}
+            path = service_profile_path() if request.get('save') else None
+            return {'report': diag.stop_profiler(path, request.get('limit', 25)), 'path': path}
+        if query == 'stats':
+            # Analysis runs beside the storage thread, never ahead of a flush
+            days = int(request.get('days', 7))
+            return await self._loop.run_in_executor(self._query_executor, running_statistics, days)
+        if query == 'power':
+            # Includes the live buffer of the capture running in this process
+            days = float(request.get('days', 1))
+            return await self._loop.run_in_executor(self._query_executor, calculate_power_statistics, days)
+        return {'error': f"Unknown query: {query}"}
+
+    async def _handle_client(self, reader, writer):
+        try:
+            line = await reader.readline()
+            try:
+                response = await self.handle_query(json.loads(line or b'{}'))
+            except Exception as e:
+                response = {'error': str(e)}
+            writer.write(json.dumps(response, default=float).encode('utf-8') + b'\n')
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _start_endpoint(self):
+        address = endpoint_address()
+        if isinstance(address, tuple):
+            return await asyncio.start_server(self._handle_client, *address)
+        if os.path.exists(address):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(address)
+            except ConnectionRefusedError:
+                # Left behind by a service that did not shut down cleanly
+                os.unlink(address)
+            else:
+                raise OSError(errno.EADDRINUSE, "Another service is serving the endpoint", address)
+            finally:
+                probe.close()
+        # Create the socket owner-only rather than tightening it after bind
+        umask = os.umask(0o077)
+        try:
+            server = await asyncio.start_unix_server(self._handle_client, address)
+        finally:
+            os.umask(umask)
+        os.chmod(address, 0o600)
+        self._socket_path = address
+        return server
+
+    # Lifecycle
+
+    def stop(self):
+        """Ask the service to shut down; safe to call from any thread"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def _install_signal_handlers(self):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(signum, self._stop.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows event loops; Ctrl+C still raises KeyboardInterrupt
+                pass
+
+    async def serve(self):
+        """Run every task until stop() or SIGINT/SIGTERM"""
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._power_event = asyncio.Event()
+        self._notify_event = asyncio.Event()
+        self._write_queue = asyncio.Queue()
+        self.started = time.monotonic()
+        self._install_signal_handlers()
+
+        listener = self.sampler.listener
+        if listener is not None:
+            self._loop.add_reader(listener.fileno(), self._on_uevent)
+
+        tasks = [
+            asyncio.create_task(self._sample_loop()),
+            asyncio.create_task(self._notify_loop()),
+            asyncio.create_task(self._write_loop()),
+        ]
+        if self.retention_days:
+            tasks.append(asyncio.create_task(self._retention_loop()))
+        if self.capture is not None:
+            self.capture.start()
+
+        server = None
+        if self.endpoint:
+            try:
+                server = await self._start_endpoint()
+            except OSError as e:
+                print(f"Error starting query endpoint: {e}")
+
+        try:
+            await self._stop.wait()
+        finally:
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+            if listener is not None:
+                self._loop.remove_reader(listener.fileno())
+
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.capture is not None:
+                # Stores the windows still queued
+                await self._loop.run_in_executor(self._storage_executor, self.capture.stop)
+
+            # Readings already taken still reach the database
+            batch = []
+            while not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+            await self._loop.run_in_executor(self._storage_executor, self._store, batch)
+            await self._loop.run_in_executor(self._storage_executor, self._flush)
+
+    def run(self):
+        """Run the service in the current thread until it is stopped"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._flush()
+            for executor in (self._sample_executor, self._notify_executor,
+                             self._storage_executor, self._query_executor):
+                executor.shutdown(wait=False)
+            if self.sampler.listener is not None:
+                self.sampler.listener.close()
+                self.sampler.listener = None
+            if self._socket_path is not None:
+                # Only the socket this service created
+                try:
+                    os.unlink(self._socket_path)
+                except OSError:
+                    pass
+                self._socket_path = None
@@ -5,37 +5,51 @@ This module provides functions for calculating battery usage statistics
 and generating plots based on historical data.
 """
 
-import datetime
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.dates import DateFormatter
 
-from powerpulse.database import get_battery_history
+from powerpulse import diag
+from powerpulse.cache import cached
+from powerpulse.analysis import AnalysisContext, runs
+from powerpulse.database import (
+    from_epoch_ms, days_ago_epoch_ms, get_power_summaries, MAX_SAMPLE_GAP_MS, FULL_CHARGE_LEVEL
+)
+from powerpulse.storage import get_backend
+from powerpulse.capture import get_active_capture, summarize
 
+MS_PER_HOUR = 3600 * 1000
+MS_PER_DAY = 24 * MS_PER_HOUR
 
-def calculate_statistics(days=7):
-    """Calculate battery usage statistics"""
-    history = get_battery_history(days)
+# Roughly how many points a history plot needs to look continuous
+HISTORY_PLOT_POINTS = 2000
+
+
+@cached('stats')
+@diag.timed('stats')
+def calculate_statistics(days=7, context=None):
+    """Calculate battery usage statistics
     
-    if not history:
+    context, an AnalysisContext of the same window, saves loading it again.
+    """
+    if context is None:
+        context = AnalysisContext(days)
+    
+    if not len(context):
         return {
             'average_discharge_rate': None,
             'average_charge_rate': None,
             'discharge_cycles': 0,
             'full_charges': 0,
             'average_daily_usage': None,
-            'longest_session': None
+            'longest_session': None,
+            'median_session': None
         }
     
-    # Convert history to structured data
-    timestamps = []
-    percentages = []
-    is_charging = []
-    
-    for entry in history:
-        timestamps.append(datetime.datetime.fromisoformat(entry[0]))
-        percentages.append(entry[1])
-        is_charging.append(bool(entry[2]))
+    # Timestamps stay in epoch milliseconds
+    timestamps = context.timestamps
+    percentages = context.percentages
+    is_charging = context.is_charging
     
     # Initialize statistics
     stats = {
@@ -44,102 +58,225 @@ def calculate_statistics(days=7):
         'discharge_cycles': 0,
         'full_charges': 0,
         'average_daily_usage': None,
-        'longest_session': None
+        'longest_session': None,
+        'median_session': None
     }
     
-    # Calculate discharge and charge rates
-    discharge_rates = []
-    charge_rates = []
-    
-    for i in range(1, len(timestamps)):
-        time_diff = (timestamps[i] - timestamps[i-1]).total_seconds() / 3600  # in hours
-        if time_diff <= 0:
-            continue
-            
-        percentage_diff = percentages[i] - percentages[i-1]
-        rate = percentage_diff / time_diff  # % per hour
-        
-        if is_charging[i] and percentage_diff > 0:
-            charge_rates.append(rate)
-        elif not is_charging[i] and percentage_diff < 0:
-            discharge_rates.append(-rate)  # Make positive for easier interpretation
-    
-    stats['average_discharge_rate'] = np.mean(discharge_rates) if discharge_rates else None
-    stats['average_charge_rate'] = np.mean(charge_rates) if charge_rates else None
+    # Differences between consecutive rows; each interval belongs to the
+    # charging state of the row that ends it
+    time_diff = context.time_diff
+    percentage_diff = context.percentage_diff
+    charging_after = is_charging[1:]
+    was_charging = is_charging[:-1]
+    
+    # Calculate discharge and charge rates, weighted by time. Rows may be
+    # sparse (only changes and heartbeats are stored), so every interval
+    # counts towards the time spent charging or discharging, while gaps
+    # longer than MAX_SAMPLE_GAP_MS mean no monitor was running and are skipped.
+    counted = (time_diff > 0) & (time_diff <= MAX_SAMPLE_GAP_MS)
+    charging_intervals = counted & charging_after
+    discharging_intervals = counted & ~charging_after
+    rising = percentage_diff > 0
+    falling = percentage_diff < 0
+    
+    charge_hours = time_diff[charging_intervals].sum() / MS_PER_HOUR
+    discharge_hours = time_diff[discharging_intervals].sum() / MS_PER_HOUR
+    charged = percentage_diff[charging_intervals & rising].sum()
+    discharged = -percentage_diff[discharging_intervals & falling].sum()
+    
+    stats['average_discharge_rate'] = float(discharged / discharge_hours) if discharged > 0 else None
+    stats['average_charge_rate'] = float(charged / charge_hours) if charged > 0 else None
     
     # Count charging cycles (a cycle is when charging starts after discharging)
-    cycle_count = 0
-    last_was_charging = None
-    
-    for i in range(len(is_charging)):
-        if last_was_charging is not None and not last_was_charging and is_charging[i]:
-            cycle_count += 1
-        last_was_charging = is_charging[i]
+    stats['discharge_cycles'] = int(np.count_nonzero(~was_charging & charging_after))
     
-    stats['discharge_cycles'] = cycle_count
+    # Count full charges (when battery reaches FULL_CHARGE_LEVEL while charging)
+    stats['full_charges'] = int(np.count_nonzero(
+        charging_after & (percentages[1:] >= FULL_CHARGE_LEVEL) & (percentages[:-1] < FULL_CHARGE_LEVEL)
+    ))
     
-    # Count full charges (when battery reaches 100% while charging)
-    full_charges = 0
-    for i in range(1, len(percentages)):
-        if is_charging[i] and percentages[i] >= 99.5 and percentages[i-1] < 99.5:
-            full_charges += 1
-    
-    stats['full_charges'] = full_charges
-    
-    # Calculate average daily usage (how much battery % is used per day)
     if len(timestamps) >= 2:
-        total_days = (timestamps[-1] - timestamps[0]).total_seconds() / (24 * 3600)
+        # Calculate average daily usage (how much battery % is used per day)
+        total_days = (timestamps[-1] - timestamps[0]) / MS_PER_DAY
         if total_days > 0:
-            # Sum of all discharge percentages
-            total_discharge = 0
-            for i in range(1, len(percentages)):
-                diff = percentages[i] - percentages[i-1]
-                if diff < 0:
-                    total_discharge -= diff
-            
-            stats['average_daily_usage'] = total_discharge / total_days
-    
-    # Find longest session on battery
-    if len(timestamps) >= 2:
-        longest_session = 0
-        current_session = 0
-        session_start = None
+            total_discharge = -percentage_diff[falling].sum()
+            stats['average_daily_usage'] = float(total_discharge / total_days)
         
-        for i in range(len(is_charging)):
-            if not is_charging[i]:
-                if session_start is None:
-                    session_start = timestamps[i]
-            else:
-                if session_start is not None:
-                    session_duration = (timestamps[i] - session_start).total_seconds() / 3600
-                    longest_session = max(longest_session, session_duration)
-                    session_start = None
-        
-        # Check if we're still in a session at the end
-        if session_start is not None:
-            session_duration = (timestamps[-1] - session_start).total_seconds() / 3600
-            longest_session = max(longest_session, session_duration)
-        
-        stats['longest_session'] = longest_session
+        # Find longest session on battery: from the first row of each run of
+        # discharging rows to the row where charging resumes (or the last row)
+        starts, ends = context.sessions
+        durations = timestamps[ends] - timestamps[starts]
+        stats['longest_session'] = float(durations.max()) / MS_PER_HOUR if len(durations) else 0
+        stats['median_session'] = float(np.median(durations)) / MS_PER_HOUR if len(durations) else 0
+    
+    return stats
+
+
+@cached('sessions')
+@diag.timed('stats.sessions')
+def session_statistics(days=7):
+    """Cycle, full-charge and battery-session figures from stored sessions
+    
+    Agrees with calculate_statistics without loading the window: only the
+    session already running at the window's first row is clipped to it,
+    and its full charges are recounted from raw rows when it is charging.
+    """
+    start = days_ago_epoch_ms(days)
+    backend = get_backend()
+    first, last = backend.bounds(start)
+    
+    stats = {
+        'discharge_cycles': 0,
+        'full_charges': 0,
+        'longest_session': None,
+        'median_session': None,
+        'battery_sessions': 0
+    }
+    if first is None:
+        return stats
+    
+    # The head session is the one holding the first row; one ending there
+    # is the session before it
+    sessions = backend.read_sessions(start)
+    sessions = sessions[max(sum(1 for session in sessions if session[0] <= first) - 1, 0):]
+    head, later = sessions[0], sessions[1:]
+    
+    stats['discharge_cycles'] = sum(1 for session in later if session[2])
+    stats['full_charges'] = sum(session[6] for session in later)
+    if head[2]:
+        end = later[0][0] if later else None
+        rows = backend.read_range(first, end, columns=('percentage',))['percentage']
+        stats['full_charges'] += int(np.count_nonzero(
+            (rows[1:] >= FULL_CHARGE_LEVEL) & (rows[:-1] < FULL_CHARGE_LEVEL)
+        ))
+    
+    durations = np.array([session[1] - max(session[0], first) for session in sessions if not session[2]],
+                         dtype=np.int64)
+    stats['battery_sessions'] = len(durations)
+    if last > first:
+        stats['longest_session'] = float(durations.max()) / MS_PER_HOUR if len(durations) else 0
+        stats['median_session'] = float(np.median(durations)) / MS_PER_HOUR if len(durations) else 0
     
     return stats
 
 
-def generate_history_plot(days=7):
-    """Generate a plot of battery history"""
-    history = get_battery_history(days)
+def _power_data(start):
+    """Stored window summaries from start, and live samples newer than them
+    
+    The live samples come from a capture running in this process and are
+    None when there are none. They are read first, so a concurrent flush
+    cannot hide a window; samples it stored meanwhile are left to the
+    summaries.
+    """
+    capture = get_active_capture()
+    live = capture.unsummarized(start) if capture is not None else None
+    windows = get_power_summaries(start)
+    if live is not None and windows:
+        live = live[live['timestamp'] >= windows[-1][1]]
+    return windows, live if live is not None and len(live) else None
+
+
+@diag.timed('stats.power')
+def calculate_power_statistics(days=1):
+    """Summarize captured power draw over the specified number of days
+    
+    Combines stored window summaries with the live capture buffer. The
+    p95 figure is the highest per-window 95th percentile.
+    """
+    windows, live = _power_data(days_ago_epoch_ms(days))
+    windows = [row for row in windows if row[3] is not None]
+    
+    total_samples = sum(row[2] for row in windows)
+    total_watts = sum(row[2] * row[3] for row in windows)
+    p95 = [row[4] for row in windows]
+    peak = [row[5] for row in windows]
+    
+    if live is not None:
+        mean, live_p95, live_peak = summarize(live)
+        if mean is not None:
+            total_samples += len(live)
+            total_watts += len(live) * mean
+            p95.append(live_p95)
+            peak.append(live_peak)
+    
+    return {
+        'average_power': total_watts / total_samples if total_samples else None,
+        'peak_window_p95': max(p95) if p95 else None,
+        'max_power': max(peak) if peak else None,
+        'windows': len(windows),
+        'live_samples': len(live) if live is not None else 0
+    }
+
+
+@diag.timed('render.power')
+def generate_power_plot(days=1):
+    """Generate a plot of captured power draw"""
+    windows, live = _power_data(days_ago_epoch_ms(days))
     
-    if not history:
+    if not windows and live is None:
         return None
     
-    timestamps = []
-    percentages = []
-    charging_status = []
+    fig, ax = plt.figure(figsize=(10, 5)), plt.gca()
+    
+    if windows:
+        times = [from_epoch_ms((row[0] + row[1]) // 2) for row in windows]
+        mean = np.array([row[3] for row in windows], dtype=float)
+        p95 = np.array([row[4] for row in windows], dtype=float)
+        peak = np.array([row[5] for row in windows], dtype=float)
+        ax.fill_between(times, mean, p95, color='orange', alpha=0.3, label='Mean to p95')
+        ax.plot(times, mean, 'b-', label='Mean W')
+        ax.plot(times, peak, 'r.', markersize=3, label='Max W')
+    
+    if live is not None:
+        ax.plot([from_epoch_ms(ts) for ts in live['timestamp'].tolist()], live['watts'],
+                'k-', linewidth=0.5, alpha=0.7, label='Live W')
+    
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Power Draw (W)')
+    ax.set_title(f'Power Draw (Last {days} Days)')
+    ax.xaxis.set_major_formatter(DateFormatter('%m-%d %H:%M'))
+    ax.grid(True, alpha=0.3)
+    ax.legend()
+    
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    
+    return fig
+
+
+@cached('history')
+def history_plot_data(days=7):
+    """Battery history for plotting, thinned to about HISTORY_PLOT_POINTS"""
+    return get_backend().read_range(
+        days_ago_epoch_ms(days), columns=('timestamp', 'percentage', 'is_charging'),
+        max_points=HISTORY_PLOT_POINTS
+    )
+
+
+@cached('daily')
+def daily_rollups(days=7):
+    """Day rollups for the daily usage plot"""
+    return get_backend().read_rollups(days, 'day')
+
+
+@diag.timed('render.history')
+def generate_history_plot(days=7, context=None):
+    """Generate a plot of battery history
+    
+    With an AnalysisContext the series is thinned from the loaded window
+    instead of being read again.
+    """
+    if context is not None:
+        history = context.downsampled(HISTORY_PLOT_POINTS)
+    else:
+        history = history_plot_data(days)
+    
+    if not len(history['timestamp']):
+        return None
     
-    for entry in history:
-        timestamps.append(datetime.datetime.fromisoformat(entry[0]))
-        percentages.append(entry[1])
-        charging_status.append(bool(entry[2]))
+    timestamps = [from_epoch_ms(timestamp) for timestamp in history['timestamp'].tolist()]
+    percentages = history['percentage']
+    charge_starts, charge_ends = runs(history['is_charging'].astype(bool))
     
     fig, ax = plt.figure(figsize=(10, 5)), plt.gca()
     
@@ -147,27 +284,9 @@ def generate_history_plot(days=7):
     ax.plot(timestamps, percentages, 'b-', label='Battery %')
     
     # Highlight charging periods
-    charge_starts = []
-    charge_ends = []
-    in_charge = False
-    
-    for i, charging in enumerate(charging_status):
-        if charging and not in_charge:
-            charge_starts.append(i)
-            in_charge = True
-        elif not charging and in_charge:
-            charge_ends.append(i)
-            in_charge = False
-    
-    # If still charging at the end
-    if in_charge:
-        charge_ends.append(len(timestamps) - 1)
-    
-    # Create patches for charging periods
-    for start, end in zip(charge_starts, charge_ends):
-        if start < len(timestamps) and end < len(timestamps):
-            ax.axvspan(timestamps[start], timestamps[end], alpha=0.2, color='green', 
-                      label='_' if start > 0 else 'Charging')
+    for start, end in zip(charge_starts.tolist(), charge_ends.tolist()):
+        ax.axvspan(timestamps[start], timestamps[end], alpha=0.2, color='green',
+                   label='_' if start > 0 else 'Charging')
     
     ax.set_ylim(0, 100)
     ax.set_xlabel('Time')
@@ -177,7 +296,7 @@ def generate_history_plot(days=7):
     ax.grid(True, alpha=0.3)
     
     # Add legend only if there are charging periods
-    if charge_starts:
+    if len(charge_starts):
         ax.legend()
     
     plt.xticks(rotation=45)
@@ -186,53 +305,28 @@ def generate_history_plot(days=7):
     return fig
 
 
-def generate_daily_usage_plot(days=7):
+@diag.timed('render.daily')
+def generate_daily_usage_plot(days=7, context=None):
     """Generate a plot of daily battery usage"""
-    history = get_battery_history(days)
+    rollups = context.daily if context is not None else daily_rollups(days)
     
-    if not history:
+    if not rollups:
         return None
     
-    # Group data by day
-    daily_data = {}
-    
-    for entry in history:
-        timestamp = datetime.datetime.fromisoformat(entry[0])
-        date = timestamp.date()
-        
-        if date not in daily_data:
-            daily_data[date] = {
-                'min': 100,
-                'max': 0,
-                'charging_time': 0,
-                'samples': 0
-            }
-        
-        # Update min/max percentage
-        percentage = entry[1]
-        daily_data[date]['min'] = min(daily_data[date]['min'], percentage)
-        daily_data[date]['max'] = max(daily_data[date]['max'], percentage)
-        
-        # Count charging time
-        if bool(entry[2]):  # is_charging
-            daily_data[date]['charging_time'] += 1
-        
-        daily_data[date]['samples'] += 1
-    
-    # Calculate daily usage and charging percentage
-    dates = sorted(daily_data.keys())
+    # Calculate daily usage and charging percentage from the day rollups
+    dates = []
     daily_usage = []
     charging_percentage = []
     
-    for date in dates:
-        data = daily_data[date]
+    for bucket, first_ts, last_ts, low, high, mean, last, samples, charging_samples, plugged, charging_ms in rollups:
+        dates.append(from_epoch_ms(bucket).date())
+        
         # Daily usage is the difference between max and min
-        usage = data['max'] - data['min']
-        daily_usage.append(usage)
+        daily_usage.append(high - low)
         
         # Charging percentage is the percentage of time spent charging
-        if data['samples'] > 0:
-            charging_percentage.append((data['charging_time'] / data['samples']) * 100)
+        if samples > 0:
+            charging_percentage.append((charging_samples / samples) * 100)
         else:
             charging_percentage.append(0)
     
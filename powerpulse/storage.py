@@ -0,0 +1,426 @@
+"""
+Storage backends for PowerPulse
+
+This module defines the interface every history storage engine implements
+and the engines themselves: the SQLite database from powerpulse.database,
+and an append-only log of fixed-size records read through mmap, which
+suits high-frequency sampling where per-row SQLite overhead dominates.
+Settings always live in the SQLite database.
+"""
+
+import os
+import mmap
+import struct
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from powerpulse import database, diag
+from powerpulse.database import (
+    HISTORY_COLUMNS, HISTORY_ARRAY_DTYPES, days_ago_epoch_ms, now_epoch_ms
+)
+
+# Names accepted by the storage_backend setting and the --backend flag
+BACKENDS = ('sqlite', 'log')
+
+LOG_FILENAME = 'battery_history.ppl'
+LOG_MAGIC = b'PPLOG001'
+LOG_HEADER = struct.Struct('<8sI4x')
+
+# One fixed-size record per sample: percentage and temperature in tenths,
+# flags packed like the compact SQLite layout, remaining time in seconds
+LOG_RECORD_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('percentage', '<i2'),
+    ('flags', 'u1'),
+    ('temperature', '<i2'),
+    ('remaining_time', '<i4'),
+])
+MISSING_TENTHS = np.iinfo(np.int16).min
+MISSING_SECONDS = -1
+
+
+class StorageBackend(ABC):
+    """Interface implemented by every history storage engine"""
+
+    name = None
+
+    @abstractmethod
+    def append(self, battery_info):
+        """Store one battery reading; returns True if it was accepted
+
+        A 'timestamp' key (epoch milliseconds) records when the reading was
+        taken, so writes may be deferred; without it the current time is used.
+        """
+
+    @abstractmethod
+    def append_arrays(self, arrays):
+        """Bulk-store time-ordered history arrays; returns the rows stored"""
+
+    @abstractmethod
+    def flush(self):
+        """Make every appended reading durable"""
+
+    @abstractmethod
+    def read_range(self, start=None, end=None, columns=HISTORY_COLUMNS, max_points=None):
+        """Read history in [start, end) as a dict of NumPy arrays
+
+        Arrays follow database.HISTORY_ARRAY_DTYPES. max_points lets the
+        engine return a coarser series when the caller only needs that many.
+        """
+
+    @abstractmethod
+    def read_rollups(self, days=7, resolution='day'):
+        """Read aggregated buckets shaped like database.get_battery_rollups"""
+
+    @abstractmethod
+    def bounds(self, start=None):
+        """Timestamps of the first and the newest reading at or after start
+
+        (None, None) when there are none.
+        """
+
+    @abstractmethod
+    def read_sessions(self, start=None):
+        """Charging and discharging sessions overlapping [start, now)
+
+        Rows follow database.SESSION_COLUMNS, oldest first; the first
+        session may begin before start.
+        """
+
+    @abstractmethod
+    def apply_retention(self, days_to_keep=30):
+        """Drop history older than days_to_keep; returns the rows removed"""
+
+    def get_setting(self, key, default=None):
+        """Get a setting value"""
+        return database.get_setting(key, default)
+
+    def update_setting(self, key, value):
+        """Update a setting value"""
+        database.update_setting(key, value)
+
+    def close(self):
+        """Release any resources held by the engine"""
+        self.flush()
+
+
+class SQLiteBackend(StorageBackend):
+    """History stored in the partitioned SQLite database"""
+
+    name = 'sqlite'
+
+    @diag.timed('persist.append')
+    def append(self, battery_info):
+        return database.save_battery_info(battery_info)
+
+    def append_arrays(self, arrays):
+        return database.import_history(arrays)
+
+    def flush(self):
+        return database.flush_battery_history()
+
+    def read_range(self, start=None, end=None, columns=HISTORY_COLUMNS, max_points=None):
+        return database.get_battery_history_arrays(start, end, columns, max_points)
+
+    def read_rollups(self, days=7, resolution='day'):
+        return database.get_battery_rollups(days, resolution)
+
+    def bounds(self, start=None):
+        return database.get_history_bounds(start)
+
+    def read_sessions(self, start=None):
+        return database.get_sessions(start)
+
+    def apply_retention(self, days_to_keep=30):
+        return database.clear_old_history(days_to_keep)
+
+
+def _read_at(fd, size, offset):
+    """Read size bytes at offset; os.pread is not available on Windows
+
+    Callers hold the log lock, and appends ignore the file position.
+    """
+    os.lseek(fd, offset, os.SEEK_SET)
+    data = b''
+    while len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class LogBackend(StorageBackend):
+    """History stored as an append-only log of fixed-size records
+
+    Appends are a single write() of one record. Reads map the file and
+    return zero-copy views of the requested time range (see records());
+    timestamps are kept strictly increasing so ranges are binary searches.
+    """
+
+    name = 'log'
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(os.path.dirname(database.DB_PATH), LOG_FILENAME)
+        self._lock = threading.Lock()
+        self._map = None
+        self._map_size = 0
+        self._fd = None
+        self._last_ts = None
+
+    def _open(self):
+        """Open the log for appending, creating or repairing it as needed"""
+        if self._fd is not None:
+            return
+
+        # O_BINARY keeps Windows from translating newlines inside records
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0), 0o644)
+        size = os.fstat(fd).st_size
+        if size < LOG_HEADER.size:
+            os.ftruncate(fd, 0)
+            os.write(fd, LOG_HEADER.pack(LOG_MAGIC, LOG_RECORD_DTYPE.itemsize))
+            size = LOG_HEADER.size
+        else:
+            magic, record_size = LOG_HEADER.unpack(_read_at(fd, LOG_HEADER.size, 0))
+            if magic != LOG_MAGIC or record_size != LOG_RECORD_DTYPE.itemsize:
+                os.close(fd)
+                raise ValueError(f"Not a PowerPulse history log: {self.path}")
+
+        # Drop a partially written record left behind by a crash
+        tail = (size - LOG_HEADER.size) % LOG_RECORD_DTYPE.itemsize
+        if tail:
+            size -= tail
+            os.ftruncate(fd, size)
+
+        if size > LOG_HEADER.size:
+            last = _read_at(fd, LOG_RECORD_DTYPE.itemsize, size - LOG_RECORD_DTYPE.itemsize)
+            self._last_ts = int(np.frombuffer(last, dtype=LOG_RECORD_DTYPE)['timestamp'][0])
+        self._fd = fd
+
+    @diag.timed('persist.append')
+    def append(self, battery_info):
+        if not battery_info:
+            return False
+
+        record = np.zeros(1, dtype=LOG_RECORD_DTYPE)
+        percentage = battery_info['percentage']
+        temperature = battery_info['temperature']
+        remaining_time = battery_info['remaining_time']
+        record['percentage'] = MISSING_TENTHS if percentage is None else int(round(percentage * 10))
+        record['flags'] = ((database.FLAG_CHARGING if battery_info['is_charging'] else 0)
+                           | (database.FLAG_PLUGGED if battery_info['power_plugged'] else 0))
+        record['temperature'] = MISSING_TENTHS if temperature is None else int(round(temperature * 10))
+        record['remaining_time'] = MISSING_SECONDS if remaining_time is None else int(round(remaining_time))
+
+        with self._lock:
+            self._open()
+            timestamp = battery_info.get('timestamp') or now_epoch_ms()
+            if self._last_ts is not None and timestamp <= self._last_ts:
+                # Keep the log sorted even if the wall clock steps back
+                timestamp = self._last_ts + 1
+            record['timestamp'] = timestamp
+            os.write(self._fd, record.tobytes())
+            self._last_ts = timestamp
+        return True
+
+    def append_arrays(self, arrays):
+        """Bulk-append history arrays newer than everything in the log"""
+        timestamps = np.asarray(arrays['timestamp'], dtype=np.int64)
+        if len(timestamps) == 0:
+            return 0
+
+        records = np.zeros(len(timestamps), dtype=LOG_RECORD_DTYPE)
+        records['timestamp'] = timestamps
+        records['flags'] = (np.asarray(arrays['is_charging'], dtype=np.uint8) * database.FLAG_CHARGING
+                            | np.asarray(arrays['power_plugged'], dtype=np.uint8) * database.FLAG_PLUGGED)
+        for name in ('percentage', 'temperature'):
+            values = np.asarray(arrays[name], dtype=np.float64)
+            records[name] = np.where(np.isnan(values), MISSING_TENTHS, np.rint(np.nan_to_num(values) * 10))
+        remaining = np.asarray(arrays['remaining_time'], dtype=np.float64)
+        records['remaining_time'] = np.where(np.isnan(remaining), MISSING_SECONDS, np.rint(np.nan_to_num(remaining)))
+
+        with self._lock:
+            self._open()
+            if np.any(np.diff(timestamps) <= 0) or (self._last_ts is not None and timestamps[0] <= self._last_ts):
+                raise ValueError("The log only accepts strictly increasing timestamps newer than its last record")
+            data = memoryview(records.tobytes())
+            while data:
+                data = data[os.write(self._fd, data):]
+            self._last_ts = int(timestamps[-1])
+        return len(records)
+
+    def flush(self):
+        with self._lock:
+            if self._fd is not None:
+                with diag.stage('persist.commit'):
+                    os.fsync(self._fd)
+        return 0
+
+    def records(self, start=None, end=None):
+        """Zero-copy structured view of the raw records in [start, end)"""
+        with self._lock:
+            self._open()
+            size = os.fstat(self._fd).st_size
+            count = (size - LOG_HEADER.size) // LOG_RECORD_DTYPE.itemsize
+            if count == 0:
+                return np.empty(0, dtype=LOG_RECORD_DTYPE)
+
+            if self._map is None or self._map_size != size:
+                # Views handed out earlier keep the previous map alive
+                self._map = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+                self._map_size = size
+            records = np.frombuffer(self._map, dtype=LOG_RECORD_DTYPE, count=count, offset=LOG_HEADER.size)
+
+        timestamps = records['timestamp']
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+        hi = count if end is None else int(np.searchsorted(timestamps, end, side='left'))
+        return records[lo:hi]
+
+    def read_range(self, start=None, end=None, columns=HISTORY_COLUMNS, max_points=None):
+        records = self.records(start, end)
+        if max_points:
+            # Same buckets and values as SQLite's rollup rows; the log keeps
+            # no rollups, so they are aggregated here
+            lower = start if start is not None else 0
+            days = ((end if end is not None else now_epoch_ms()) - lower) / database.ROLLUP_WIDTH_MS['day']
+            resolution = database.choose_rollup_resolution(days, max_points)
+            if resolution is not None:
+                return self._bucket(records, columns, resolution)
+        return self._decode(records, columns)
+
+    def _bucket(self, records, columns, resolution):
+        """One row per rollup bucket, shaped like database._rollups_as_history"""
+        records = records[records['percentage'] != MISSING_TENTHS]
+        timestamps = np.asarray(records['timestamp'])
+        buckets = database.rollup_buckets(timestamps, resolution)
+        starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+        samples = np.diff(np.append(starts, len(timestamps)))
+
+        def majority(flag):
+            if not len(starts):
+                return np.empty(0, dtype=bool)
+            return np.add.reduceat(((records['flags'] & flag) != 0).astype(np.int64), starts) * 2 > samples
+
+        bucketed = {
+            'timestamp': timestamps[starts],
+            'percentage': (np.add.reduceat(records['percentage'].astype(np.float64), starts) / 10 / samples
+                           if len(starts) else np.empty(0)),
+            'is_charging': majority(database.FLAG_CHARGING),
+            'power_plugged': majority(database.FLAG_PLUGGED),
+            'temperature': np.full(len(starts), np.nan),
+            'remaining_time': np.full(len(starts), np.nan),
+        }
+        decoded = {}
+        for name in columns:
+            if name not in HISTORY_ARRAY_DTYPES:
+                raise ValueError(f"Unknown history column: {name}")
+            decoded[name] = np.ascontiguousarray(bucketed[name], dtype=HISTORY_ARRAY_DTYPES[name])
+        return decoded
+
+    def _decode(self, records, columns):
+        """Columns of raw records as arrays typed per HISTORY_ARRAY_DTYPES"""
+        decoded = {}
+        for name in columns:
+            if name not in HISTORY_ARRAY_DTYPES:
+                raise ValueError(f"Unknown history column: {name}")
+            if name == 'timestamp':
+                values = records['timestamp']
+            elif name == 'is_charging':
+                values = (records['flags'] & database.FLAG_CHARGING) != 0
+            elif name == 'power_plugged':
+                values = (records['flags'] & database.FLAG_PLUGGED) != 0
+            elif name == 'remaining_time':
+                raw = records['remaining_time']
+                values = np.where(raw == MISSING_SECONDS, np.nan, raw)
+            else:
+                raw = records[name]
+                values = np.where(raw == MISSING_TENTHS, np.nan, raw / 10)
+            decoded[name] = np.ascontiguousarray(values, dtype=HISTORY_ARRAY_DTYPES[name])
+        return decoded
+
+    def read_rollups(self, days=7, resolution='day'):
+        columns = ('timestamp', 'percentage', 'is_charging', 'power_plugged')
+        arrays = self.read_range(days_ago_epoch_ms(days), columns=columns)
+        rows = zip(*(arrays[name].tolist() for name in columns))
+        return database.aggregate_rollups(rows, resolution)
+
+    def bounds(self, start=None):
+        timestamps = self.records(start)['timestamp']
+        if not len(timestamps):
+            return None, None
+        return int(timestamps[0]), int(timestamps[-1])
+
+    def read_sessions(self, start=None):
+        """Sessions computed from the records; the log keeps no sessions table"""
+        arrays = self.read_range(start, columns=('timestamp', 'percentage', 'is_charging'))
+        return database.sessions_from_arrays(arrays['timestamp'], arrays['percentage'], arrays['is_charging'])
+
+    def apply_retention(self, days_to_keep=30):
+        """Rewrite the log without records older than days_to_keep
+
+        The file is replaced atomically, so retention should run in the
+        process that appends to the log.
+        """
+        threshold = days_ago_epoch_ms(days_to_keep)
+        keep = self.records(threshold)
+        removed = len(self.records()) - len(keep)
+        if removed == 0:
+            return 0
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(LOG_HEADER.pack(LOG_MAGIC, LOG_RECORD_DTYPE.itemsize))
+            f.write(keep.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self._lock:
+            os.replace(tmp_path, self.path)
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = None
+            self._map = None
+            self._map_size = 0
+        database.reset_running_statistics()
+        return removed
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._map = None
+
+
+_backend = None
+_backend_override = None
+_backend_lock = threading.Lock()
+
+
+def set_backend(name):
+    """Select the storage backend for this process, overriding the setting"""
+    global _backend_override
+
+    if name is not None and name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {name}")
+    with _backend_lock:
+        _backend_override = name
+
+
+def get_backend():
+    """Get the storage backend selected by --backend or the storage_backend setting"""
+    global _backend
+
+    name = _backend_override or database.get_setting('storage_backend', 'sqlite')
+    if name not in BACKENDS:
+        name = 'sqlite'
+
+    with _backend_lock:
+        if _backend is None or _backend.name != name:
+            if _backend is not None:
+                _backend.close()
+            _backend = LogBackend() if name == 'log' else SQLiteBackend()
+        return _backend
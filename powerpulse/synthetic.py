@@ -0,0 +1,275 @@
+"""
+Synthetic battery traces for PowerPulse
+
+This module generates realistic battery histories (discharge under varying
+load, constant-current/constant-voltage charging, docked periods, suspend
+gaps, unplug events and sensor noise) for load testing, writes them into
+the history or a fake /sys/class/power_supply tree, and replays recorded
+or synthetic traces through get_battery_info at any speed.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from powerpulse.database import HISTORY_COLUMNS, HISTORY_ARRAY_DTYPES, now_epoch_ms
+from powerpulse.providers import BatteryProvider
+
+# Trace columns: the history columns plus the power draw in watts
+TRACE_COLUMNS = HISTORY_COLUMNS + ('power_now',)
+TRACE_DTYPES = dict(HISTORY_ARRAY_DTYPES, power_now=np.float32)
+
+DESIGN_CAPACITY_WH = 50.0
+CV_THRESHOLD = 80.0     # percentage where charging switches to constant voltage
+CV_TIME_CONSTANT = 0.5  # hours
+SUSPEND_DRAIN = 0.5     # % per hour while suspended
+
+
+def _discharge(rng, t, start, capacity):
+    """Percentage, power and remaining time while running on battery"""
+    load = np.clip(rng.lognormal(np.log(9.0), 0.4), 3.0, 40.0)
+    power = load * (1 + 0.15 * rng.standard_normal(len(t)))
+    # Occasional short spikes (compiles, video calls)
+    spikes = rng.random(len(t)) < 0.01
+    power[spikes] *= rng.uniform(1.5, 3.0, spikes.sum())
+    power = np.clip(power, 1.0, None)
+
+    used = np.cumsum(power * np.diff(t, prepend=t[0])) / 3600 / capacity * 100
+    percentage = start - used
+    remaining = np.clip(percentage, 0, None) / (load / capacity * 100) * 3600
+    return percentage, power, remaining
+
+
+def _charge(rng, t, start, capacity):
+    """Percentage, power and time to full while charging (CC then CV)"""
+    rate = rng.uniform(40.0, 70.0)  # % per hour in the constant-current phase
+    hours = t / 3600
+    cc_hours = max(0.0, (CV_THRESHOLD - start) / rate)
+    cv_start = max(start, CV_THRESHOLD)
+
+    percentage = np.where(
+        hours < cc_hours,
+        start + rate * hours,
+        100 - (100 - cv_start) * np.exp(-(hours - cc_hours) / CV_TIME_CONSTANT),
+    )
+    slope = np.where(hours < cc_hours, rate, (100 - percentage) / CV_TIME_CONSTANT)
+    power = slope / 100 * capacity * (1 + 0.05 * rng.standard_normal(len(t)))
+
+    # Time left in each phase, counting "full" as 99.5%
+    cc_left = np.clip(CV_THRESHOLD - percentage, 0, None) / rate
+    cv_left = CV_TIME_CONSTANT * np.log(np.clip(100 - np.maximum(percentage, CV_THRESHOLD), 0.5, None) / 0.5)
+    remaining = (cc_left + cv_left) * 3600
+    return percentage, np.abs(power), remaining
+
+
+def generate_trace(days=7, interval=30, end=None, seed=None, capacity=DESIGN_CAPACITY_WH):
+    """Generate a synthetic battery trace
+
+    Returns a dict of arrays keyed by TRACE_COLUMNS covering days up to end
+    (epoch milliseconds, default now), sampled every interval seconds
+    except during suspend gaps.
+    """
+    rng = np.random.default_rng(seed)
+    end = now_epoch_ms() if end is None else end
+    start = end - int(days * 86400 * 1000)
+    step = int(interval * 1000)
+
+    segments = []
+    clock = start
+    percentage = rng.uniform(60.0, 100.0)
+    state = 'discharge'
+
+    while clock < end:
+        if state == 'discharge':
+            low = rng.uniform(8.0, 30.0)
+            # Unplugged sessions sometimes end early (plugged in at a desk)
+            if rng.random() < 0.3:
+                low = max(low, rng.uniform(30.0, 70.0))
+            duration = 6 * 3600
+            t = np.arange(0, duration, interval, dtype=np.float64)
+            values, power, remaining = _discharge(rng, t, percentage, capacity)
+            count = max(1, int(np.searchsorted(-values, -low)))
+
+            # A suspend partway through the session
+            if rng.random() < 0.25 and count > 10:
+                cut = int(rng.integers(1, count - 1))
+                segments.append((clock, step, values[:cut], False, False, power[:cut], remaining[:cut]))
+                clock += cut * step
+                gap_hours = rng.uniform(0.5, 8.0)
+                clock += int(gap_hours * 3600 * 1000)
+                percentage = max(1.0, values[cut - 1] - SUSPEND_DRAIN * gap_hours)
+                continue
+
+            segments.append((clock, step, values[:count], False, False, power[:count], remaining[:count]))
+            clock += count * step
+            percentage = max(0.0, values[count - 1])
+            state = 'charge'
+
+        elif state == 'charge':
+            t = np.arange(0, 4 * 3600, interval, dtype=np.float64)
+            values, power, remaining = _charge(rng, t, percentage, capacity)
+            target = 100.0 if rng.random() < 0.7 else rng.uniform(70.0, 95.0)
+            count = max(1, int(np.searchsorted(values, min(target, 99.9))))
+            segments.append((clock, step, values[:count], True, True, power[:count], remaining[:count]))
+            clock += count * step
+            percentage = min(100.0, values[count - 1])
+            state = 'docked' if target == 100.0 and rng.random() < 0.5 else 'discharge'
+
+        else:
+            count = max(1, int(rng.uniform(1.0, 10.0) * 3600 / interval))
+            values = np.full(count, 100.0)
+            power = np.zeros(count)
+            segments.append((clock, step, values, False, True, power, np.full(count, np.nan)))
+            clock += count * step
+            percentage = 100.0
+            state = 'discharge'
+
+    columns = {name: [] for name in TRACE_COLUMNS}
+    for seg_start, seg_step, values, charging, plugged, power, remaining in segments:
+        count = len(values)
+        timestamps = seg_start + np.arange(count, dtype=np.int64) * seg_step + rng.integers(0, 50, count)
+        # Sensor noise, except while docked where firmware reports a steady 100%
+        noisy = values + 0.15 * rng.standard_normal(count) if charging or not plugged else values
+        columns['timestamp'].append(timestamps)
+        columns['percentage'].append(np.round(np.clip(noisy, 0, 100), 1))
+        columns['is_charging'].append(np.full(count, charging))
+        columns['power_plugged'].append(np.full(count, plugged))
+        columns['temperature'].append(np.round(28 + 0.4 * power + 0.3 * rng.standard_normal(count), 1))
+        columns['remaining_time'].append(np.round(remaining))
+        columns['power_now'].append(power)
+
+    trace = {name: np.concatenate(parts).astype(TRACE_DTYPES[name]) for name, parts in columns.items()}
+    keep = (trace['timestamp'] >= start) & (trace['timestamp'] < end)
+    return {name: values[keep] for name, values in trace.items()}
+
+
+def save_trace(path, trace):
+    """Write a trace to a .npy (structured array) or .csv file"""
+    records = np.zeros(len(trace['timestamp']), dtype=[(name, TRACE_DTYPES[name]) for name in TRACE_COLUMNS])
+    for name in TRACE_COLUMNS:
+        records[name] = trace[name]
+    if path.endswith('.csv'):
+        np.savetxt(path, np.column_stack([records[name].astype(np.float64) for name in TRACE_COLUMNS]),
+                   fmt='%.10g', delimiter=',', header=','.join(TRACE_COLUMNS), comments='')
+    else:
+        np.save(path, records)
+    return len(records)
+
+
+def load_trace(path):
+    """Read a trace written by save_trace (or a CSV with the same header)"""
+    if path.endswith('.csv'):
+        records = np.genfromtxt(path, delimiter=',', names=True)
+    else:
+        records = np.load(path)
+    return {
+        name: records[name].astype(TRACE_DTYPES[name])
+        for name in TRACE_COLUMNS if name in records.dtype.names
+    }
+
+
+def write_sysfs_tree(root, info, battery='BAT0', adapter='AC', capacity=DESIGN_CAPACITY_WH):
+    """Write one reading as a fake /sys/class/power_supply tree under root
+
+    Files are rewritten in place, so a SysfsBatteryReader holding them open
+    sees each new reading, which allows animating the tree from a trace.
+    """
+    percentage = info['percentage']
+    if info['is_charging']:
+        status = 'Charging'
+    elif info['power_plugged']:
+        status = 'Full' if percentage >= 99.5 else 'Not charging'
+    else:
+        status = 'Discharging'
+
+    power = info.get('power_now') or 0.0
+    energy_full = int(capacity * 1e6)
+    battery_files = {
+        'type': 'Battery',
+        'status': status,
+        'present': '1',
+        'capacity': str(int(round(percentage))),
+        'energy_full': str(energy_full),
+        'energy_now': str(int(energy_full * percentage / 100)),
+        'power_now': str(int(power * 1e6)),
+        'voltage_now': str(int(11.4e6 + 1.2e6 * percentage / 100)),
+        'cycle_count': str(info.get('cycle_count', 0)),
+    }
+    if info.get('temperature') is not None:
+        battery_files['temp'] = str(int(round(info['temperature'] * 10)))
+    adapter_files = {
+        'type': 'Mains',
+        'online': '1' if info['power_plugged'] else '0',
+    }
+
+    for name, files in ((battery, battery_files), (adapter, adapter_files)):
+        directory = os.path.join(root, name)
+        os.makedirs(directory, exist_ok=True)
+        for attribute, value in files.items():
+            with open(os.path.join(directory, attribute), 'w') as f:
+                f.write(value + '\n')
+
+
+def trace_reading(trace, index):
+    """The reading at index of a trace, shaped like get_battery_info's result"""
+    reading = {}
+    for name in TRACE_COLUMNS:
+        value = trace[name][index].item()
+        if isinstance(value, float):
+            # Drop float32 noise (64.5999984 -> 64.6); NaN means not reported
+            value = None if value != value else round(value, 4)
+        reading[name] = value
+    return reading
+
+
+class ReplayProvider(BatteryProvider):
+    """Replays a recorded or synthetic trace as if it were a battery
+
+    speed is how many trace seconds pass per wall-clock second; None (or 0)
+    returns the next row on every read, as fast as the caller asks. Readings
+    carry the trace's timestamps, so replayed history keeps its original
+    time line. Without a trace, a one-week synthetic trace is generated.
+    """
+
+    name = 'replay'
+
+    def __init__(self, trace=None, speed=None, loop=False):
+        if trace is None:
+            trace = generate_trace(days=7, seed=0)
+        elif isinstance(trace, str):
+            trace = load_trace(trace)
+        self.trace = trace
+        self.speed = speed or None
+        self.loop = loop
+        self.position = 0
+        self._started = None
+
+    def _index(self):
+        count = len(self.trace['timestamp'])
+        if self.speed is None:
+            index = self.position
+            self.position += 1
+        else:
+            now = time.monotonic()
+            if self._started is None:
+                self._started = now
+            target = int(self.trace['timestamp'][0]) + (now - self._started) * self.speed * 1000
+            index = max(0, int(np.searchsorted(self.trace['timestamp'], target, side='right')) - 1)
+            self.position = index + 1
+
+        if index >= count:
+            if not self.loop or count == 0:
+                return None
+            # Start over from the beginning
+            self.position = 0
+            self._started = None
+            return self._index()
+        return index
+
+    def read(self):
+        index = self._index()
+        if index is None:
+            return None
+        return trace_reading(self.trace, index)
+
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+"""
+PowerPulse Benchmark Suite
+--------------------------
+This script seeds throwaway databases with synthetic battery history and
+times the hot paths at each size:
+- bulk import and save_battery_info throughput
+- get_battery_history latency over several windows
+- calculate_statistics, generate_history_plot and generate_daily_usage_plot
+  (time and peak memory, with the result cache off), and a cached stats call
+- CLI cold start
+
+Every size runs in its own process with its own data directory, so the
+user's real history is never touched. Results are written as JSON; pass
+--baseline to flag regressions against an earlier results file.
+
+Examples:
+    python scripts/benchmark.py --sizes 10k,100k --output baseline.json
+    python scripts/benchmark.py --sizes 10k,100k --baseline baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent.absolute()
+
+DEFAULT_SIZES = "10k,100k,1M,10M"
+SAMPLE_INTERVAL = 30             # seconds between synthetic samples
+HISTORY_WINDOWS = (1, 7, 30, 365)  # days
+STATS_WINDOWS = (7, 30, 365)       # days
+SAVE_SAMPLES = 20000             # readings stored one by one through the backend
+SEED_CHUNK_DAYS = 365            # synthetic history generated a year at a time
+
+# A metric regresses when it is this much worse than the baseline...
+DEFAULT_THRESHOLD = 0.25
+# ...and the difference is larger than measurement noise
+NOISE_FLOOR = {'s': 0.002, 'MB': 1.0, 'rows/s': 0.0}
+
+
+def parse_size(text):
+    """Parse a row count such as 10k or 1M."""
+    text = text.strip().lower()
+    factor = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    if factor != 1:
+        text = text[:-1]
+    return int(float(text) * factor)
+
+
+def format_size(rows):
+    """Short label for a row count, e.g. 100k."""
+    for suffix, factor in (('M', 1000000), ('k', 1000)):
+        if rows >= factor and rows % factor == 0:
+            return f"{rows // factor}{suffix}"
+    return str(rows)
+
+
+def metric(value, unit):
+    return {'value': value, 'unit': unit}
+
+
+def best_time(func, repeat):
+    """Fastest of several timed calls, in seconds."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(func):
+    """Peak memory allocated by one call, in MB (NumPy buffers included)."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_environment(data_dir):
+    """Environment that points PowerPulse at a throwaway data directory."""
+    env = dict(os.environ)
+    env['HOME'] = data_dir
+    env['USERPROFILE'] = data_dir
+    env['APPDATA'] = data_dir
+    env['MPLBACKEND'] = 'Agg'
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(REPO_ROOT), env.get('PYTHONPATH')]))
+    return env
+
+
+# Worker: runs inside the throwaway data directory
+
+def seed_history(rows, seed):
+    """Fill the history with about rows synthetic samples ending now."""
+    from powerpulse.database import now_epoch_ms
+    from powerpulse.storage import get_backend
+    from powerpulse.synthetic import generate_trace
+
+    # Generate newest first until there are enough rows, then load oldest first
+    chunks = []
+    total = 0
+    end = now_epoch_ms()
+    while total < rows:
+        chunk = generate_trace(days=SEED_CHUNK_DAYS, interval=SAMPLE_INTERVAL, end=end, seed=seed + len(chunks))
+        if not len(chunk['timestamp']):
+            break
+        chunks.append(chunk)
+        total += len(chunk['timestamp'])
+        end = int(chunk['timestamp'][0])
+
+    excess = total - rows
+    if chunks and excess > 0:
+        chunks[-1] = {name: values[excess:] for name, values in chunks[-1].items()}
+
+    started = time.perf_counter()
+    stored = 0
+    for chunk in reversed(chunks):
+        stored += get_backend().append_arrays(chunk)
+    get_backend().flush()
+    elapsed = time.perf_counter() - started
+    return stored, elapsed
+
+
+def run_worker(rows, repeat, backend, seed):
+    """Seed one database and measure every hot path against it."""
+    from powerpulse.database import setup_database, get_battery_history, days_ago_epoch_ms, now_epoch_ms
+    from powerpulse.storage import get_backend, set_backend
+
+    setup_database()
+    if backend:
+        set_backend(backend)
+
+    import matplotlib.pyplot as plt
+    from powerpulse.cache import get_cache
+    from powerpulse.stats import calculate_statistics, generate_history_plot, generate_daily_usage_plot
+
+    # Time the computations themselves; cache hits are measured separately
+    get_cache().enabled = False
+
+    results = {}
+    stored, elapsed = seed_history(rows, seed)
+    results['rows'] = metric(stored, 'rows')
+    results['bulk_import'] = metric(stored / elapsed if elapsed else 0.0, 'rows/s')
+
+    if get_backend().name == 'sqlite':
+        read_history = get_battery_history
+    else:
+        def read_history(days):
+            return get_backend().read_range(days_ago_epoch_ms(days))
+
+    for days in HISTORY_WINDOWS:
+        results[f'history_{days}d'] = metric(best_time(lambda: read_history(days), repeat), 's')
+
+    for days in STATS_WINDOWS:
+        results[f'stats_{days}d'] = metric(best_time(lambda: calculate_statistics(days), repeat), 's')
+        results[f'stats_{days}d_memory'] = metric(peak_memory(lambda: calculate_statistics(days)), 'MB')
+
+    get_cache().enabled = True
+    calculate_statistics(7)
+    results['stats_7d_cached'] = metric(best_time(lambda: calculate_statistics(7), repeat), 's')
+    get_cache().enabled = False
+
+    def plot(generate, days):
+        fig = generate(days)
+        if fig is not None:
+            plt.close(fig)
+
+    for name, generate in (('history_plot', generate_history_plot), ('daily_plot', generate_daily_usage_plot)):
+        for days in (7, 365):
+            results[f'{name}_{days}d'] = metric(best_time(lambda: plot(generate, days), repeat), 's')
+            results[f'{name}_{days}d_memory'] = metric(peak_memory(lambda: plot(generate, days)), 'MB')
+
+    # Last, so the extra rows do not change what the reads above see
+    backend_store = get_backend()
+    start = now_epoch_ms() + 1000
+    reading = {
+        'percentage': 50.0,
+        'is_charging': False,
+        'power_plugged': False,
+        'temperature': 30.0,
+        'remaining_time': 3600,
+    }
+    started = time.perf_counter()
+    for i in range(SAVE_SAMPLES):
+        backend_store.append(dict(reading, timestamp=start + i * SAMPLE_INTERVAL * 1000,
+                                  percentage=50.0 + (i % 20) * 0.5))
+    backend_store.flush()
+    elapsed = time.perf_counter() - started
+    results['save_throughput'] = metric(SAVE_SAMPLES / elapsed, 'rows/s')
+
+    try:
+        import resource
+        # ru_maxrss is KB on Linux and bytes on macOS
+        scale = 1e6 if sys.platform == 'darwin' else 1e3
+        results['peak_rss'] = metric(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 'MB')
+    except ImportError:
+        pass
+
+    return results
+
+
+# Driver
+
+def cli_cold_start(env, repeat):
+    """Time fresh CLI processes: argument parsing only, and a stats report."""
+    results = {}
+    commands = {
+        'cli_help': ['--help'],
+        'cli_stats': ['--no-cache', 'stats', '--days', '7'],
+    }
+    for name, arguments in commands.items():
+        def run():
+            subprocess.run([sys.executable, '-m', 'powerpulse.cli'] + arguments, env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        results[name] = metric(best_time(run, repeat), 's')
+    return results
+
+
+def run_size(rows, args):
+    """Benchmark one database size in a separate process."""
+    data_dir = tempfile.mkdtemp(prefix='powerpulse-bench-')
+    env = benchmark_environment(data_dir)
+    output = os.path.join(data_dir, 'worker.json')
+    try:
+        cmd = [sys.executable, str(Path(__file__).absolute()), '--worker', str(rows),
+               '--worker-output', output, '--repeat', str(args.repeat), '--seed', str(args.seed)]
+        if args.backend:
+            cmd += ['--backend', args.backend]
+        subprocess.run(cmd, env=env, check=True)
+        with open(output) as f:
+            results = json.load(f)
+        results.update(cli_cold_start(env, args.repeat))
+        return results
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def environment_info():
+    import sqlite3
+    import numpy
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'numpy': numpy.__version__,
+        'sqlite': sqlite3.sqlite_version,
+    }
+
+
+def compare(results, baseline, threshold):
+    """List the metrics that regressed against the baseline."""
+    regressions = []
+    for size, metrics in results['results'].items():
+        previous = baseline.get('results', {}).get(size, {})
+        for name, current in metrics.items():
+            before = previous.get(name)
+            unit = current['unit']
+            if before is None or unit not in NOISE_FLOOR or not before['value']:
+                continue
+            if unit == 'rows/s':
+                # Throughput: higher is better
+                change = (before['value'] - current['value']) / before['value']
+            else:
+                change = (current['value'] - before['value']) / before['value']
+            if change > threshold and abs(current['value'] - before['value']) > NOISE_FLOOR[unit]:
+                regressions.append((size, name, before['value'], current['value'], unit, change))
+    return regressions
+
+
+def print_results(results):
+    for size, metrics in results['results'].items():
+        print(f"\n{size} samples")
+        print("-" * 40)
+        for name, value in metrics.items():
+            number = value['value']
+            if value['unit'] == 's':
+                text = f"{number * 1000:.1f} ms"
+            elif value['unit'] == 'rows/s':
+                text = f"{number:,.0f} rows/s"
+            elif value['unit'] == 'MB':
+                text = f"{number:.1f} MB"
+            else:
+                text = f"{number}"
+            print(f"{name:<28}{text}")
+
+
+def main():
+    """Main entry point for the benchmark script."""
+    parser = argparse.ArgumentParser(description="Benchmark PowerPulse at several history sizes")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated row counts (default: {DEFAULT_SIZES})")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per timing; the fastest is kept")
+    parser.add_argument("--backend", choices=["sqlite", "log"], help="Storage backend to benchmark")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the synthetic history")
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the results")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--results", help="Compare this existing results file instead of running")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Relative slowdown that counts as a regression (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        results = run_worker(args.worker, args.repeat, args.backend, args.seed)
+        with open(args.worker_output, 'w') as f:
+            json.dump(results, f)
+        return
+
+    if args.results:
+        with open(args.results) as f:
+            results = json.load(f)
+    else:
+        results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'backend': args.backend or 'sqlite',
+            'environment': environment_info(),
+            'results': {},
+        }
+        for rows in [parse_size(size) for size in args.sizes.split(',')]:
+            print(f"Benchmarking {format_size(rows)} samples...")
+            results['results'][format_size(rows)] = run_size(rows, args)
+
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print_results(results)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if not regressions:
+            print(f"\nNo regressions against {args.baseline}")
+            return
+        print(f"\nRegressions against {args.baseline}:")
+        for size, name, before, after, unit, change in regressions:
+            print(f"  {size} {name}: {before:.4g} -> {after:.4g} {unit} ({change:+.0%} worse)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
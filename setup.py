@@ -16,7 +16,7 @@ platform_deps = {
 install_requires = [
     'psutil>=5.9.0',
     'matplotlib>=3.5.0',
-    'numpy>=1.20.0',
+    'numpy>=1.23.0',
 ]
 
 # Development requirements
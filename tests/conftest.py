@@ -0,0 +1,64 @@
+"""
+Shared fixtures for the PowerPulse tests
+
+powerpulse.database creates its data directory under the home directory
+on import, so HOME is pointed at a scratch directory before any powerpulse
+module is imported; the data_dir fixture then gives each test a fresh
+database of its own.
+"""
+
+import os
+import tempfile
+
+os.environ['HOME'] = tempfile.mkdtemp(prefix='powerpulse-tests-')
+os.environ['APPDATA'] = os.environ['HOME']
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import numpy as np
+import pytest
+
+from powerpulse import database, storage, cache, running_stats
+from powerpulse.synthetic import generate_trace
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """A fresh, set up database in tmp_path, with the process singletons reset"""
+    database.close_connections()
+    monkeypatch.setattr(database, 'APP_DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'battery_history.db'))
+    monkeypatch.setattr(cache, 'APP_DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(database, '_sample_buffer', database.SampleBuffer())
+    monkeypatch.setattr(storage, '_backend', None)
+    monkeypatch.setattr(storage, '_backend_override', None)
+    monkeypatch.setattr(running_stats, '_running', None)
+    cache.get_cache().clear()
+    cache.get_cache().enabled = True
+
+    database.setup_database()
+    yield tmp_path
+
+    if storage._backend is not None:
+        storage._backend.close()
+    database.close_connections()
+    cache.get_cache().clear()
+
+
+@pytest.fixture
+def trace():
+    """Ten days of synthetic history ending now, as history arrays"""
+    return generate_trace(days=10, interval=60, seed=7)
+
+
+def history_arrays(timestamps, percentages, charging, plugged=None):
+    """History arrays from plain sequences, with the optional columns missing"""
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    charging = np.asarray(charging, dtype=bool)
+    return {
+        'timestamp': timestamps,
+        'percentage': np.asarray(percentages, dtype=np.float64),
+        'is_charging': charging,
+        'power_plugged': charging if plugged is None else np.asarray(plugged, dtype=bool),
+        'temperature': np.full(len(timestamps), np.nan),
+        'remaining_time': np.full(len(timestamps), np.nan),
+    }
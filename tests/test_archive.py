@@ -0,0 +1,224 @@
+"""Tests for the compressed history archives"""
+
+import os
+
+import numpy as np
+import pytest
+
+from powerpulse import database
+from powerpulse.archive import ArchiveFile, write_archive, BLOCK_RECORDS
+from powerpulse.database import HISTORY_COLUMNS, HISTORY_ARRAY_DTYPES
+from powerpulse.synthetic import generate_trace
+
+
+def random_arrays(rows, seed=0):
+    """History arrays at archive precision, with missing readings"""
+    rng = np.random.default_rng(seed)
+    arrays = {
+        'timestamp': 1_700_000_000_000 + np.cumsum(rng.integers(1, 120000, rows)),
+        'percentage': np.round(rng.uniform(0, 100, rows), 1),
+        'is_charging': rng.random(rows) < 0.4,
+        'power_plugged': rng.random(rows) < 0.5,
+        'temperature': np.round(rng.uniform(20, 60, rows), 1),
+        'remaining_time': np.round(rng.uniform(0, 30000, rows)),
+    }
+    for name in ('percentage', 'temperature', 'remaining_time'):
+        arrays[name][rng.random(rows) < 0.05] = np.nan
+    return {name: values.astype(HISTORY_ARRAY_DTYPES[name]) for name, values in arrays.items()}
+
+
+def assert_arrays_equal(actual, expected, columns=HISTORY_COLUMNS):
+    assert set(actual) == set(columns)
+    for name in columns:
+        np.testing.assert_array_equal(np.asarray(actual[name], dtype=HISTORY_ARRAY_DTYPES[name]),
+                                      np.asarray(expected[name], dtype=HISTORY_ARRAY_DTYPES[name]), err_msg=name)
+
+
+def sliced(arrays, start=None, end=None):
+    timestamps = arrays['timestamp']
+    mask = np.ones(len(timestamps), dtype=bool)
+    if start is not None:
+        mask &= timestamps >= start
+    if end is not None:
+        mask &= timestamps < end
+    return {name: values[mask] for name, values in arrays.items()}
+
+
+# File format
+
+@pytest.mark.parametrize('rows', [0, 1, BLOCK_RECORDS, 3 * BLOCK_RECORDS + 17])
+def test_round_trip(tmp_path, rows):
+    arrays = random_arrays(rows)
+    path = str(tmp_path / 'week.ppa')
+    write_archive(path, arrays)
+    assert not os.path.exists(path + '.tmp')
+
+    with ArchiveFile(path) as archive:
+        assert archive.record_count == rows
+        assert len(archive.index) == -(-rows // BLOCK_RECORDS)
+        assert archive.first_ts == (int(arrays['timestamp'][0]) if rows else None)
+        assert archive.last_ts == (int(arrays['timestamp'][-1]) if rows else None)
+        assert_arrays_equal(archive.read(), arrays)
+
+
+def test_range_reads(tmp_path):
+    arrays = random_arrays(3 * BLOCK_RECORDS + 17, seed=1)
+    timestamps = arrays['timestamp']
+    path = str(tmp_path / 'week.ppa')
+    write_archive(path, arrays)
+
+    rng = np.random.default_rng(2)
+    with ArchiveFile(path) as archive:
+        bounds = [(None, None), (None, int(timestamps[5000])), (int(timestamps[5000]), None),
+                  (int(timestamps[0]) - 1, int(timestamps[-1]) + 1), (int(timestamps[-1]) + 1, None)]
+        bounds += [tuple(sorted(int(value) for value in rng.integers(timestamps[0] - 1000, timestamps[-1] + 1000, 2)))
+                   for _ in range(50)]
+        for start, end in bounds:
+            assert_arrays_equal(archive.read(start, end), sliced(arrays, start, end))
+
+        columns = ('timestamp', 'percentage')
+        assert_arrays_equal(archive.read(None, None, columns), arrays, columns)
+
+
+def test_first_at_or_after(tmp_path):
+    arrays = random_arrays(2 * BLOCK_RECORDS + 5, seed=3)
+    timestamps = arrays['timestamp']
+    path = str(tmp_path / 'week.ppa')
+    write_archive(path, arrays)
+
+    with ArchiveFile(path) as archive:
+        assert archive.first_at_or_after(int(timestamps[0]) - 1) == timestamps[0]
+        assert archive.first_at_or_after(int(timestamps[-1]) + 1) is None
+        for i in (0, 1, BLOCK_RECORDS - 1, BLOCK_RECORDS, len(timestamps) - 1):
+            assert archive.first_at_or_after(int(timestamps[i])) == timestamps[i]
+            assert archive.first_at_or_after(int(timestamps[i]) - 1) == timestamps[i]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.ppa'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        ArchiveFile(str(path))
+
+
+# Archiving from the database
+
+@pytest.fixture
+def old_trace():
+    """Sixty days of history at archive precision"""
+    return generate_trace(days=60, interval=300, seed=11)
+
+
+def test_archiving_keeps_reads_unchanged(data_dir, old_trace):
+    database.import_history(old_trace)
+    before = database.get_battery_history_arrays()
+    threshold = database.days_ago_epoch_ms(30)
+
+    archived = database.archive_old_history(30)
+
+    assert archived > 0
+    assert archived == int((old_trace['timestamp'] < database.partition_bounds(threshold)[0]).sum())
+    assert_arrays_equal(database.get_battery_history_arrays(), before)
+    for days in (10, 31, 45, 90):
+        start = database.days_ago_epoch_ms(days)
+        assert_arrays_equal(database.get_battery_history_arrays(start), sliced(before, start))
+
+    with database.get_connection_manager().reader() as conn:
+        catalog = conn.execute('''
+        SELECT filename, start_ts, end_ts, row_count, first_ts, last_ts FROM history_archives
+        ''').fetchall()
+        partitions = conn.execute('SELECT MIN(start_ts) FROM history_partitions').fetchone()[0]
+
+    assert sum(row[3] for row in catalog) == archived
+    for filename, start_ts, end_ts, row_count, first_ts, last_ts in catalog:
+        assert end_ts <= partitions
+        with ArchiveFile(os.path.join(database.archive_dir(), filename)) as archive:
+            assert archive.record_count == row_count
+            assert (archive.first_ts, archive.last_ts) == (first_ts, last_ts)
+            assert start_ts <= first_ts <= last_ts < end_ts
+
+
+def test_bounds_span_archives(data_dir, old_trace):
+    database.import_history(old_trace)
+    database.archive_old_history(30)
+    timestamps = old_trace['timestamp']
+
+    assert database.get_history_bounds() == (timestamps[0], timestamps[-1])
+    rng = np.random.default_rng(5)
+    for start in rng.integers(timestamps[0] - 1000, timestamps[-1] + 1000, 100):
+        later = timestamps[timestamps >= start]
+        expected = (later[0], later[-1]) if len(later) else (None, None)
+        assert database.get_history_bounds(int(start)) == expected
+
+
+def test_retention_trims_archives(data_dir, old_trace):
+    database.import_history(old_trace)
+    database.archive_old_history(30)
+    threshold = database.days_ago_epoch_ms(45)
+    expected = sliced(database.get_battery_history_arrays(), threshold)
+
+    database.clear_old_history(45)
+
+    assert_arrays_equal(database.get_battery_history_arrays(), expected)
+    with database.get_connection_manager().reader() as conn:
+        catalog = conn.execute('SELECT filename, row_count, first_ts FROM history_archives').fetchall()
+    assert sorted(os.listdir(database.archive_dir())) == sorted(row[0] for row in catalog)
+    for filename, row_count, first_ts in catalog:
+        assert first_ts >= threshold
+        with ArchiveFile(os.path.join(database.archive_dir(), filename)) as archive:
+            assert (archive.record_count, archive.first_ts) == (row_count, first_ts)
+
+
+def archive_files():
+    directory = database.archive_dir()
+    return {name: open(os.path.join(directory, name), 'rb').read() for name in os.listdir(directory)}
+
+
+def test_failed_archiving_leaves_the_files(data_dir, old_trace, monkeypatch):
+    database.import_history(old_trace)
+    database.archive_old_history(30)
+    files = archive_files()
+
+    # A late sample for an archived week is merged into its file, and the
+    # transaction then fails
+    late = {name: values[10:11] for name, values in old_trace.items()}
+    late['timestamp'] = late['timestamp'] + 1
+    database.import_history(late)
+    before = database.get_battery_history_arrays()
+    stage = database._stage_archive
+
+    def fail(path, arrays, staged):
+        stage(path, arrays, staged)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(database, '_stage_archive', fail)
+    with pytest.raises(OSError):
+        database.archive_old_history(30)
+    assert archive_files() == files
+    assert_arrays_equal(database.get_battery_history_arrays(), before)
+
+    # Until the merge the late sample is read after the archives
+    monkeypatch.setattr(database, '_stage_archive', stage)
+    assert database.archive_old_history(30) == 1
+    assert archive_files().keys() == files.keys()
+    order = np.argsort(before['timestamp'], kind='stable')
+    assert_arrays_equal(database.get_battery_history_arrays(), {name: values[order] for name, values in before.items()})
+
+
+def test_staged_archives_are_recovered(data_dir, old_trace, monkeypatch):
+    database.import_history(old_trace)
+    before = database.get_battery_history_arrays()
+
+    # Stop between the commit and moving the files into place
+    install = database._install_staged_archives
+    monkeypatch.setattr(database, '_install_staged_archives', lambda staged, committed: None)
+    database.archive_old_history(30)
+    monkeypatch.setattr(database, '_install_staged_archives', install)
+    staged = sorted(archive_files())
+    assert staged and all(name.endswith('.ppa.new') for name in staged)
+    # A staged file of a transaction that did not commit
+    write_archive(os.path.join(database.archive_dir(), 'history_0.ppa.new'), random_arrays(3))
+
+    database.setup_database()
+    assert sorted(archive_files()) == [name[:-len('.new')] for name in staged]
+    assert_arrays_equal(database.get_battery_history_arrays(), before)
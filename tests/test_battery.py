@@ -0,0 +1,167 @@
+"""Tests for the sysfs battery reader, run against fake power_supply trees"""
+
+import os
+import errno
+
+import pytest
+
+from powerpulse.battery import SysfsBatteryReader
+from powerpulse.providers import SysfsProvider
+from powerpulse.synthetic import write_sysfs_tree
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'pread'), reason="the sysfs reader needs os.pread")
+
+
+def supply(root, name, **attributes):
+    """Write one power supply directory with the given attribute values"""
+    directory = os.path.join(root, name)
+    os.makedirs(directory, exist_ok=True)
+    for attribute, value in attributes.items():
+        with open(os.path.join(directory, attribute), 'w') as f:
+            f.write(f'{value}\n')
+
+
+def reading(percentage=50.0, charging=False, plugged=False, power=10.0, temperature=31.5):
+    return {'percentage': percentage, 'is_charging': charging, 'power_plugged': plugged,
+            'power_now': power, 'temperature': temperature}
+
+
+@pytest.fixture
+def reader(tmp_path):
+    reader = SysfsBatteryReader(str(tmp_path))
+    yield reader
+    reader.close()
+
+
+def test_energy_units(tmp_path, reader):
+    write_sysfs_tree(str(tmp_path), reading(), capacity=50.0)
+
+    info = reader.read()
+    assert info['percentage'] == 50.0
+    assert not info['is_charging'] and not info['power_plugged']
+    assert info['temperature'] == 31.5
+    assert info['energy_now'] == 25.0
+    assert info['power_now'] == 10.0
+    assert info['remaining_time'] == pytest.approx(25.0 / 10.0 * 3600)
+    assert reader.read_power() == (10.0, False)
+
+
+def test_charging_time_to_full(tmp_path, reader):
+    write_sysfs_tree(str(tmp_path), reading(percentage=80.0, charging=True, plugged=True, power=20.0), capacity=50.0)
+
+    info = reader.read()
+    assert info['is_charging'] and info['power_plugged']
+    assert info['remaining_time'] == pytest.approx(10.0 / 20.0 * 3600)
+    assert reader.read_power() == (20.0, True)
+
+
+def test_charge_units(tmp_path, reader):
+    supply(tmp_path, 'BAT0', type='Battery', status='Discharging', capacity=40,
+           charge_now=2000000, charge_full=5000000, current_now=1000000, voltage_now=12000000)
+
+    info = reader.read()
+    assert info['percentage'] == 40.0
+    assert info['power_now'] == pytest.approx(12.0)
+    assert info['remaining_time'] == pytest.approx(2.0 * 3600)
+    assert 'energy_now' not in info
+    assert reader.read_power() == (pytest.approx(12.0), False)
+
+
+def test_charge_units_without_voltage(tmp_path, reader):
+    supply(tmp_path, 'BAT0', type='Battery', status='Discharging', capacity=40,
+           charge_now=2000000, charge_full=5000000, current_now=500000)
+
+    info = reader.read()
+    assert info['remaining_time'] == pytest.approx(4.0 * 3600)
+    assert 'power_now' not in info
+    assert reader.read_power() == (None, False)
+
+
+def test_mixed_units_across_batteries(tmp_path, reader):
+    supply(tmp_path, 'BAT0', type='Battery', status='Discharging', capacity=50,
+           energy_now=20000000, energy_full=40000000, power_now=5000000)
+    supply(tmp_path, 'BAT1', type='Battery', status='Discharging', capacity=25,
+           charge_now=1000000, charge_full=4000000, current_now=500000, voltage_now=10000000)
+
+    info = reader.read()
+    # 20 Wh + 10 Wh of 40 Wh + 40 Wh, drained at 5 W + 5 W
+    assert info['percentage'] == 37.5
+    assert info['power_now'] == pytest.approx(10.0)
+    assert info['remaining_time'] == pytest.approx(30.0 / 10.0 * 3600)
+
+
+def test_level_and_rate_in_different_units(tmp_path, reader):
+    # Energy level but a current rate without voltage: no time estimate
+    # rather than Wh divided by A
+    supply(tmp_path, 'BAT0', type='Battery', status='Discharging', capacity=50,
+           energy_now=20000000, energy_full=40000000, current_now=1000000)
+
+    info = reader.read()
+    assert info['percentage'] == 50.0
+    assert info['remaining_time'] is None
+
+
+def test_full_on_mains(tmp_path, reader):
+    write_sysfs_tree(str(tmp_path), reading(percentage=100.0, plugged=True, power=0.0))
+
+    info = reader.read()
+    assert info['percentage'] == 100.0
+    assert not info['is_charging'] and info['power_plugged']
+    assert info['remaining_time'] is None
+
+
+def test_plugged_from_status_without_adapter(tmp_path, reader):
+    supply(tmp_path, 'BAT0', type='Battery', status='Not charging', capacity=80)
+
+    info = reader.read()
+    assert info['power_plugged'] and not info['is_charging']
+    assert info['remaining_time'] is None
+
+
+def test_peripheral_batteries_are_ignored(tmp_path, reader):
+    supply(tmp_path, 'hid-mouse-battery', type='Battery', scope='Device', capacity=5, status='Discharging')
+    assert not reader.discover()
+    assert reader.read() is None
+
+    supply(tmp_path, 'BAT0', type='Battery', capacity=60, status='Discharging')
+    assert reader.discover()
+    assert reader.read()['percentage'] == 60.0
+
+
+def test_missing_and_malformed_attributes(tmp_path, reader):
+    supply(tmp_path, 'BAT0', type='Battery', status='Discharging', capacity=70, power_now='')
+
+    info = reader.read()
+    assert info['percentage'] == 70.0
+    assert 'power_now' not in info and info['remaining_time'] is None
+    assert reader.read_power() == (None, False)
+
+
+def test_new_readings_are_seen_through_open_files(tmp_path, reader):
+    write_sysfs_tree(str(tmp_path), reading(percentage=50.0))
+    assert reader.read()['percentage'] == 50.0
+    write_sysfs_tree(str(tmp_path), reading(percentage=49.0, power=12.5))
+    assert reader.read()['percentage'] == 49.0
+    assert reader.read_power() == (12.5, False)
+
+
+def test_removed_battery(tmp_path, reader, monkeypatch):
+    write_sysfs_tree(str(tmp_path), reading())
+    assert reader.read_power() == (10.0, False)
+
+    def removed(fd, size, offset):
+        raise OSError(errno.ENODEV, os.strerror(errno.ENODEV))
+
+    monkeypatch.setattr(os, 'pread', removed)
+    assert reader.read_power() == (None, False)
+    assert reader.batteries == []
+
+    provider = SysfsProvider(str(tmp_path))
+    assert provider.read() is None
+    assert provider.reader.batteries == []
+
+    # Both discover the supplies again once they are back
+    monkeypatch.undo()
+    assert reader.read_power() == (10.0, False)
+    assert provider.read()['percentage'] == 50.0
+    provider.close()
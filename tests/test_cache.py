@@ -0,0 +1,104 @@
+"""Tests for the result cache and its data keys"""
+
+import pickle
+
+import pytest
+
+from powerpulse import cache, database
+from powerpulse.cache import ResultCache, data_key, get_cache
+from powerpulse.stats import calculate_statistics
+from powerpulse.storage import get_backend, set_backend
+
+
+def sample(timestamp, percentage):
+    return {'timestamp': timestamp, 'percentage': percentage, 'is_charging': False,
+            'power_plugged': False, 'temperature': None, 'remaining_time': None}
+
+
+def counts():
+    info = get_cache().info()
+    return info['hits'], info['misses']
+
+
+def test_evicts_least_recently_used():
+    results = ResultCache(max_bytes=cache.estimate_size(b'x' * 100) * 3)
+    for key in 'abc':
+        results.put(key, b'x' * 100)
+    assert results.get('a') is not None
+    results.put('d', b'x' * 100)
+
+    assert results.get('b') is None
+    assert [results.get(key) is not None for key in 'acd'] == [True, True, True]
+    assert results.info()['bytes'] <= results.max_bytes
+
+    results.put('huge', b'x' * results.max_bytes)
+    assert results.get('huge') is None
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'log'])
+def test_new_sample_changes_the_key(data_dir, trace, backend):
+    set_backend(backend)
+    get_backend().append_arrays(trace)
+    get_backend().flush()
+    hits, misses = counts()
+
+    first = calculate_statistics(7)
+    assert calculate_statistics(7) is first
+    assert counts() == (hits + 1, misses + 1)
+
+    key = data_key(7)
+    newest = int(trace['timestamp'][-1]) + 60000
+    # Buffered samples count, before they are written
+    get_backend().append(sample(newest, 5.0))
+    assert data_key(7) != key
+
+    second = calculate_statistics(7)
+    assert second is not first
+    assert second['average_daily_usage'] > first['average_daily_usage']
+    assert calculate_statistics(7) is second
+    assert counts() == (hits + 2, misses + 2)
+
+
+def test_rewrite_changes_the_key(data_dir, trace):
+    database.import_history(trace)
+    first = calculate_statistics(7)
+    key = data_key(7)
+
+    database.reset_running_statistics()
+
+    assert data_key(7)[1] == key[1] + 1
+    assert calculate_statistics(7) is not first
+
+
+def test_disabled_cache_is_bypassed(data_dir, trace):
+    database.import_history(trace)
+    get_cache().enabled = False
+    assert calculate_statistics(7) is not calculate_statistics(7)
+    assert get_cache().info()['entries'] == 0
+
+
+def test_saved_entries_are_reused(data_dir, trace):
+    database.import_history(trace)
+    first = calculate_statistics(7)
+    path = cache.cache_path()
+    assert get_cache().save(path)
+    assert not get_cache().save(path)
+
+    restored = ResultCache()
+    assert restored.load(path)
+    key = ('stats', 7) + data_key(7)
+    assert restored.get(key) == first
+
+    # The saved entries go stale like the live ones
+    database.save_battery_info(sample(int(trace['timestamp'][-1]) + 60000, 5.0))
+    assert restored.get(('stats', 7) + data_key(7)) is None
+
+
+def test_other_cache_formats_are_ignored(data_dir):
+    path = data_dir / 'old.pickle'
+    with open(path, 'wb') as f:
+        pickle.dump({'format': cache.CACHE_FORMAT - 1, 'entries': [(('stats', 7), {})]}, f)
+    results = ResultCache()
+    assert not results.load(str(path))
+    assert not results.load(str(data_dir / 'missing.pickle'))
+    assert results.info()['entries'] == 0
@@ -0,0 +1,98 @@
+"""Tests for the power capture and the live data it feeds to statistics"""
+
+import numpy as np
+import pytest
+
+from powerpulse import capture as capture_module, database
+from powerpulse.capture import PowerCapture, PowerRingBuffer, SUMMARY_FLUSH_WINDOWS, summarize
+from powerpulse.stats import calculate_power_statistics
+
+WINDOW_MS = 60 * 1000
+
+
+def constant_source(watts=10.0, charging=False):
+    return lambda: (watts, charging)
+
+
+@pytest.fixture
+def active(monkeypatch):
+    """Make a capture the active one of this process"""
+    def activate(capture):
+        monkeypatch.setattr(capture_module, '_active_capture', capture)
+        return capture
+    return activate
+
+
+def test_ring_buffer_keeps_the_newest_samples():
+    ring = PowerRingBuffer(capacity=5)
+    for i in range(8):
+        ring.append(i * 1000, float(i), False)
+    assert len(ring) == 5
+    assert ring.snapshot()['timestamp'].tolist() == [3000, 4000, 5000, 6000, 7000]
+    assert ring.snapshot(4500, 7000)['watts'].tolist() == [5.0, 6.0]
+
+
+def test_summarize_skips_missing_readings():
+    samples = np.zeros(4, dtype=capture_module.POWER_SAMPLE_DTYPE)
+    samples['watts'] = [1.0, np.nan, 3.0, 5.0]
+    mean, p95, peak = summarize(samples)
+    assert (mean, peak) == (3.0, 5.0)
+    assert 3.0 < p95 <= 5.0
+    assert summarize(samples[1:2]) == (None, None, None)
+
+
+def test_windows_are_stored_in_batches(data_dir):
+    capture = PowerCapture(source=constant_source())
+    start = database.now_epoch_ms() // WINDOW_MS * WINDOW_MS - 10 * WINDOW_MS
+    for i in range(SUMMARY_FLUSH_WINDOWS * 60):
+        capture.sample_once(start + i * 1000)
+    assert database.get_power_summaries() == []
+
+    capture.sample_once(start + SUMMARY_FLUSH_WINDOWS * WINDOW_MS)
+    summaries = database.get_power_summaries()
+    assert [row[0] for row in summaries] == [start + i * WINDOW_MS for i in range(SUMMARY_FLUSH_WINDOWS)]
+    assert all(row[2] == 60 and row[3] == 10.0 for row in summaries)
+
+
+def test_queued_windows_count_as_live(data_dir, active):
+    capture = active(PowerCapture(source=constant_source()))
+    start = database.now_epoch_ms() // WINDOW_MS * WINDOW_MS - 10 * WINDOW_MS
+    for i in range(180):
+        capture.sample_once(start + i * 1000)
+
+    # Two windows are queued and one is open; none are stored yet
+    assert database.get_power_summaries() == []
+    assert len(capture.unsummarized()) == 180
+    assert len(capture.unsummarized(start + 90 * 1000)) == 90
+
+    power = calculate_power_statistics(1)
+    assert power['live_samples'] == 180
+    assert power['average_power'] == 10.0
+
+
+def test_stored_windows_are_not_counted_twice(data_dir, active):
+    capture = active(PowerCapture(source=constant_source()))
+    start = database.now_epoch_ms() // WINDOW_MS * WINDOW_MS - 10 * WINDOW_MS
+    total = SUMMARY_FLUSH_WINDOWS * 60 + 30
+    for i in range(total):
+        capture.sample_once(start + i * 1000)
+
+    power = calculate_power_statistics(1)
+    assert power['windows'] == SUMMARY_FLUSH_WINDOWS
+    assert power['live_samples'] == 30
+
+    # As if the buffer was read just before a flush stored the windows
+    capture.unsummarized = capture.buffer.snapshot
+    power = calculate_power_statistics(1)
+    assert power['windows'] == SUMMARY_FLUSH_WINDOWS
+    assert power['live_samples'] == 30
+
+
+def test_stop_stores_the_last_window(data_dir):
+    capture = PowerCapture(source=constant_source(4.0), rate=50)
+    capture.run(duration=0.2)
+    assert capture.samples >= 5
+    summaries = database.get_power_summaries()
+    assert sum(row[2] for row in summaries) == capture.samples
+    assert capture_module.get_active_capture() is None
+    assert len(capture.unsummarized()) == 0
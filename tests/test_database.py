@@ -0,0 +1,410 @@
+"""Tests for the SQLite history store in powerpulse.database"""
+
+import time
+import datetime
+import sqlite3
+import threading
+
+import numpy as np
+import pytest
+
+from powerpulse import database
+
+LEGACY_ROWS = 3000
+LEGACY_STEP = datetime.timedelta(minutes=10)
+
+
+def legacy_database(monkeypatch, path, timestamp_type, rows, user_version):
+    """Point the store at a database in an older layout holding rows"""
+    database.close_connections()
+    monkeypatch.setattr(database, 'DB_PATH', str(path))
+    conn = sqlite3.connect(path)
+    conn.execute(f'''
+    CREATE TABLE battery_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp {timestamp_type},
+        percentage REAL,
+        is_charging INTEGER,
+        power_plugged INTEGER,
+        temperature REAL,
+        remaining_time REAL
+    )
+    ''')
+    conn.executemany('''
+    INSERT INTO battery_history (timestamp, percentage, is_charging, power_plugged, temperature, remaining_time)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.execute(f'PRAGMA user_version = {user_version}')
+    conn.commit()
+    conn.close()
+
+
+def legacy_times():
+    """Local times of the legacy samples, spanning three weekly partitions"""
+    start = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(days=21)
+    return [start + i * LEGACY_STEP for i in range(LEGACY_ROWS)]
+
+
+def legacy_values(i):
+    """Sample values; the charging state flips every 50 samples"""
+    charging = i // 50 % 2
+    return 50.0 + i % 50 * (1 if charging else -0.5), charging, charging, 30.5, 3600.0
+
+
+def query(sql, *args):
+    with database.get_connection_manager().reader() as conn:
+        return conn.execute(sql, args).fetchall()
+
+
+def stored_rows():
+    with database.get_connection_manager().reader() as conn:
+        return database._read_history(conn, database.HISTORY_COLUMNS)
+
+
+def assert_schema_current():
+    assert query('PRAGMA user_version')[0][0] == database.SCHEMA_VERSION
+    tables = {row[0] for row in query("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'battery_history' not in tables
+    assert {'history_partitions', 'history_archives', 'battery_rollup_minute', 'battery_rollup_hour',
+            'battery_rollup_day', 'power_summary', 'sessions', 'stats_window_state', 'settings_meta'} <= tables
+
+
+# Migrations
+
+def test_text_timestamps_migrate_to_epoch_ms(data_dir, monkeypatch):
+    times = legacy_times()
+    rows = [(time.isoformat(), *legacy_values(i)) for i, time in enumerate(times)]
+    rows.append(('not a timestamp', 1.0, 0, 0, None, None))
+    legacy_database(monkeypatch, data_dir / 'legacy.db', 'TEXT', rows, 0)
+
+    database.setup_database()
+
+    assert_schema_current()
+    stored = stored_rows()
+    assert [row[0] for row in stored] == [database.to_epoch_ms(time) for time in times]
+    assert [row[1:] for row in stored] == [row[1:] for row in rows[:-1]]
+
+    # Rollups and sessions are built from the migrated rows
+    assert query('SELECT SUM(samples) FROM battery_rollup_day')[0][0] == LEGACY_ROWS
+    assert query('SELECT COUNT(*) FROM sessions')[0][0] == LEGACY_ROWS // 50
+
+
+def test_setup_is_idempotent(data_dir):
+    database.save_battery_info({'timestamp': 1_000_000, 'percentage': 42.0, 'is_charging': False,
+                                'power_plugged': False, 'temperature': None, 'remaining_time': None})
+    database.flush_battery_history()
+
+    database.setup_database()
+    database.setup_database()
+
+    assert_schema_current()
+    assert stored_rows() == [(1_000_000, 42.0, 0, 0, None, None)]
+
+
+def test_unpartitioned_history_moves_into_weekly_partitions(data_dir, monkeypatch):
+    rows = [(database.to_epoch_ms(time), *legacy_values(i)) for i, time in enumerate(legacy_times())]
+    legacy_database(monkeypatch, data_dir / 'legacy.db', 'INTEGER NOT NULL', rows, 1)
+
+    database.setup_database()
+
+    assert_schema_current()
+    assert stored_rows() == rows
+    partitions = query('SELECT name, start_ts, end_ts, row_count FROM history_partitions ORDER BY start_ts')
+    assert len(partitions) >= 3
+    assert sum(partition[3] for partition in partitions) == LEGACY_ROWS
+    for name, start, end, row_count in partitions:
+        assert end - start == database.PARTITION_WIDTH_MS
+        assert query(f'SELECT COUNT(*), MIN(timestamp) >= ?, MAX(timestamp) < ? FROM {name}',
+                     start, end)[0] == (row_count, 1, 1)
+
+
+# Connections
+
+def settings(conn):
+    return dict(conn.execute('SELECT key, value FROM settings'))
+
+
+def test_nested_writer_rolls_back_only_the_inner_block(data_dir):
+    manager = database.get_connection_manager()
+    with manager.writer() as conn:
+        conn.execute("INSERT INTO settings VALUES ('outer', '1')")
+        with pytest.raises(ValueError):
+            with manager.writer() as inner:
+                assert inner is conn
+                inner.execute("INSERT INTO settings VALUES ('inner', '1')")
+                raise ValueError
+        with manager.writer() as inner:
+            inner.execute("INSERT INTO settings VALUES ('kept', '1')")
+        # Nothing is committed before the outermost block exits
+        with manager.reader() as reader:
+            assert 'outer' not in settings(reader)
+
+    with manager.reader() as reader:
+        stored = settings(reader)
+    assert 'outer' in stored and 'kept' in stored and 'inner' not in stored
+
+    # A failing outer block undoes the nested blocks it contains
+    with pytest.raises(ValueError):
+        with manager.writer() as conn:
+            with manager.writer() as inner:
+                inner.execute("INSERT INTO settings VALUES ('lost', '1')")
+            raise ValueError
+    with manager.reader() as reader:
+        assert 'lost' not in settings(reader)
+    with manager.writer() as conn:
+        assert not conn.in_transaction
+
+
+def test_readers_are_pooled(data_dir):
+    manager = database.ConnectionManager(database.DB_PATH, pool_size=2)
+    with manager.reader() as first:
+        with manager.reader() as nested:
+            assert nested is first
+    with manager.reader() as again:
+        assert again is first
+
+    # Two threads hold the whole pool; a third waits for one of them
+    borrowed, release = [], threading.Event()
+
+    def read():
+        with manager.reader() as conn:
+            borrowed.append(conn)
+            release.wait(5)
+
+    holders = [threading.Thread(target=read) for _ in range(2)]
+    for thread in holders:
+        thread.start()
+    while len(borrowed) < 2:
+        time.sleep(0.005)
+    waiting = threading.Thread(target=read)
+    waiting.start()
+    waiting.join(0.1)
+    assert waiting.is_alive() and len(borrowed) == 2
+
+    release.set()
+    for thread in holders + [waiting]:
+        thread.join(5)
+    assert len(borrowed) == 3 and borrowed[2] in borrowed[:2]
+    assert len(manager._all_readers) == 2
+    manager.close()
+
+
+def test_close_connections_flushes_and_closes(data_dir):
+    manager = database.get_connection_manager()
+    database.save_battery_info(sample(database.now_epoch_ms()))
+    assert len(database._sample_buffer) == 1
+
+    database.close_connections()
+    assert len(database._sample_buffer) == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        with manager.writer():
+            pass
+    with pytest.raises(sqlite3.ProgrammingError):
+        manager.data_version()
+
+    # The next use opens a new manager, which sees the flushed sample
+    assert database.get_connection_manager() is not manager
+    assert len(stored_rows()) == 1
+
+
+# Retention
+
+def test_retention_drops_whole_partitions(data_dir, trace):
+    database.import_history(trace)
+    threshold = database.days_ago_epoch_ms(4)
+    expected = int((trace['timestamp'] < threshold).sum())
+
+    assert database.clear_old_history(4) == expected
+
+    timestamps = database.get_battery_history_arrays()['timestamp']
+    assert len(timestamps) == len(trace['timestamp']) - expected
+    assert timestamps.min() >= threshold
+    # Only the partition holding the threshold was trimmed row by row
+    assert query('SELECT COUNT(*) FROM history_partitions WHERE end_ts <= ?', threshold)[0][0] == 0
+    assert query('SELECT COUNT(*) FROM history_partitions WHERE start_ts < ?', threshold)[0][0] <= 1
+    assert query('SELECT SUM(row_count) FROM history_partitions')[0][0] == len(timestamps)
+    assert query('SELECT COUNT(*) FROM battery_rollup_day WHERE last_ts < ?', threshold)[0][0] == 0
+
+
+# Storage layouts
+
+def tenths_trace(trace):
+    """The trace at the precision the compact layout keeps"""
+    arrays = {name: np.asarray(trace[name]) for name in database.HISTORY_COLUMNS}
+    arrays['percentage'] = np.round(arrays['percentage'].astype(np.float64), 1)
+    arrays['temperature'] = np.round(arrays['temperature'].astype(np.float64), 1)
+    arrays['remaining_time'] = np.round(arrays['remaining_time'].astype(np.float64))
+    return arrays
+
+
+def test_compact_layout_round_trip(data_dir, trace):
+    database.import_history(tenths_trace(trace))
+    before = stored_rows()
+    partitions = query('SELECT COUNT(*) FROM history_partitions')[0][0]
+
+    assert database.convert_history_layout('compact', vacuum=False) == partitions
+    assert {row[0] for row in query('SELECT layout FROM history_partitions')} == {'compact'}
+    assert stored_rows() == before
+
+    # New rows go into compact partitions too
+    newest = before[-1][0] + database.PARTITION_WIDTH_MS
+    database.save_battery_info({'timestamp': newest, 'percentage': 77.7, 'is_charging': True,
+                                'power_plugged': True, 'temperature': 31.4, 'remaining_time': None})
+    database.flush_battery_history()
+    name, layout = query('SELECT name, layout FROM history_partitions ORDER BY start_ts DESC LIMIT 1')[0]
+    assert layout == 'compact'
+    assert query(f'SELECT percentage, flags, temperature FROM {name}') == [
+        (777, database.FLAG_CHARGING | database.FLAG_PLUGGED, 314)]
+
+    after = before + [(newest, 77.7, 1, 1, 31.4, None)]
+    assert stored_rows() == after
+    assert database.convert_history_layout('standard', vacuum=False) == partitions + 1
+    assert {row[0] for row in query('SELECT layout FROM history_partitions')} == {'standard'}
+    assert stored_rows() == after
+
+
+def test_unknown_layout_is_rejected(data_dir):
+    with pytest.raises(ValueError):
+        database.convert_history_layout('columnar')
+
+
+# Write buffer
+
+def sample(timestamp, percentage=50.0):
+    return {'timestamp': timestamp, 'percentage': percentage, 'is_charging': False,
+            'power_plugged': False, 'temperature': None, 'remaining_time': None}
+
+
+def test_buffer_is_due_at_max_rows():
+    buffer = database.SampleBuffer()
+    assert buffer.max_rows == 20
+    assert not any(buffer.add((i, 50.0, 0, 0, None, None)) for i in range(19))
+    assert buffer.add((19, 50.0, 0, 0, None, None))
+    assert len(buffer) == 20
+
+
+def test_buffer_is_due_at_max_age(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(database.time, 'monotonic', lambda: clock[0])
+    buffer = database.SampleBuffer()
+    assert buffer.max_age == 300
+
+    assert not buffer.add((0, 50.0, 0, 0, None, None))
+    clock[0] += 299
+    assert not buffer.add((1, 50.0, 0, 0, None, None))
+    clock[0] += 1
+    assert buffer.add((2, 50.0, 0, 0, None, None))
+
+    # The age counts from the oldest row still buffered
+    buffer.discard(3)
+    clock[0] += 1000
+    assert not buffer.add((3, 50.0, 0, 0, None, None))
+
+
+def test_save_flushes_every_max_rows(data_dir):
+    start = database.now_epoch_ms() - 3600000
+    for i in range(19):
+        database.save_battery_info(sample(start + i * 60000))
+    assert len(database._sample_buffer) == 19
+    assert query('SELECT SUM(row_count) FROM history_partitions')[0][0] in (None, 0)
+
+    # Buffered rows are visible to readers before they are written
+    assert len(database.get_battery_history(1)) == 19
+    assert len(database.get_battery_history_arrays(start)['timestamp']) == 19
+
+    database.save_battery_info(sample(start + 19 * 60000))
+    assert len(database._sample_buffer) == 0
+    assert [row[0] for row in stored_rows()] == [start + i * 60000 for i in range(20)]
+    assert query('SELECT SUM(samples) FROM battery_rollup_day')[0][0] == 20
+
+
+# Rollups
+
+def assert_rollups_equal(actual, expected):
+    assert [row[0] for row in actual] == [row[0] for row in expected]
+    for got, want in zip(actual, expected):
+        assert got == pytest.approx(want, rel=1e-9), got[0]
+
+
+def stored_rollups(resolution):
+    return query(f'SELECT * FROM battery_rollup_{resolution} ORDER BY bucket')
+
+
+@pytest.mark.parametrize('resolution', database.ROLLUP_RESOLUTIONS)
+def test_rollups_match_raw_rows(data_dir, trace, resolution):
+    database.import_history(trace)
+    # Leave a few rows in the write buffer
+    newest = int(trace['timestamp'][-1])
+    for i in range(1, 6):
+        database.save_battery_info(sample(newest + i * 60000, 40.0 + i))
+    rows = stored_rows() + database._sample_buffer.pending()
+    now = database.now_epoch_ms()
+
+    for days in (0.5, 1, 3, 7, 30):
+        start = database.days_ago_epoch_ms(days)
+        expected = database.aggregate_rollups([row for row in rows if row[0] >= start], resolution)
+        assert_rollups_equal(database.get_battery_rollups(days, resolution), expected)
+
+    rng = np.random.default_rng(4)
+    for _ in range(20):
+        start, end = sorted(int(value) for value in rng.integers(rows[0][0] - 3600000, now, 2))
+        expected = database.aggregate_rollups([row for row in rows if start <= row[0] < end], resolution)
+        assert_rollups_equal(database.get_rollups_range(start, end, resolution), expected)
+
+
+def test_incremental_rollups_match_rebuild(data_dir, trace):
+    timestamps = trace['timestamp']
+    half = len(timestamps) // 2
+    database.import_history({name: values[:half] for name, values in trace.items()}, chunk_size=997)
+    for i in range(half, half + 250):
+        database.save_battery_info({'timestamp': int(timestamps[i]),
+                                    'percentage': float(trace['percentage'][i]),
+                                    'is_charging': bool(trace['is_charging'][i]),
+                                    'power_plugged': bool(trace['power_plugged'][i]),
+                                    'temperature': None, 'remaining_time': None})
+    database.import_history({name: values[half + 250:] for name, values in trace.items()}, chunk_size=997)
+
+    incremental = {resolution: stored_rollups(resolution) for resolution in database.ROLLUP_RESOLUTIONS}
+    sessions = query('SELECT * FROM sessions ORDER BY start_ts')
+    database.rebuild_rollups()
+
+    for resolution, rollups in incremental.items():
+        assert_rollups_equal(rollups, stored_rollups(resolution))
+    assert query('SELECT * FROM sessions ORDER BY start_ts') == sessions
+
+
+# Settings cache
+
+def test_settings_are_written_through(data_dir):
+    cached = database._settings_cache
+    assert database.get_setting('units', 'metric') == 'metric'
+
+    database.update_setting('units', 'imperial')
+    database.update_notification_setting('low_battery', level=15, enabled=False)
+    # The writer connection refreshed the cache in the same transaction
+    assert cached._settings['units'] == 'imperial'
+    assert database.get_setting('units') == 'imperial'
+    assert ('low_battery', 15, 0) in database.get_notification_settings()
+
+
+def test_settings_written_by_another_connection_are_seen(data_dir):
+    cached = database._settings_cache
+    assert database.get_setting('units') is None
+    version = cached._version
+    settings = cached._settings
+
+    # A write elsewhere that leaves the settings alone changes data_version
+    # but not the settings version, so nothing is reloaded
+    other = sqlite3.connect(database.DB_PATH)
+    other.execute("INSERT INTO power_summary VALUES (1000, 2000, 1, 5.0, 5.0, 5.0, 0)")
+    other.commit()
+    assert database.get_setting('units') is None
+    assert cached._settings is settings
+
+    other.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('units', 'imperial')")
+    other.execute("UPDATE notifications SET level = 25 WHERE type = 'low_battery'")
+    other.commit()
+    other.close()
+    assert database.get_setting('units') == 'imperial'
+    assert ('low_battery', 25, 1) in database.get_notification_settings()
+    assert cached._version == version + 2
@@ -0,0 +1,71 @@
+"""Tests for the pipeline instrumentation in powerpulse.diag"""
+
+import pytest
+
+from powerpulse import diag
+
+
+@pytest.fixture(autouse=True)
+def clean_diag():
+    enabled = diag.is_enabled()
+    diag.reset()
+    yield
+    diag.enable(enabled)
+    diag.reset()
+
+
+@diag.timed('work')
+def work(fail=False):
+    """Does some work"""
+    if fail:
+        raise ValueError("failed")
+    return 42
+
+
+def test_enabled_calls_are_recorded():
+    diag.enable()
+    assert work() == 42
+    assert work() == 42
+    with pytest.raises(ValueError):
+        work(fail=True)
+    with diag.stage('block'):
+        pass
+    diag.count('reads')
+    diag.count('reads', 2)
+
+    data = diag.snapshot()
+    assert data['enabled']
+    assert data['stages']['work']['count'] == 3
+    assert data['stages']['work']['errors'] == 1
+    assert sum(data['stages']['work']['histogram']) == 3
+    assert data['stages']['block']['count'] == 1
+    assert data['counters'] == {'reads': 3}
+    assert 'work' in diag.format_report(data)
+
+    diag.reset()
+    assert diag.snapshot()['stages'] == {} and diag.snapshot()['counters'] == {}
+
+
+def test_disabled_timed_is_a_pass_through():
+    diag.enable(False)
+    assert work() == 42
+    with pytest.raises(ValueError):
+        work(fail=True)
+    assert diag.stage('block') is diag._NULL_STAGE
+    diag.count('reads')
+
+    data = diag.snapshot()
+    assert not data['enabled']
+    assert data['stages'] == {} and data['counters'] == {}
+    assert work.__name__ == 'work' and work.__doc__ == "Does some work"
+
+
+def test_percentiles_follow_the_histogram():
+    stats = diag.StageStats()
+    assert stats.percentile(50) is None
+    for _ in range(99):
+        stats.add(0.0002)
+    stats.add(3.0)
+    assert 0.0001 <= stats.percentile(50) <= 0.00025
+    assert stats.percentile(100) == 3.0
+    assert stats.to_dict()['max'] == 3.0
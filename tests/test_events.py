@@ -0,0 +1,112 @@
+"""Tests for the power supply uevent listener, fed through a local socket pair"""
+
+import socket
+import threading
+import time
+
+import pytest
+
+from powerpulse import events
+from powerpulse.events import parse_uevent, UeventListener
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="needs datagram socket pairs")
+
+
+def uevent(action='change', subsystem='power_supply', name='BAT0', **fields):
+    devpath = f'/devices/LNXSYSTM:00/PNP0C0A:00/power_supply/{name}'
+    parts = [f'{action}@{devpath}', f'ACTION={action}', f'DEVPATH={devpath}', f'SUBSYSTEM={subsystem}',
+             f'POWER_SUPPLY_NAME={name}']
+    parts += [f'{key}={value}' for key, value in fields.items()]
+    return '\0'.join(parts).encode('utf-8') + b'\0'
+
+
+@pytest.fixture
+def pair():
+    """A listener reading one end of a datagram socket pair, and the other end"""
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    listener = UeventListener(sock=ours)
+    yield listener, theirs
+    listener.close()
+    theirs.close()
+
+
+@pytest.fixture
+def quick_settle(monkeypatch):
+    monkeypatch.setattr(events, 'SETTLE_DELAY', 0.05)
+    monkeypatch.setattr(events, 'MAX_SETTLE', 0.3)
+
+
+def test_parse_kernel_message():
+    event = parse_uevent(uevent(POWER_SUPPLY_STATUS='Charging', POWER_SUPPLY_CAPACITY='57'))
+    assert event['ACTION'] == 'change'
+    assert event['SUBSYSTEM'] == 'power_supply'
+    assert event['POWER_SUPPLY_STATUS'] == 'Charging'
+    assert event['POWER_SUPPLY_CAPACITY'] == '57'
+
+
+def test_parse_fills_action_and_devpath_from_header():
+    event = parse_uevent(b'add@/devices/platform/AC\0SUBSYSTEM=power_supply\0')
+    assert event == {'SUBSYSTEM': 'power_supply', 'ACTION': 'add', 'DEVPATH': '/devices/platform/AC'}
+
+
+@pytest.mark.parametrize('data', [b'', b'libudev\0\xfe\xed', b'no header here\0KEY=value'])
+def test_parse_rejects_udev_and_malformed_messages(data):
+    assert parse_uevent(data) is None
+
+
+def test_receive_filters_other_subsystems(pair):
+    listener, sender = pair
+    sender.send(uevent(subsystem='usb'))
+    assert listener.receive() is None
+    sender.send(uevent())
+    assert listener.receive()['POWER_SUPPLY_NAME'] == 'BAT0'
+
+
+def test_wait_coalesces_a_burst(pair, quick_settle):
+    listener, sender = pair
+    sender.send(uevent(name='AC', POWER_SUPPLY_ONLINE='1'))
+    sender.send(uevent(subsystem='usb'))
+    sender.send(uevent(POWER_SUPPLY_STATUS='Charging'))
+
+    def late():
+        time.sleep(0.02)
+        sender.send(uevent(name='BAT1'))
+
+    thread = threading.Thread(target=late)
+    thread.start()
+    received = listener.wait(timeout=1)
+    thread.join()
+
+    assert [event['POWER_SUPPLY_NAME'] for event in received] == ['AC', 'BAT0', 'BAT1']
+    assert listener.wait(timeout=0) == []
+
+
+def test_wait_settle_is_bounded(pair, quick_settle):
+    listener, sender = pair
+    stop = threading.Event()
+
+    def chatter():
+        while not stop.is_set():
+            sender.send(uevent())
+            time.sleep(0.01)
+
+    thread = threading.Thread(target=chatter)
+    thread.start()
+    try:
+        started = time.monotonic()
+        received = listener.wait(timeout=1)
+        elapsed = time.monotonic() - started
+    finally:
+        stop.set()
+        thread.join()
+
+    assert len(received) > 1
+    assert elapsed < events.MAX_SETTLE + 0.25
+
+
+def test_wait_times_out_without_events(pair):
+    listener, sender = pair
+    sender.send(uevent(subsystem='usb'))
+    started = time.monotonic()
+    assert listener.wait(timeout=0.2) == []
+    assert 0.15 <= time.monotonic() - started < 1
@@ -0,0 +1,103 @@
+"""Tests for the incremental statistics against calculate_statistics"""
+
+import numpy as np
+import pytest
+
+from powerpulse import cache
+from powerpulse.analysis import AnalysisContext
+from powerpulse.running_stats import RunningStatistics, WINDOW_DAYS, MAX_WINDOW_DAYS
+from powerpulse.stats import calculate_statistics, MS_PER_DAY
+from powerpulse.storage import get_backend, set_backend
+from powerpulse.synthetic import generate_trace
+
+from conftest import history_arrays
+
+DAYS = (0.25, 1, 2, 3, 5.5, 7, 14)
+
+
+def expected_statistics(days, now):
+    """calculate_statistics over the rows a window ending at now holds"""
+    history = get_backend().read_range(now - int(days * MS_PER_DAY),
+                                       columns=('timestamp', 'percentage', 'is_charging'))
+    context = AnalysisContext(days, history=history_arrays(history['timestamp'], history['percentage'],
+                                                           history['is_charging']))
+    return calculate_statistics(days, context=context)
+
+
+def assert_same(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        if value is None:
+            assert actual[key] is None, key
+        else:
+            assert actual[key] == pytest.approx(value, rel=1e-9, abs=1e-9), key
+
+
+def store(arrays):
+    get_backend().append_arrays(arrays)
+    get_backend().flush()
+
+
+@pytest.fixture(autouse=True)
+def no_result_cache(data_dir):
+    cache.get_cache().enabled = False
+
+
+@pytest.fixture(params=['sqlite', 'log'])
+def backend(request, data_dir):
+    set_backend(request.param)
+    return request.param
+
+
+def test_matches_full_scan(backend, trace):
+    store(trace)
+    running = RunningStatistics()
+    now = int(trace['timestamp'][-1]) + 1000
+    for days in DAYS + WINDOW_DAYS[:-2]:
+        assert_same(running.statistics(days, now=now), expected_statistics(days, now))
+
+
+def test_matches_as_samples_arrive(backend):
+    trace = generate_trace(days=6, interval=60, seed=12)
+    timestamps = trace['timestamp']
+    running = RunningStatistics()
+    bounds = np.linspace(0, len(timestamps), 9).astype(int)
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        store({name: values[lo:hi] for name, values in trace.items()})
+        # Query a little after the newest row so the windows slide too
+        now = int(timestamps[hi - 1]) + 5 * 60000
+        for days in (0.5, 1, 3):
+            assert_same(running.statistics(days, now=now), expected_statistics(days, now))
+
+
+def test_state_survives_a_restart(data_dir, trace):
+    store(trace)
+    now = int(trace['timestamp'][-1]) + 1000
+    running = RunningStatistics()
+    before = {days: running.statistics(days, now=now) for days in DAYS}
+    assert running.save()
+
+    restarted = RunningStatistics()
+    restarted.load(now)
+    assert restarted.watermark == running.watermark
+    for days in DAYS:
+        assert_same(restarted.statistics(days, now=now), before[days])
+
+    # Rows stored after the save are picked up from the watermark
+    later = generate_trace(days=1, interval=60, end=now + MS_PER_DAY, seed=13)
+    store(later)
+    now = int(later['timestamp'][-1]) + 1000
+    for days in DAYS:
+        assert_same(restarted.statistics(days, now=now), expected_statistics(days, now))
+
+
+def test_empty_history(data_dir):
+    running = RunningStatistics()
+    stats = running.statistics(7)
+    assert stats == calculate_statistics(7)
+    assert stats['discharge_cycles'] == 0 and stats['average_discharge_rate'] is None
+
+
+def test_longer_windows_fall_back(data_dir, trace):
+    store(trace)
+    assert_same(RunningStatistics().statistics(MAX_WINDOW_DAYS + 1), calculate_statistics(MAX_WINDOW_DAYS + 1))
@@ -0,0 +1,300 @@
+"""Tests for the change filter, adaptive sampling and the sampler"""
+
+import time
+import queue
+
+import numpy as np
+import pytest
+
+from powerpulse import cache
+from powerpulse.analysis import AnalysisContext
+from powerpulse.database import HISTORY_COLUMNS, MAX_SAMPLE_GAP_MS, FULL_CHARGE_LEVEL
+from powerpulse.sampling import (
+    ChangeFilter, AdaptiveSampler, Sampler, MAX_HEARTBEAT, MIN_INTERVAL, FAST_DISCHARGE_RATE, TEMPERATURE_DEADBAND
+)
+from powerpulse.stats import calculate_statistics
+from powerpulse.synthetic import generate_trace, trace_reading
+
+
+def reading(percentage=50.0, charging=False, plugged=None, temperature=30.0):
+    return {'percentage': percentage, 'is_charging': charging,
+            'power_plugged': charging if plugged is None else plugged, 'temperature': temperature,
+            'remaining_time': None}
+
+
+# Change filter
+
+def test_deadband_is_measured_from_the_stored_reading():
+    changes = ChangeFilter(deadband=1.0, heartbeat=600)
+    assert changes.should_persist(reading(50.0), now=0)
+    assert not changes.should_persist(reading(49.6), now=10)
+    assert not changes.should_persist(reading(49.2), now=20)
+    assert changes.should_persist(reading(49.0), now=30)
+    assert not changes.should_persist(reading(48.5), now=40)
+    assert changes.last['percentage'] == 49.0
+
+
+@pytest.mark.parametrize('changed', [
+    reading(50.0, charging=True),
+    reading(50.0, plugged=True),
+    reading(50.0, temperature=30.0 + TEMPERATURE_DEADBAND),
+    reading(None),
+    reading(50.0, temperature=None),
+], ids=['charging', 'plugged', 'temperature', 'percentage-missing', 'temperature-missing'])
+def test_state_changes_are_always_stored(changed):
+    changes = ChangeFilter(deadband=5.0, heartbeat=600)
+    assert changes.should_persist(reading(50.0), now=0)
+    assert changes.should_persist(changed, now=1)
+
+
+def test_full_charge_crossings_are_stored():
+    changes = ChangeFilter(deadband=1.0, heartbeat=600)
+    assert changes.should_persist(reading(FULL_CHARGE_LEVEL - 0.6, charging=True), now=0)
+    assert changes.should_persist(reading(FULL_CHARGE_LEVEL, charging=True), now=1)
+    assert changes.should_persist(reading(FULL_CHARGE_LEVEL - 0.1, charging=True), now=2)
+    assert not changes.should_persist(reading(FULL_CHARGE_LEVEL - 0.5, charging=True), now=3)
+
+
+def test_heartbeat():
+    changes = ChangeFilter(deadband=1.0, heartbeat=600)
+    assert changes.should_persist(reading(), now=0)
+    assert not changes.should_persist(reading(), now=599)
+    assert changes.should_persist(reading(), now=600)
+    assert not changes.should_persist(reading(), now=1199)
+
+    changes.reset()
+    assert changes.should_persist(reading(), now=1200)
+
+
+def test_heartbeat_stays_below_the_sample_gap():
+    assert ChangeFilter(heartbeat=10 ** 6).heartbeat == MAX_HEARTBEAT
+    assert MAX_HEARTBEAT * 1000 < MAX_SAMPLE_GAP_MS
+
+
+# Adaptive interval
+
+def test_interval_backs_off_while_stable(data_dir):
+    sampler = AdaptiveSampler(base_interval=30, heartbeat=600)
+    intervals = []
+    for i in range(8):
+        sampler.observe(reading(60.0), now=i * 30)
+        intervals.append(sampler.interval)
+    assert intervals == [30, 60, 120, 240, 480, 600, 600, 600]
+
+    # Any change returns to the base interval
+    sampler.observe(reading(59.0), now=300)
+    assert sampler.interval == 30
+    sampler.observe(reading(59.0, charging=True), now=330)
+    assert sampler.interval == 30
+
+
+def test_interval_shortens_on_fast_discharge(data_dir):
+    sampler = AdaptiveSampler(base_interval=60)
+    sampler.observe(reading(70.0), now=0)
+    sampler.observe(reading(69.0), now=60)
+    assert sampler.discharge_rate == pytest.approx(60.0)
+    assert sampler.discharge_rate >= FAST_DISCHARGE_RATE
+    assert sampler.interval == 30
+
+    # Plugging in stops tracking the discharge rate
+    sampler.observe(reading(69.0, plugged=True), now=120)
+    assert sampler.discharge_rate is None
+    assert sampler.interval == 60
+
+
+def test_interval_shortens_near_a_notification_level(data_dir):
+    # The default settings notify at 20% on battery and 100% when charging
+    sampler = AdaptiveSampler(base_interval=60)
+    sampler.observe(reading(21.0), now=0)
+    assert sampler.interval == max(MIN_INTERVAL, 60 // 4)
+    sampler.observe(reading(99.0, charging=True), now=60)
+    assert sampler.interval == max(MIN_INTERVAL, 60 // 4)
+    sampler.observe(reading(50.0, charging=True), now=120)
+    assert sampler.interval == 60
+
+
+def test_reset_forgets_the_past(data_dir):
+    sampler = AdaptiveSampler(base_interval=30)
+    for i in range(5):
+        sampler.observe(reading(60.0), now=i * 30)
+    assert sampler.interval > 30
+
+    sampler.reset()
+    assert sampler.interval == 30
+    assert sampler.discharge_rate is None
+    assert sampler.observe(reading(60.0), now=150)
+
+
+# Statistics of the stored readings
+
+@pytest.mark.parametrize('seed', range(3))
+def test_stored_readings_keep_the_statistics(data_dir, seed):
+    cache.get_cache().enabled = False
+    trace = generate_trace(days=7, interval=60, seed=seed)
+    timestamps = trace['timestamp']
+    sampler = AdaptiveSampler(base_interval=60)
+    stored = np.array([sampler.observe(trace_reading(trace, i), now=timestamps[i] / 1000)
+                       for i in range(len(timestamps))])
+    assert stored.sum() < len(stored) / 2
+
+    def statistics(mask):
+        history = {name: trace[name][mask] for name in HISTORY_COLUMNS}
+        return calculate_statistics(7, context=AnalysisContext(7, history=history))
+
+    dense, sparse = statistics(np.ones(len(stored), dtype=bool)), statistics(stored)
+
+    # No gap the statistics would skip is introduced
+    dense_gaps = np.diff(timestamps) > MAX_SAMPLE_GAP_MS
+    sparse_gaps = np.diff(timestamps[stored]) > MAX_SAMPLE_GAP_MS
+    assert sparse_gaps.sum() == dense_gaps.sum()
+
+    for key in ('discharge_cycles', 'full_charges'):
+        assert sparse[key] == dense[key], key
+    for key in ('longest_session', 'median_session'):
+        assert sparse[key] == pytest.approx(dense[key], abs=MAX_HEARTBEAT / 3600), key
+    # Rates and usage lose the noise inside the deadband, nothing more
+    for key in ('average_discharge_rate', 'average_charge_rate', 'average_daily_usage'):
+        assert sparse[key] <= dense[key], key
+        assert sparse[key] == pytest.approx(dense[key], rel=0.15), key
+
+
+# Sampler
+
+class FakeListener:
+    """Stands in for the uevent listener: wait() returns queued events"""
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self.closed = False
+
+    def wait(self, timeout):
+        try:
+            return [self.events.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+    def close(self):
+        self.closed = True
+
+
+class Battery:
+    """A read callable counting its calls"""
+
+    def __init__(self, percentage=50.0):
+        self.percentage = percentage
+        self.reads = 0
+
+    def __call__(self):
+        self.reads += 1
+        return reading(self.percentage)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_polls_on_the_interval():
+    battery = Battery()
+    sampler = Sampler(0.05, read=battery)
+    sampler.start()
+    time.sleep(0.32)
+    sampler.stop(1)
+    # A reading at start and one per interval, without drift or bursts
+    assert 5 <= battery.reads <= 8
+    assert sampler.samples == battery.reads
+
+
+def test_events_trigger_a_reading():
+    battery = Battery()
+    listener = FakeListener()
+    sampler = Sampler(3600, read=battery, listener=listener)
+    sampler.start()
+    wait_for(lambda: battery.reads == 1)
+
+    listener.events.put({'POWER_SUPPLY_ONLINE': '1'})
+    wait_for(lambda: battery.reads == 2)
+    listener.events.put({'POWER_SUPPLY_ONLINE': '0'})
+    wait_for(lambda: battery.reads == 3)
+    time.sleep(0.05)
+    assert battery.reads == 3
+
+    sampler._stop.set()
+    listener.events.put({})
+    sampler.stop(1)
+    assert battery.reads == 3
+    assert listener.closed and sampler.listener is None
+
+
+def test_listener_falls_back_to_the_interval():
+    battery = Battery()
+    listener = FakeListener()
+    sampler = Sampler(0.05, read=battery, listener=listener)
+    sampler.start()
+    time.sleep(0.32)
+    sampler.stop(1)
+    assert 5 <= battery.reads <= 8
+    assert listener.closed
+
+
+def test_stop_leaves_a_blocked_listener_open():
+    listener = FakeListener()
+    sampler = Sampler(3600, read=Battery(), listener=listener)
+    sampler.start()
+    wait_for(lambda: sampler.samples == 1)
+    sampler.stop(0.05)
+    assert not listener.closed
+
+    listener.events.put({})
+    sampler._thread.join(1)
+    assert not sampler._thread.is_alive()
+
+
+def test_subscribers(data_dir):
+    battery = Battery()
+    sampler = Sampler(60, adaptive=AdaptiveSampler(60, deadband=1.0), read=battery)
+    everything, stored = [], []
+    sampler.subscribe(everything.append)
+    sampler.subscribe(lambda info: 1 / 0)
+    sampler.subscribe(stored.append, stored_only=True)
+
+    for percentage in (50.0, 49.8, 49.5, 48.9):
+        battery.percentage = percentage
+        assert sampler.sample_once()['percentage'] == percentage
+    assert [info['percentage'] for info in everything] == [50.0, 49.8, 49.5, 48.9]
+    assert [info['percentage'] for info in stored] == [50.0, 48.9]
+    assert all('timestamp' in info for info in everything)
+
+    sampler.unsubscribe(everything.append)
+    sampler.sample_once()
+    assert len(everything) == 4
+
+
+def test_failed_reads_are_skipped():
+    def broken():
+        raise OSError("no battery")
+
+    received = []
+    sampler = Sampler(60, read=broken)
+    sampler.subscribe(received.append)
+    assert sampler.sample_once() is None
+    sampler.read = lambda: None
+    assert sampler.sample_once() is None
+    assert received == [] and sampler.samples == 0
+
+
+def test_suspend_resets_adaptive_sampling(data_dir, monkeypatch):
+    adaptive = AdaptiveSampler(30)
+    for i in range(5):
+        adaptive.observe(reading(60.0), now=i * 30)
+    sampler = Sampler(30, adaptive=adaptive, read=Battery())
+    assert not sampler.check_suspend()
+    assert not sampler.check_suspend()
+
+    wall = time.time()
+    monkeypatch.setattr(time, 'time', lambda: wall + 3600)
+    assert sampler.check_suspend()
+    assert sampler.suspends == 1
+    assert adaptive.interval == 30 and sampler.current_interval() == 30
@@ -0,0 +1,117 @@
+"""Tests for the monitoring service and its local query endpoint"""
+
+import os
+import json
+import time
+import errno
+import shutil
+import socket
+import asyncio
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+from powerpulse import service as service_module
+from powerpulse.capture import PowerCapture
+from powerpulse.database import get_power_summaries
+from powerpulse.sampling import Sampler
+from powerpulse.service import MonitoringService, query_service
+from powerpulse.storage import get_backend
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="the endpoint is a Unix socket here")
+
+
+def read_battery():
+    return {'percentage': 64.0, 'is_charging': False, 'power_plugged': False,
+            'temperature': 30.0, 'remaining_time': 7200.0}
+
+
+@pytest.fixture
+def socket_path(data_dir, monkeypatch):
+    # A short path; tmp_path can exceed the Unix socket path limit
+    directory = tempfile.mkdtemp(prefix='pp-')
+    path = os.path.join(directory, 'service.sock')
+    monkeypatch.setattr(service_module, 'endpoint_address', lambda: path)
+    yield path
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def make_service(capture=None):
+    return MonitoringService(Sampler(3600, read=read_battery), endpoint=True, capture=capture)
+
+
+@contextmanager
+def running(service):
+    """Run the service in a thread until the block exits"""
+    thread = threading.Thread(target=service.run)
+    thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                query_service({'query': 'status'}, timeout=1)
+                break
+            except OSError:
+                if time.monotonic() > deadline or not thread.is_alive():
+                    raise
+                time.sleep(0.02)
+        yield service
+    finally:
+        service.stop()
+        thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_queries(socket_path):
+    capture = PowerCapture(rate=50, source=lambda: (8.0, False))
+    with running(make_service(capture)) as service:
+        status = query_service({'query': 'status'})
+        assert status['samples'] == 1
+        assert status['last_reading']['percentage'] == 64.0
+        assert not status['events']
+
+        stats = query_service({'query': 'stats', 'days': 1})
+        assert set(stats) >= {'average_discharge_rate', 'discharge_cycles', 'median_session'}
+
+        # The live buffer of the service's capture is served too
+        time.sleep(0.2)
+        power = query_service({'query': 'power', 'days': 1})
+        assert power['live_samples'] > 0
+        assert power['average_power'] == 8.0
+        assert query_service({'query': 'status'})['capture_samples'] >= power['live_samples']
+
+        assert 'stages' in query_service({'query': 'diag'})
+        assert query_service({'query': 'uptime'}) == {'error': "Unknown query: uptime"}
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall(b'not json\n')
+            assert 'error' in json.loads(sock.makefile().readline())
+
+    # Shutdown stores the reading and the captured windows, and removes the socket
+    assert not os.path.exists(socket_path)
+    assert len(get_backend().read_range()['timestamp']) == service.rows_written == 1
+    assert sum(row[2] for row in get_power_summaries()) == capture.samples
+
+
+def test_second_service_leaves_the_running_one_alone(socket_path):
+    with running(make_service()):
+        second = make_service()
+        with pytest.raises(OSError) as raised:
+            asyncio.run(second._start_endpoint())
+        assert raised.value.errno == errno.EADDRINUSE
+        assert second._socket_path is None
+
+        assert query_service({'query': 'status'})['samples'] == 1
+
+
+def test_stale_socket_is_replaced(socket_path):
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+    assert os.path.exists(socket_path)
+
+    with running(make_service()):
+        assert os.stat(socket_path).st_mode & 0o777 == 0o600
+        assert query_service({'query': 'status'})['samples'] == 1
@@ -0,0 +1,208 @@
+"""Tests for the vectorized calculate_statistics against the original loop"""
+
+import math
+
+import numpy as np
+import pytest
+
+from powerpulse import cache
+from powerpulse.analysis import AnalysisContext
+from powerpulse.database import MAX_SAMPLE_GAP_MS, FULL_CHARGE_LEVEL
+from powerpulse import database
+from powerpulse.stats import calculate_statistics, session_statistics, MS_PER_HOUR, MS_PER_DAY
+from powerpulse.storage import get_backend, set_backend
+from powerpulse.synthetic import generate_trace
+
+from conftest import history_arrays
+
+
+def reference_statistics(timestamps, percentages, is_charging):
+    """The row-by-row implementation calculate_statistics replaced"""
+    timestamps = [int(value) for value in timestamps]
+    percentages = [float(value) for value in percentages]
+    is_charging = [bool(value) for value in is_charging]
+
+    stats = {
+        'average_discharge_rate': None,
+        'average_charge_rate': None,
+        'discharge_cycles': 0,
+        'full_charges': 0,
+        'average_daily_usage': None,
+        'longest_session': None,
+        'median_session': None
+    }
+    if not timestamps:
+        return stats
+
+    discharged = discharge_hours = 0.0
+    charged = charge_hours = 0.0
+    for i in range(1, len(timestamps)):
+        time_diff = timestamps[i] - timestamps[i-1]
+        if time_diff <= 0 or time_diff > MAX_SAMPLE_GAP_MS:
+            continue
+        percentage_diff = percentages[i] - percentages[i-1]
+        if is_charging[i]:
+            charge_hours += time_diff / MS_PER_HOUR
+            if percentage_diff > 0:
+                charged += percentage_diff
+        else:
+            discharge_hours += time_diff / MS_PER_HOUR
+            if percentage_diff < 0:
+                discharged -= percentage_diff
+    stats['average_discharge_rate'] = discharged / discharge_hours if discharged > 0 else None
+    stats['average_charge_rate'] = charged / charge_hours if charged > 0 else None
+
+    for i in range(1, len(is_charging)):
+        if not is_charging[i-1] and is_charging[i]:
+            stats['discharge_cycles'] += 1
+
+    for i in range(1, len(percentages)):
+        if is_charging[i] and percentages[i] >= FULL_CHARGE_LEVEL and percentages[i-1] < FULL_CHARGE_LEVEL:
+            stats['full_charges'] += 1
+
+    if len(timestamps) >= 2:
+        total_days = (timestamps[-1] - timestamps[0]) / MS_PER_DAY
+        if total_days > 0:
+            total_discharge = 0
+            for i in range(1, len(percentages)):
+                diff = percentages[i] - percentages[i-1]
+                if diff < 0:
+                    total_discharge -= diff
+            stats['average_daily_usage'] = total_discharge / total_days
+
+        sessions = []
+        session_start = None
+        for i in range(len(is_charging)):
+            if not is_charging[i]:
+                if session_start is None:
+                    session_start = timestamps[i]
+            elif session_start is not None:
+                sessions.append(timestamps[i] - session_start)
+                session_start = None
+        if session_start is not None:
+            sessions.append(timestamps[-1] - session_start)
+        stats['longest_session'] = max(sessions) / MS_PER_HOUR if sessions else 0
+        stats['median_session'] = float(np.median(sessions)) / MS_PER_HOUR if sessions else 0
+
+    return stats
+
+
+def assert_same(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        if value is None:
+            assert actual[key] is None, key
+        else:
+            assert actual[key] == pytest.approx(value, rel=1e-9, abs=1e-9), key
+
+
+def statistics_of(history):
+    context = AnalysisContext(days=7, history=history)
+    return calculate_statistics(7, context=context)
+
+
+def random_trace(seed, rows=2000):
+    """Random walk with flips of charging state, gaps and missing readings"""
+    rng = np.random.default_rng(seed)
+    steps = rng.choice([30000, 60000, 61000, MAX_SAMPLE_GAP_MS, MAX_SAMPLE_GAP_MS + 1, 3 * 3600000],
+                       size=rows, p=[0.5, 0.3, 0.1, 0.04, 0.03, 0.03])
+    timestamps = 1_700_000_000_000 + np.cumsum(steps)
+    charging = np.cumsum(rng.random(rows) < 0.02) % 2 == 1
+    percentages = np.clip(np.round(np.cumsum(np.where(charging, 0.6, -0.4)
+                                             + rng.normal(0, 0.3, rows)) % 100 + 1, 1), 0, 100)
+    percentages[rng.random(rows) < 0.01] = np.nan
+    return timestamps, percentages, charging
+
+
+@pytest.fixture(autouse=True)
+def no_result_cache(data_dir):
+    # Different traces can share a cache key (same backend and bounds)
+    cache.get_cache().enabled = False
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_matches_loop_on_synthetic_traces(seed):
+    trace = generate_trace(days=7, interval=60, seed=seed)
+    history = history_arrays(trace['timestamp'], trace['percentage'], trace['is_charging'])
+    expected = reference_statistics(trace['timestamp'], trace['percentage'], trace['is_charging'])
+    assert_same(statistics_of(history), expected)
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_matches_loop_on_random_traces(seed):
+    timestamps, percentages, charging = random_trace(seed)
+    expected = reference_statistics(timestamps, percentages, charging)
+    assert_same(statistics_of(history_arrays(timestamps, percentages, charging)), expected)
+
+
+@pytest.mark.parametrize('rows', [
+    [],
+    [(0, 50.0, False)],
+    [(0, 50.0, True)],
+    [(0, 90.0, True), (60000, 95.0, True), (120000, 99.5, True), (180000, 100.0, True)],
+    [(0, 80.0, False), (MAX_SAMPLE_GAP_MS + 1, 70.0, False), (MAX_SAMPLE_GAP_MS + 60001, 69.0, False)],
+    [(0, 80.0, False), (MAX_SAMPLE_GAP_MS, 70.0, False), (2 * MAX_SAMPLE_GAP_MS, 75.0, True)],
+    [(0, 99.0, True), (60000, 99.6, True), (120000, 99.0, True), (180000, 99.7, True)],
+    [(0, 50.0, False), (60000, math.nan, False), (120000, 48.0, True), (180000, 49.0, False)],
+], ids=['empty', 'single-discharging', 'single-charging', 'all-charging', 'gap-over-limit',
+        'gap-at-limit', 'repeated-full', 'missing-percentage'])
+def test_matches_loop_on_edge_cases(rows):
+    timestamps = [row[0] for row in rows]
+    percentages = [row[1] for row in rows]
+    charging = [row[2] for row in rows]
+    expected = reference_statistics(timestamps, percentages, charging)
+    assert_same(statistics_of(history_arrays(timestamps, percentages, charging)), expected)
+
+
+def test_loads_the_window_from_storage(data_dir):
+    from powerpulse.storage import get_backend
+
+    trace = generate_trace(days=3, interval=60, seed=3)
+    get_backend().append_arrays(trace)
+    get_backend().flush()
+
+    history = get_backend().read_range(None, columns=('timestamp', 'percentage', 'is_charging'))
+    expected = reference_statistics(history['timestamp'], history['percentage'], history['is_charging'])
+    assert_same(calculate_statistics(7), expected)
+
+
+# Session statistics
+
+SESSION_KEYS = ('discharge_cycles', 'full_charges', 'longest_session', 'median_session')
+
+
+def assert_sessions_agree(days):
+    sessions = session_statistics(days)
+    expected = calculate_statistics(days)
+    assert_same({key: sessions[key] for key in SESSION_KEYS}, {key: expected[key] for key in SESSION_KEYS})
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'log'])
+def test_session_statistics_agree(trace, backend):
+    set_backend(backend)
+    get_backend().append_arrays(trace)
+    get_backend().flush()
+
+    for days in (0.1, 0.5, 1, 2.5, 4, 7, 10, 30):
+        assert_sessions_agree(days)
+
+
+def test_session_statistics_follow_new_samples(trace):
+    database.import_history(trace)
+    newest = int(trace['timestamp'][-1])
+    percentage = float(trace['percentage'][-1])
+    # Charge to full and back down, a few samples at a time
+    for i in range(1, 121):
+        charging = 30 <= i < 90
+        percentage = min(100.0, percentage + 1.5) if charging else max(0.0, percentage - 0.5)
+        database.save_battery_info({'timestamp': newest + i * 60000, 'percentage': percentage,
+                                    'is_charging': charging, 'power_plugged': charging,
+                                    'temperature': None, 'remaining_time': None})
+        if i % 7 == 0:
+            for days in (0.2, 1, 7):
+                assert_sessions_agree(days)
+
+
+def test_session_statistics_empty():
+    assert session_statistics(7) == {'discharge_cycles': 0, 'full_charges': 0, 'longest_session': None,
+                                     'median_session': None, 'battery_sessions': 0}
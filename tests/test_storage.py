@@ -0,0 +1,168 @@
+"""Tests for the storage backends in powerpulse.storage"""
+
+import numpy as np
+import pytest
+
+from powerpulse import database, storage
+from powerpulse.database import HISTORY_COLUMNS, HISTORY_ARRAY_DTYPES
+from powerpulse.storage import LogBackend, SQLiteBackend, LOG_HEADER, LOG_RECORD_DTYPE
+
+
+def sample(timestamp, percentage=50.0, charging=False, temperature=None, remaining_time=None):
+    return {'timestamp': timestamp, 'percentage': percentage, 'is_charging': charging,
+            'power_plugged': charging, 'temperature': temperature, 'remaining_time': remaining_time}
+
+
+def assert_arrays_equal(actual, expected, columns=HISTORY_COLUMNS):
+    assert list(actual) == list(columns)
+    for name in columns:
+        assert actual[name].dtype == HISTORY_ARRAY_DTYPES[name], name
+        np.testing.assert_array_equal(actual[name], np.asarray(expected[name], dtype=HISTORY_ARRAY_DTYPES[name]),
+                                      err_msg=name)
+
+
+def assert_rows_close(actual, expected):
+    assert len(actual) == len(expected)
+    for got, want in zip(actual, expected):
+        assert got == pytest.approx(want, rel=1e-6), got[0]
+
+
+@pytest.fixture
+def log(data_dir):
+    backend = LogBackend(str(data_dir / 'history.ppl'))
+    yield backend
+    backend.close()
+
+
+def reopen(backend):
+    backend.close()
+    return LogBackend(backend.path)
+
+
+def test_append_and_reopen(log):
+    # Every field holds a newline byte; the records must come back unchanged
+    samples = [sample(0x0A0A0A0A0A, 1.0, True, 1.0, 10.0),
+               sample(0x0A0A0A0A0A + 0x0A, None, False, None, None),
+               sample(0x0A0A0A0A0A + 0x0A0A, 100.0, True, 25.7, 3600.0)]
+    for info in samples:
+        assert log.append(info)
+    expected = {
+        'timestamp': [info['timestamp'] for info in samples],
+        'percentage': [1.0, np.nan, 100.0],
+        'is_charging': [True, False, True],
+        'power_plugged': [True, False, True],
+        'temperature': [1.0, np.nan, 25.7],
+        'remaining_time': [10.0, np.nan, 3600.0],
+    }
+    assert_arrays_equal(log.read_range(), expected)
+
+    log = reopen(log)
+    assert_arrays_equal(log.read_range(), expected)
+    assert log.bounds() == (samples[0]['timestamp'], samples[-1]['timestamp'])
+    log.close()
+
+
+def test_timestamps_stay_increasing(log):
+    log.append(sample(5000))
+    log.append(sample(4000))
+    log.append(sample(5001))
+    assert log.read_range()['timestamp'].tolist() == [5000, 5001, 5002]
+
+    with pytest.raises(ValueError):
+        log.append_arrays({name: values[:2] for name, values in log.read_range().items()})
+
+
+def test_reopen_drops_a_partial_record(log):
+    log.append(sample(1000))
+    log.append(sample(2000))
+    log.close()
+    with open(log.path, 'ab') as f:
+        f.write(b'\n' * (LOG_RECORD_DTYPE.itemsize - 1))
+
+    log = LogBackend(log.path)
+    assert log.read_range()['timestamp'].tolist() == [1000, 2000]
+    log.append(sample(1500))
+    assert log.read_range()['timestamp'].tolist() == [1000, 2000, 2001]
+    log.close()
+
+
+def test_rejects_other_files(data_dir):
+    path = data_dir / 'other.ppl'
+    path.write_bytes(b'\0' * (LOG_HEADER.size + LOG_RECORD_DTYPE.itemsize))
+    with pytest.raises(ValueError):
+        LogBackend(str(path)).read_range()
+
+
+def test_read_range_slices(log, trace):
+    log.append_arrays(trace)
+    expected = log.read_range()
+    timestamps = expected['timestamp']
+    assert len(timestamps) == len(trace['timestamp'])
+
+    rng = np.random.default_rng(9)
+    for start, end in [(None, None), (int(timestamps[100]), None), (None, int(timestamps[100]))] + [
+            tuple(sorted(int(value) for value in rng.integers(timestamps[0] - 1000, timestamps[-1] + 1000, 2)))
+            for _ in range(30)]:
+        mask = np.ones(len(timestamps), dtype=bool)
+        if start is not None:
+            mask &= timestamps >= start
+        if end is not None:
+            mask &= timestamps < end
+        columns = ('timestamp', 'percentage', 'is_charging')
+        assert_arrays_equal(log.read_range(start, end, columns), {name: expected[name][mask] for name in columns},
+                            columns)
+
+    with pytest.raises(ValueError):
+        log.read_range(columns=('timestamp', 'voltage'))
+
+
+def test_matches_sqlite(log, trace):
+    log.append_arrays(trace)
+    sqlite = SQLiteBackend()
+    sqlite.append_arrays(trace)
+    sqlite.flush()
+
+    assert_arrays_equal(log.read_range(), sqlite.read_range())
+    assert log.bounds() == sqlite.bounds()
+    now = database.now_epoch_ms()
+    for days, max_points in ((1, 100), (3, 200), (7, 500), (10, 20), (2, 5000)):
+        start = now - days * database.ROLLUP_WIDTH_MS['day']
+        for end in (None, now - database.ROLLUP_WIDTH_MS['day'] // 3):
+            assert_arrays_equal(log.read_range(start, end, max_points=max_points),
+                                sqlite.read_range(start, end, max_points=max_points))
+    for resolution in database.ROLLUP_RESOLUTIONS:
+        assert_rows_close(log.read_rollups(3, resolution), sqlite.read_rollups(3, resolution))
+    # The log keeps percentages as float32, so they differ in the last bits
+    assert_rows_close(log.read_sessions(), sqlite.read_sessions())
+
+
+def test_retention_rewrites_the_log(log, trace):
+    log.append_arrays(trace)
+    threshold = database.days_ago_epoch_ms(4)
+    expected = int((trace['timestamp'] < threshold).sum())
+
+    assert log.apply_retention(4) == expected
+    assert log.read_range()['timestamp'].min() >= threshold
+    assert len(log.read_range()['timestamp']) == len(trace['timestamp']) - expected
+    log.append(sample(database.now_epoch_ms()))
+    assert len(reopen(log).read_range()['timestamp']) == len(trace['timestamp']) - expected + 1
+
+
+def test_backend_follows_the_setting(data_dir):
+    assert isinstance(storage.get_backend(), SQLiteBackend)
+    storage.set_backend('log')
+    assert isinstance(storage.get_backend(), LogBackend)
+    with pytest.raises(ValueError):
+        storage.set_backend('csv')
+
+
+def test_backends_implement_the_whole_interface():
+    class Partial(storage.StorageBackend):
+        def append(self, battery_info):
+            return True
+
+    with pytest.raises(TypeError, match='read_range'):
+        Partial()
+    with pytest.raises(TypeError):
+        storage.StorageBackend()
+    assert not SQLiteBackend.__abstractmethods__ and not LogBackend.__abstractmethods__